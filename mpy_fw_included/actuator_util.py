@@ -0,0 +1,160 @@
+# actuator_util.py
+# pin actuation on the second core of the RP2040, shared by the controller firmwares
+import time
+import machine
+from array import array
+
+try:
+    import _thread
+except ImportError:
+    _thread = None
+
+# RP2040 SIO registers, a write to GPIO_OUT_XOR flips all the masked outputs in the same clock cycle
+SIO_BASE = 0xD0000000
+GPIO_OUT = SIO_BASE + 0x010
+GPIO_OUT_SET = SIO_BASE + 0x014
+GPIO_OUT_CLR = SIO_BASE + 0x018
+GPIO_OUT_XOR = SIO_BASE + 0x01C
+
+ACTUATION_QUEUE_SIZE = 32
+# the mean latency is a moving average over about 2^4 actuations, kept scaled by 2^4 so it stays a small int
+LATENCY_MEAN_SHIFT = 4
+
+
+# write the set and clear masks to the SIO output registers, the pins that change are flipped together with
+# one GPIO_OUT_XOR write so the rising and falling edges of all pins happen in the same clock cycle
+def write_pin_masks(set_mask, clear_mask):
+    if not set_mask:
+        machine.mem32[GPIO_OUT_CLR] = clear_mask
+    elif not clear_mask:
+        machine.mem32[GPIO_OUT_SET] = set_mask
+    else:
+        out = machine.mem32[GPIO_OUT]
+        machine.mem32[GPIO_OUT_XOR] = (set_mask & ~out) | (clear_mask & out)
+
+
+# the viper versions are used when the native emitter is available
+write_pin_masks_python = write_pin_masks
+try:
+    from native_util import write_pin_masks
+except (ImportError, SyntaxError, ValueError):
+    pass
+
+
+# core0 parses the commands and saves the state, the pin writes are queued in a lock-protected ring buffer and
+# applied by a tight loop on core1, so a slow USB write or a flash save does not delay the actuation
+# without _thread, or before start(), the masks are written directly
+# each pin that changes is recorded in the event log with the command_id set by core0 for the current command
+class Actuator:
+    def __init__(self, size=ACTUATION_QUEUE_SIZE, events=None):
+        self.size = size
+        self.set_masks = array("I", [0] * size)
+        self.clear_masks = array("I", [0] * size)
+        # time.ticks_us() when the entry was queued
+        self.submit_times = array("i", [0] * size)
+        self.command_ids = array("I", [0] * size)
+        self.command_id = 0
+        self.events = events
+        self.head = 0  # next entry written by core0
+        # next entry applied by core1, it advances once the entry is written and logged
+        self.tail = 0
+        self.lock = _thread.allocate_lock() if _thread else None
+        self.running = False
+        # command to pin latency of the applied entries in microseconds
+        self.count = 0
+        self.last_us = 0
+        self.max_us = 0
+        self.mean_scaled = 0
+
+    def start(self):
+        if _thread is None or self.running:
+            return
+        self.running = True
+        _thread.start_new_thread(self.run, ())
+
+    def stop(self):
+        self.running = False
+
+    # queue the masks for core1, waits while the ring buffer is full
+    def submit(self, set_mask, clear_mask):
+        if not self.running:
+            start = time.ticks_us()
+            self.apply(set_mask, clear_mask, self.command_id)
+            self.record(time.ticks_diff(time.ticks_us(), start))
+            return
+        while True:
+            self.lock.acquire()
+            head = self.head
+            next_head = (head + 1) % self.size
+            if next_head != self.tail:
+                self.set_masks[head] = set_mask
+                self.clear_masks[head] = clear_mask
+                self.submit_times[head] = time.ticks_us()
+                self.command_ids[head] = self.command_id
+                self.head = next_head
+                self.lock.release()
+                return
+            self.lock.release()
+
+    # queue a single pin value
+    def write_pin(self, pin_id, value):
+        if value:
+            self.submit(1 << pin_id, 0)
+        else:
+            self.submit(0, 1 << pin_id)
+
+    # wait until core1 applied and logged all queued entries, e.g. before the pin values are read for a save or
+    # core0 writes the event log
+    def wait_idle(self):
+        while self.running and self.tail != self.head:
+            pass
+
+    # actuation loop on core1, it does not allocate so it never waits for the garbage collector
+    # core0 does not write the entry at tail until tail advances, so it is read without the lock
+    def run(self):
+        while self.running:
+            tail = self.tail
+            if tail == self.head:
+                continue
+            self.apply(
+                self.set_masks[tail], self.clear_masks[tail], self.command_ids[tail]
+            )
+            self.record(time.ticks_diff(time.ticks_us(), self.submit_times[tail]))
+            self.lock.acquire()
+            self.tail = (tail + 1) % self.size
+            self.lock.release()
+
+    # write the masks and log the pins that changed
+    def apply(self, set_mask, clear_mask, command_id):
+        old = machine.mem32[GPIO_OUT]
+        write_pin_masks(set_mask, clear_mask)
+        if self.events is None:
+            return
+        changed = ((old | set_mask) & ~clear_mask) ^ old
+        pin = 0
+        while changed:
+            if changed & 1:
+                old_value = (old >> pin) & 1
+                self.events.record(pin, old_value, old_value ^ 1, command_id)
+            changed >>= 1
+            pin += 1
+
+    def record(self, latency_us):
+        self.count += 1
+        self.last_us = latency_us
+        if self.count == 1:
+            self.mean_scaled = latency_us << LATENCY_MEAN_SHIFT
+        else:
+            self.mean_scaled += latency_us - (self.mean_scaled >> LATENCY_MEAN_SHIFT)
+        if latency_us > self.max_us:
+            self.max_us = latency_us
+
+    def report(self, output):
+        output.add(b"Info: Latency: core1: ")
+        output.add(b"running" if self.running else b"stopped")
+        output.add(b", actuations: ").add_int(self.count)
+        output.add(b", last: ").add_int(self.last_us)
+        output.add(b" us, mean: ").add_int(self.mean_scaled >> LATENCY_MEAN_SHIFT)
+        output.add(b" us, max: ").add_int(self.max_us)
+        output.add(b" us, queued: ").add_int((self.head - self.tail) % self.size)
+        output.end_line()
@@ -0,0 +1,160 @@
+# adc_util.py
+# ADC acquisition by DMA streamed to the host in binary blocks, used by the potentiostat firmware
+import time
+import rp2
+import machine
+import uctypes
+from array import array
+
+# RP2040 ADC registers
+ADC_BASE = 0x4004C000
+ADC_CS = ADC_BASE + 0x00
+ADC_FCS = ADC_BASE + 0x08
+ADC_FIFO = ADC_BASE + 0x0C
+ADC_DIV = ADC_BASE + 0x10
+ADC_CS_EN = 1 << 0
+ADC_CS_TS_EN = 1 << 1  # temperature sensor, channel 4
+ADC_CS_START_MANY = 1 << 3
+ADC_FCS_EN = 1 << 0
+ADC_FCS_DREQ_EN = 1 << 3
+ADC_FCS_THRESH_1 = 1 << 24
+DREQ_ADC = 36
+ADC_CLOCK = 48_000_000
+ADC_MIN_CYCLES = 96  # of a conversion
+ADC_CHANNELS = 5
+# conversions per second of all channels together, limited by the USB throughput
+ADC_MAX_RATE = 100_000
+# conversions per block, each one 2 bytes, a power of 2 so the DMA write address wraps to the start of its buffer
+ADC_BLOCK_SAMPLES = 1024
+# DMA abort register
+DMA_CHAN_ABORT = 0x50000444
+
+
+# the ADC converts the channels in round-robin at a fixed rate into its FIFO, two DMA channels chained to each other
+# move the conversions into two buffers in turn, so one buffer is sent while the other is filled, the write address
+# of each channel wraps to the start of its buffer (the buffers are aligned to their size), so the CPU only sends
+# the blocks: a hard interrupt counts the completed blocks and records their time.ticks_us()
+# a block is sent as a header line followed by its bytes:
+# "ADC block: seq 12, time 123456789, bytes 2048" then 1024 little-endian uint16 conversions
+# a block whose buffer was refilled while it was written to the USB is followed by "ADC block overwritten: seq 12"
+class AdcStream:
+    def __init__(self, block_samples=ADC_BLOCK_SAMPLES):
+        self.block_bytes = 2 * block_samples
+        # log2 of the block size, the size of the DMA write ring
+        self.ring = self.block_bytes.bit_length() - 1
+        self.buffers = []
+        self.addresses = []  # of the aligned blocks
+        self.views = []
+        for _ in range(2):
+            # twice the size, so an aligned block fits in it
+            buf = bytearray(2 * self.block_bytes)
+            address = uctypes.addressof(buf)
+            start = -address % self.block_bytes
+            self.buffers.append(buf)
+            self.addresses.append(address + start)
+            self.views.append(memoryview(buf)[start : start + self.block_bytes])
+        self.dmas = (rp2.DMA(), rp2.DMA())
+        self.completed = 0  # blocks completed, written by the interrupt handler
+        self.times = array("i", [0] * 4)  # time.ticks_us() of the last completed blocks
+        self.sent = 0
+        self.dropped = 0  # blocks overwritten before they were sent
+        self.running = False
+        self.channels = []
+        self.rate = 0  # conversions per second of all channels
+        self.start_time = 0
+
+    # interrupt handler of both channels, the buffer of the block is refilled two blocks later
+    def block_done(self, dma):
+        self.times[self.completed % 4] = time.ticks_us()
+        self.completed += 1
+
+    # convert the channels (0 to 3, 4 is the temperature sensor) rate times per second each
+    # returns the time.ticks_us() of the start
+    def start(self, channels, rate):
+        channels = sorted(set(channels))
+        if not channels or channels[0] < 0 or channels[-1] >= ADC_CHANNELS:
+            raise ValueError(f"channels must be 0 to {ADC_CHANNELS - 1}")
+        total = rate * len(channels)
+        if not 0 < total <= ADC_MAX_RATE:
+            raise ValueError(f"rate times channels must be at most {ADC_MAX_RATE} Hz")
+        div = round((ADC_CLOCK / total - 1) * 256)
+        if div < (ADC_MIN_CYCLES - 1) * 256 or div >= 1 << 24:
+            raise ValueError(
+                f"rate times channels must be at least {ADC_CLOCK // (1 << 16) + 1} Hz"
+            )
+        self.stop()
+        mask = 0
+        for channel in channels:
+            # the pins of channels 0 to 3 are set up as analog inputs
+            machine.ADC(channel)
+            mask |= 1 << channel
+        for i in range(2):
+            dma = self.dmas[i]
+            dma.config(
+                read=ADC_FIFO,
+                write=self.addresses[i],
+                count=self.block_bytes // 2,
+                ctrl=dma.pack_ctrl(
+                    size=1,
+                    inc_read=False,
+                    inc_write=True,
+                    ring_size=self.ring,
+                    ring_sel=True,
+                    treq_sel=DREQ_ADC,
+                    chain_to=self.dmas[1 - i].channel,
+                    irq_quiet=False,
+                ),
+            )
+            dma.irq(self.block_done, hard=True)
+        self.completed = 0
+        self.sent = 0
+        self.dropped = 0
+        self.channels = channels
+        self.rate = ADC_CLOCK * 256 / (div + 256)
+        self.dmas[0].active(1)
+        machine.mem32[ADC_DIV] = div
+        machine.mem32[ADC_FCS] = ADC_FCS_EN | ADC_FCS_DREQ_EN | ADC_FCS_THRESH_1
+        cs = ADC_CS_EN | (channels[0] << 12) | (mask << 16) | ADC_CS_START_MANY
+        if 4 in channels:
+            cs |= ADC_CS_TS_EN
+        self.start_time = time.ticks_us()
+        machine.mem32[ADC_CS] = cs
+        self.running = True
+        return self.start_time
+
+    # called by the command loop, sends the last completed block, the older ones were overwritten
+    def send(self, output):
+        completed = self.completed
+        if self.sent == completed:
+            return
+        if completed - self.sent > 1:
+            self.dropped += completed - 1 - self.sent
+            self.sent = completed - 1
+        seq = self.sent
+        output.add(b"ADC block: seq ").add_int(seq)
+        output.add(b", time ").add_int(self.times[seq % 4])
+        output.add(b", bytes ").add_int(self.block_bytes).end_line()
+        output.stream.write(self.views[seq % 2])
+        self.sent = seq + 1
+        # the buffer is refilled by block seq + 2, its channel may be running before the interrupt counts seq + 1
+        if self.completed - seq >= 2 or self.dmas[seq % 2].active():
+            self.dropped += 1
+            output.add(b"ADC block overwritten: seq ").add_int(seq).end_line()
+
+    # stop the conversions and the DMA, the partial block is not sent
+    def stop(self):
+        if not self.running:
+            return
+        machine.mem32[ADC_CS] = ADC_CS_EN
+        # the channels are disabled first so the abort does not trigger the chained channel (RP2040-E13)
+        for dma in self.dmas:
+            dma.active(0)
+        mask = (1 << self.dmas[0].channel) | (1 << self.dmas[1].channel)
+        machine.mem32[DMA_CHAN_ABORT] = mask
+        while machine.mem32[DMA_CHAN_ABORT] & mask:
+            pass
+        machine.mem32[ADC_FCS] = 0
+        # drain the FIFO, its level is in FCS[19:16]
+        while (machine.mem32[ADC_FCS] >> 16) & 0xF:
+            machine.mem32[ADC_FIFO]
+        self.running = False
@@ -2,31 +2,52 @@ import os
 import sys
 import time
 import json
-import select
 import machine
-from bootloader_util import set_bootloader_mode
+from bootloader_util import set_bootloader_mode, mark_ready, boot_summary
+from output_util import OutputBuffer, HeapMonitor
+from input_util import LineReader
+from event_util import EventLog
+from stepper_util import Stepper, STEPPER_TIMEOUT_MARGIN_MS
+from planner_util import plan_visit, parse_constraints
+from journal_util import RecordJournal
+from bench_util import bench_native
 
 # this is a program to control a stepper motor
 MAX_POSITION = 16000
 SLOTS_CONFIG_FILE = "autosampler_slot_config.json"
 STATUS_FILE = "autosampler_status.json"
+# the position and direction are appended to a journal of fixed records after every move instead of rewriting
+# the status file, the newest record overrides the position of the status file at boot
+POSITION_FILES = ("autosampler_position_0.bin", "autosampler_position_1.bin")
+position_journal = RecordJournal(POSITION_FILES, 2)
 PULSE_PIN = 12
 DIRECTION_PIN = 14
 ENABLE_PIN = 15
+# moves sent by the host while another move runs, started one after the other when it ends
+MOVE_QUEUE_SIZE = 8
+# preallocated buffer for the frequently polled responses and the heap statistics for the diag command
+output = OutputBuffer()
+heap_monitor = HeapMonitor()
+# pre-encoded direction names for the output buffer
+DIRECTION_BYTES = {0: b"Right", 1: b"Left"}
+# log of the pin changes for the events command, a move is logged as a change of the enable and direction pins
+# and one event of the pulse pin with the start and end positions
+events = EventLog()
 
 
 class Autosampler:
     def __init__(self, pulse_pin, direction_pin, enable_pin):
-        # Initialize pins
-        self.pulse = machine.Pin(
-            pulse_pin, machine.Pin.OUT, machine.Pin.PULL_UP, value=0
-        )
+        # Initialize pins, the pulses are generated by a PIO state machine
+        self.stepper = Stepper(pulse_pin)
         self.direction = machine.Pin(
             direction_pin, machine.Pin.OUT, machine.Pin.PULL_UP, value=0
         )
         self.enable = machine.Pin(
             enable_pin, machine.Pin.OUT, machine.Pin.PULL_UP, value=1
         )
+        self.pulse_pin_id = pulse_pin
+        self.direction_pin_id = direction_pin
+        self.enable_pin_id = enable_pin
 
         # Initialize autosampler state
         # current position of the autosampler, current_position = 0 is the rightmost position
@@ -44,8 +65,34 @@ class Autosampler:
         # power status of the autosampler
         self.is_power_on = False
 
-        # time interval between steps in milliseconds
+        # state of the current move, see move_auto_sampler
+        self.move_start_position = 0
+        self.move_steps = 0
+        self.move_predicted_us = 0
+        self.move_command = 0
+        self.last_stream = 0
+        # (method name, arguments) of the host moves, visits and calibrations waiting for the current one, see request
+        self.move_queue = []
+        # slots left in the current visit, None when no visit is running
+        self.visit_queue = None
+        self.visit_start = 0
+        # move time model, time = offset + scale * time predicted from the profile, fitted by calibrate
+        self.time_offset_us = 0
+        self.time_scale = 1.0
+        # positions left in the current calibration, None when no calibration is running, and the
+        # (predicted, actual) durations of its moves in microseconds
+        self.calibration_queue = None
+        self.calibration_samples = []
+        # interval of the position lines sent during a move, 0 to disable
+        self.stream_interval_ms = 200
+
+        # time interval between steps in milliseconds, the start rate of the moves
         self.time_interval_between_steps_ms = 5
+        # motion profile, acceleration in steps/s^2 (0 moves at the start rate, or the max speed if lower),
+        # max speed in steps/s and jerk in steps/s^3 (0 for a trapezoidal profile)
+        self.acceleration = 0
+        self.max_speed = 1000 // self.time_interval_between_steps_ms
+        self.jerk = 0
 
         self.rtc = machine.RTC()  # RTC setup
 
@@ -56,12 +103,29 @@ class Autosampler:
         self.load_config()
         self.load_status()
 
+    # the newline is written separately to avoid a new string
     def write_message(self, message) -> None:
-        sys.stdout.write(f"{message}\n")
+        sys.stdout.write(message)
+        sys.stdout.write("\n")
 
     def send_status(self) -> None:
-        status = f"Autosampler Status: position: {self.current_position}, direction: {self.direction_map[self.current_direction]}"
-        self.write_message(f"{status}")
+        output.add(b"Autosampler Status: position: ").add_int(self.current_position)
+        output.add(b", direction: ").add(DIRECTION_BYTES[self.current_direction])
+        output.end_line()
+
+    def diagnostics(self) -> None:
+        heap_monitor.report(output)
+
+    def dump_events(self) -> None:
+        events.dump(output)
+
+    def bench_native(self, iterations=1000) -> None:
+        try:
+            bench_native(output, int(iterations))
+        except ValueError:
+            self.write_message(
+                "Error: Invalid input, expected format '0:bench_native:iterations'"
+            )
 
     def send_config(self) -> None:
         # assemble in json format
@@ -70,7 +134,9 @@ class Autosampler:
         )
 
     def ping(self) -> None:
-        self.write_message(f"PING: Pico Autosampler Control Version {self.version}")
+        self.write_message(
+            f"PING: Pico Autosampler Control Version {self.version}, {boot_summary()}"
+        )
 
     def hard_reset(self) -> None:
         self.write_message("Success: Performing hard reset.")
@@ -83,6 +149,12 @@ class Autosampler:
                     "current_position": self.current_position,
                     "current_direction": self.current_direction,
                     "name": self.name,
+                    "acceleration": self.acceleration,
+                    "max_speed": self.max_speed,
+                    "jerk": self.jerk,
+                    "stream_interval_ms": self.stream_interval_ms,
+                    "time_offset_us": self.time_offset_us,
+                    "time_scale": self.time_scale,
                 }
                 json.dump(save_data, f)
         except Exception as e:
@@ -98,6 +170,16 @@ class Autosampler:
                     self.current_position = data.get("current_position", -1)
                     self.current_direction = data.get("current_direction", 1)
                     self.name = data.get("name", "Not Set")
+                    self.acceleration = data.get("acceleration", self.acceleration)
+                    self.max_speed = data.get("max_speed", self.max_speed)
+                    self.jerk = data.get("jerk", self.jerk)
+                    self.stream_interval_ms = data.get(
+                        "stream_interval_ms", self.stream_interval_ms
+                    )
+                    self.time_offset_us = data.get("time_offset_us", 0)
+                    self.time_scale = data.get("time_scale", 1.0)
+                    self.apply_profile()
+                self.load_position()
                 self.write_message(
                     f"Success: Status loaded: {self.current_position}, {self.current_direction}"
                 )
@@ -105,10 +187,26 @@ class Autosampler:
                 self.write_message(
                     "Warning: Status file not found. Initialized with defaults."
                 )
+                self.load_position()
                 self.save_status()
         except Exception as e:
             self.write_message(f"Error: Could not load status, {e}")
 
+    # append the position and direction to the position journal
+    def save_position(self) -> None:
+        try:
+            position_journal.append((self.current_position, self.current_direction))
+        except Exception as e:
+            self.write_message(f"Error: Could not save position, {e}")
+
+    def load_position(self) -> None:
+        try:
+            values = position_journal.load()
+            if values:
+                self.current_position, self.current_direction = values
+        except Exception as e:
+            self.write_message(f"Error: Could not load position, {e}")
+
     def save_config(self) -> None:
         try:
             with open(SLOTS_CONFIG_FILE, "w") as f:
@@ -146,9 +244,9 @@ class Autosampler:
     def get_time(self) -> None:
         try:
             year, month, day, _, hour, minute, second, _ = self.rtc.datetime()
-            self.write_message(
-                f"RTC Time: {year}-{month}-{day} {hour}:{minute}:{second}"
-            )
+            output.add(b"RTC Time: ").add_int(year).add(b"-").add_int(month)
+            output.add(b"-").add_int(day).add(b" ").add_int(hour)
+            output.add(b":").add_int(minute).add(b":").add_int(second).end_line()
         except Exception as e:
             self.write_message(f"Error: Could not get RTC time, {e}")
 
@@ -161,83 +259,432 @@ class Autosampler:
         except Exception as e:
             self.write_message(f"Error: Could not set RTC time, {e}")
 
-    def move_auto_sampler(self, steps) -> None:
+    # start a move of steps (positive to the left), the move runs on the PIO and the command loop keeps running,
+    # poll_move() ends it and finish_move() updates the position
+    # returns False when no move was started, finish_move() is not called then
+    def move_auto_sampler(self, steps) -> bool:
+        if self.stepper.moving:
+            self.write_message(
+                "Error: move_auto_sampler, a move is in progress, send stop first"
+            )
+            return False
+        self.move_start_position = self.current_position
+        self.move_command = heap_monitor.commands
         try:
+            old_direction = self.current_direction
             if steps > 0:
                 self.current_direction = 1  # move to the left
             else:
                 self.current_direction = 0  # move to the right
             self.direction.value(self.current_direction)
+            if self.current_direction != old_direction:
+                events.record(
+                    self.direction_pin_id,
+                    old_direction,
+                    self.current_direction,
+                    self.move_command,
+                )
 
             self.is_power_on = True
             self.enable.value(0)
-            for _ in range(abs(steps)):
-                self.pulse.value(0)
-                self.pulse.value(1)
-
-                self.current_position -= 1 * (1 - 2 * self.current_direction)
-                time.sleep_ms(self.time_interval_between_steps_ms)
-                if not self.is_power_on:
-                    break
-            self.save_status()
-            self.enable.value(1)
-            self.is_power_on = False
+            events.record(self.enable_pin_id, 1, 0, self.move_command)
+            self.move_steps = abs(steps)
+            if not steps:
+                self.finish_move(0)
+                return True
+            # the pulses are counted by the PIO, the position is updated from the pulses completed
+            self.move_predicted_us = self.stepper.start(abs(steps))
+            self.last_stream = time.ticks_ms()
         except Exception as e:
+            completed = self.stepper.abort() if self.stepper.moving else 0
             self.write_message(f"Error: move_auto_sampler, {e}")
-            self.enable.value(1)
-            self.is_power_on = False
+            self.finish_move(completed)
+        return True
+
+    # position during a move, from the pulses completed so far
+    def live_position(self) -> int:
+        if not self.stepper.moving:
+            return self.current_position
+        completed = self.stepper.completed()
+        return self.move_start_position + completed * (2 * self.current_direction - 1)
+
+    # called by the command loop, ends the move when the pulses are done or it overran its predicted duration,
+    # and streams the position every stream_interval_ms
+    def poll_move(self) -> None:
+        if not self.stepper.moving:
+            return
+        if self.stepper.done():
+            self.finish_move(self.stepper.finish())
+            return
+        timeout_ms = self.move_predicted_us // 1000 + STEPPER_TIMEOUT_MARGIN_MS
+        if self.stepper.elapsed_us() > timeout_ms * 1000:
+            self.finish_move(self.stepper.abort())
+            return
+        now = time.ticks_ms()
+        if (
+            self.stream_interval_ms
+            and time.ticks_diff(now, self.last_stream) >= self.stream_interval_ms
+        ):
+            self.last_stream = now
+            self.getCurrentPosition()
+
+    # update the position from the pulses completed, disable the driver and report the move
+    def finish_move(self, completed, stopped=False) -> None:
+        actual_us = self.stepper.elapsed_us() if self.move_steps else 0
+        self.current_position = self.move_start_position + completed * (
+            2 * self.current_direction - 1
+        )
+        events.record(
+            self.pulse_pin_id,
+            self.move_start_position,
+            self.current_position,
+            self.move_command,
+        )
+        self.save_position()
+        self.enable.value(1)
+        events.record(self.enable_pin_id, 0, 1, self.move_command)
+        self.is_power_on = False
+        if completed != self.move_steps and not stopped:
+            self.write_message(
+                f"Error: move_auto_sampler, move aborted after {completed} of {self.move_steps} steps"
+            )
+        if self.move_steps:
+            output.add(b"Info: Move: steps ").add_int(completed)
+            output.add(b", predicted ").add_int(self.move_predicted_us // 1000)
+            output.add(b" ms, actual ").add_int(actual_us // 1000)
+            output.add(b" ms").end_line()
+        self.write_message(
+            f"Info: moved to position {self.current_position} in {actual_us / 1000000} seconds. relative position: {self.current_position - self.move_start_position}"
+        )
+        self.getCurrentPosition()
+        completed_all = not stopped and completed == self.move_steps
+        if self.visit_queue is not None:
+            if not completed_all:
+                self.visit_queue = None
+                self.write_message("Error: visit aborted.")
+            else:
+                self.visit_next()
+        elif self.calibration_queue is not None:
+            if not completed_all:
+                self.calibration_queue = None
+                self.write_message("Error: calibration aborted.")
+            else:
+                self.calibration_samples.append((self.move_predicted_us, actual_us))
+                self.calibration_next()
+        if self.move_queue:
+            if not completed_all:
+                self.write_message(
+                    f"{'Info' if stopped else 'Error'}: {len(self.move_queue)} queued moves cancelled."
+                )
+                self.move_queue = []
+            # a queued move that does not start, e.g. to a deleted slot, is reported and skipped
+            while self.move_queue and not self.busy():
+                name, args = self.move_queue.pop(0)
+                getattr(self, name)(*args)
+
+    # a move, a visit or a calibration is running
+    def busy(self) -> bool:
+        return (
+            self.stepper.moving
+            or self.visit_queue is not None
+            or self.calibration_queue is not None
+        )
 
-    def move_to_position(self, position) -> None:
-        if position:
+    # the moveTo, moveToSlot, visit and calibrate commands, one sent while the autosampler is busy is queued as the
+    # name and arguments of the method that starts it, and started when the current one ends, so the moves the host
+    # sends back-to-back run in order, a stopped or aborted move cancels the queue
+    def request(self, label, name, *args) -> None:
+        if not self.busy():
+            getattr(self, name)(*args)
+            return
+        if len(self.move_queue) >= MOVE_QUEUE_SIZE:
+            self.write_message(
+                f"Error: The move queue is full ({MOVE_QUEUE_SIZE} moves), send stop first."
+            )
+            return
+        self.move_queue.append((name, args))
+        self.write_message(f"Info: {label} queued, {len(self.move_queue)} pending.")
+
+    def request_position(self, position) -> None:
+        self.request(f"Move to position {position}", "move_to_position", position)
+
+    def request_slot(self, slot) -> None:
+        self.request(f"Move to slot {slot}", "move_to_slot", slot)
+
+    # slots and constraints of the visit and plan commands, "1,rinse,waste" and "1<rinse,rinse<waste"
+    # returns the slots in the order with the least predicted travel time and that time, None on invalid input
+    def plan_slots(self, slots, constraints):
+        try:
+            positions = {}
+            for slot in slots.split(","):
+                slot = slot.strip()
+                if slot not in self.autosampler_config:
+                    raise ValueError(f"slot {slot} not found in the configuration")
+                positions[slot] = int(self.autosampler_config[slot])
+            return plan_visit(
+                self.current_position,
+                positions,
+                parse_constraints(constraints),
+                self.estimate_us,
+            )
+        except ValueError as e:
+            self.write_message(
+                f"Error: Invalid input, expected format 'visit:slot,slot,...:slot<slot,...', {e}"
+            )
+            return None
+
+    # report the order and the travel of a plan
+    def send_plan(self, order, predicted_us) -> None:
+        travel = 0
+        position = self.current_position
+        for slot in order:
+            travel += abs(int(self.autosampler_config[slot]) - position)
+            position = int(self.autosampler_config[slot])
+        self.write_message(
+            f"Info: Visit plan: {','.join(order)}, travel {travel} steps, predicted {predicted_us // 1000} ms"
+        )
+
+    # send the order with the least predicted travel time without moving
+    def plan(self, slots, constraints="") -> None:
+        plan = self.plan_slots(slots, constraints)
+        if plan:
+            self.send_plan(*plan)
+
+    # visit the slots in the order with the least predicted travel time, one move after the other, the order is
+    # planned from the position where the visit starts
+    def visit(self, slots, constraints="") -> None:
+        self.request(f"Visit of {slots}", "start_visit", slots, constraints)
+
+    def start_visit(self, slots, constraints) -> None:
+        plan = self.plan_slots(slots, constraints)
+        if not plan:
+            return
+        self.send_plan(*plan)
+        self.visit_queue = plan[0]
+        self.visit_start = time.ticks_ms()
+        self.visit_next()
+
+    # start the move to the next slot of the visit, called again by finish_move
+    def visit_next(self) -> None:
+        if not self.visit_queue:
+            self.visit_queue = None
+            elapsed_ms = time.ticks_diff(time.ticks_ms(), self.visit_start)
+            self.write_message(f"Info: Visit completed in {elapsed_ms} ms.")
+            return
+        # a slot deleted since the plan ends the visit, it must not resume on an unrelated move
+        if not self.move_to_slot(self.visit_queue.pop(0)):
+            self.visit_queue = None
+            self.write_message("Error: visit aborted.")
+
+    # duration of a move of steps in microseconds with the time model
+    def estimate_us(self, steps) -> int:
+        if not steps:
+            return 0
+        return int(
+            self.time_offset_us + self.time_scale * self.stepper.predict_us(steps)
+        )
+
+    # estimated duration of a move between two positions, for the host to plan its timing
+    # the slot names are often numbers, so the slots have their own command, estimateSlot
+    def estimate(self, start, end) -> None:
+        try:
+            start = max(0, min(int(start), MAX_POSITION))
+            end = max(0, min(int(end), MAX_POSITION))
+        except ValueError:
+            self.write_message(
+                "Error: Invalid input, expected format 'estimate:from_position:to_position'"
+            )
+            return
+        self.send_estimate(start, end)
+
+    # estimated duration of a move between two slots
+    def estimate_slot(self, start, end) -> None:
+        for slot in (start, end):
+            if slot not in self.autosampler_config:
+                self.write_message(f"Error: Slot {slot} not found in the configuration")
+                return
+        self.send_estimate(
+            int(self.autosampler_config[start]), int(self.autosampler_config[end])
+        )
+
+    def send_estimate(self, start, end) -> None:
+        output.add(b"INFO: Estimate: from ").add_int(start).add(b" to ").add_int(end)
+        output.add(b", steps ").add_int(abs(end - start))
+        output.add(b", time ").add_int(self.estimate_us(abs(end - start)) // 1000)
+        output.add(b" ms").end_line()
+
+    # move back and forth from the position where the calibration starts over each distance and fit the time model
+    # to the durations
+    def calibrate(self, distances="25,100,400,1600") -> None:
+        self.request("Calibration", "start_calibration", distances)
+
+    def start_calibration(self, distances) -> None:
+        try:
+            if self.current_position < 0:
+                raise ValueError("the position is unknown, set it first")
+            queue = []
+            for distance in distances.split(","):
+                distance = int(distance)
+                if distance <= 0 or distance > MAX_POSITION:
+                    raise ValueError(f"distance {distance} out of range")
+                target = self.current_position + distance
+                if target > MAX_POSITION:
+                    target = self.current_position - distance
+                if target < 0:
+                    raise ValueError(f"distance {distance} does not fit the axis")
+                queue.append(target)
+                queue.append(self.current_position)
+        except ValueError as e:
+            self.write_message(
+                f"Error: Invalid input, expected format 'calibrate:distance,distance,...', {e}"
+            )
+            return
+        self.write_message(f"Info: Calibration: {len(queue)} moves.")
+        self.calibration_queue = queue
+        self.calibration_samples = []
+        self.calibration_next()
+
+    # start the next calibration move, or fit the model after the last one
+    def calibration_next(self) -> None:
+        if self.calibration_queue:
+            if not self.move_to_position(self.calibration_queue.pop(0)):
+                self.calibration_queue = None
+                self.write_message("Error: calibration aborted.")
+            return
+        self.calibration_queue = None
+        # least squares fit of actual = offset + scale * predicted
+        samples = self.calibration_samples
+        n = len(samples)
+        mean_predicted = sum(sample[0] for sample in samples) / n
+        mean_actual = sum(sample[1] for sample in samples) / n
+        variance = sum((sample[0] - mean_predicted) ** 2 for sample in samples)
+        if variance:
+            covariance = sum(
+                (sample[0] - mean_predicted) * (sample[1] - mean_actual)
+                for sample in samples
+            )
+            self.time_scale = covariance / variance
+        else:
+            self.time_scale = 1.0
+        self.time_offset_us = int(mean_actual - self.time_scale * mean_predicted)
+        max_error_us = max(
+            abs(self.time_offset_us + self.time_scale * sample[0] - sample[1])
+            for sample in samples
+        )
+        self.save_status()
+        self.write_message(
+            f"Info: Calibration: samples {n}, offset {self.time_offset_us / 1000:.1f} ms, scale {self.time_scale:.4f}, max error {max_error_us / 1000:.1f} ms"
+        )
+
+    def getTimeModel(self) -> None:
+        self.write_message(
+            f"INFO: Time model: offset {self.time_offset_us / 1000:.1f} ms, scale {self.time_scale:.4f}"
+        )
+
+    # abort the current move, the position is kept at the pulses completed
+    def stop(self) -> None:
+        if not self.stepper.moving:
+            self.write_message("Info: No move in progress.")
+            return
+        self.finish_move(self.stepper.abort(), stopped=True)
+        self.write_message(f"Success: Move stopped at position {self.current_position}")
+
+    def setStreamInterval(self, interval_ms) -> None:
+        try:
+            interval_ms = int(interval_ms)
+            if interval_ms < 0:
+                raise ValueError("interval must be positive")
+        except ValueError as e:
+            self.write_message(
+                f"Error: Invalid input, expected format 'setStreamInterval:interval_ms', {e}"
+            )
+            return
+        self.stream_interval_ms = interval_ms
+        self.save_status()
+        self.write_message(
+            f"SUCCESS: Position stream interval set to: {interval_ms} ms"
+        )
+
+    # precompute the step intervals of the acceleration ramp
+    def apply_profile(self) -> None:
+        self.stepper.set_profile(
+            1000 / self.time_interval_between_steps_ms,
+            self.max_speed,
+            self.acceleration,
+            self.jerk,
+        )
+
+    def setProfile(self, acceleration, max_speed, jerk="0") -> None:
+        try:
+            acceleration = int(acceleration)
+            max_speed = int(max_speed)
+            jerk = int(jerk)
+            if acceleration < 0 or max_speed <= 0 or jerk < 0:
+                raise ValueError("values must be positive")
+        except ValueError as e:
+            self.write_message(
+                f"Error: Invalid profile, expected format 'setProfile:acceleration:max_speed:jerk', {e}"
+            )
+            return
+        self.acceleration = acceleration
+        self.max_speed = max_speed
+        self.jerk = jerk
+        self.apply_profile()
+        self.save_status()
+        self.getProfile()
+
+    def getProfile(self) -> None:
+        output.add(b"INFO: Profile: acceleration ").add_int(self.acceleration)
+        output.add(b" steps/s^2, max speed ").add_int(self.max_speed)
+        output.add(b" steps/s, jerk ").add_int(self.jerk)
+        output.add(b" steps/s^3, ramp ").add_int(len(self.stepper.ramp))
+        output.add(b" steps").end_line()
+
+    # returns False when no move was started, see move_auto_sampler
+    def move_to_position(self, position) -> bool:
+        # the slots pass an int, position 0 is valid
+        if position or position == 0:
             position = int(position)
             # clamp position to valid range
             position = max(0, min(position, MAX_POSITION))
 
-            initial_position = self.current_position
-            start_time = time.ticks_us()
-            self.move_auto_sampler(position - self.current_position)
-            end_time = time.ticks_us()
-            self.write_message(
-                f"Info: moved to position {position} in {time.ticks_diff(end_time, start_time) / 1000000} seconds. relative position: {position - initial_position}"
-            )
+            return self.move_auto_sampler(position - self.current_position)
         else:
             self.write_message("Error: Invalid position input.")
+            return False
 
-    def move_to_slot(self, slot) -> None:
+    def move_to_slot(self, slot) -> bool:
         if slot:
             if slot not in self.autosampler_config:
                 self.write_message(f"Error: Slot {slot} not found in the configuration")
-                return
+                return False
             position = int(self.autosampler_config[slot])
-
-            initial_position = self.current_position
-            start_time = time.ticks_us()
-            self.move_to_position(position)
-            end_time = time.ticks_us()
-            self.write_message(
-                f"Info: moved to slot {slot} in {time.ticks_diff(end_time, start_time) / 1000000} seconds. relative position: {position - initial_position}"
-            )
+            self.write_message(f"Info: Moving to slot {slot} at position {position}.")
+            return self.move_to_position(position)
         else:
             self.write_message(
                 f"Error: Invalid slot input, available slots: {list(self.autosampler_config.keys())}"
             )
+            return False
 
     def shutdown(self) -> None:
         self.move_auto_sampler(-self.current_position)
-        self.current_position = 0
-        self.write_message("Success: Autosampler position reset to initial position.")
+        self.write_message("Success: Autosampler returning to initial position.")
 
     def setCurrentPosition(self, position) -> None:
-        if position:
+        if self.stepper.moving:
+            self.write_message("Error: A move is in progress, send stop first.")
+        elif position:
             new_position = max(0, min(int(position), MAX_POSITION))
             self.current_position = new_position
-            self.save_config()
+            self.save_position()
             self.write_message(f"SUCCESS: Position set to: {self.current_position}")
         else:
             self.write_message("Error: Invalid position input.")
 
     def getCurrentPosition(self) -> None:
-        self.write_message(f"INFO: Current position: {self.current_position}")
+        output.add(b"INFO: Current position: ").add_int(self.live_position())
+        output.end_line()
 
     def setCurrentDirection(self, direction: str) -> None:
         if direction:
@@ -245,6 +692,7 @@ class Autosampler:
                 self.current_direction = 1
             elif direction.upper() == "RIGHT":
                 self.current_direction = 0
+            self.save_position()
             self.write_message(
                 f"INFO: Direction set to: {self.direction_map[self.current_direction]}"
             )
@@ -270,10 +718,10 @@ class Autosampler:
             )
 
     def moveToLeftMost(self) -> None:
-        self.move_to_position(MAX_POSITION)
+        self.request_position(MAX_POSITION)
 
     def moveToRightMost(self) -> None:
-        self.move_to_position(0)
+        self.request_position(0)
 
     def dumpSlotsConfig(self) -> None:
         self.write_message(
@@ -326,16 +774,29 @@ def help():
         "getDirection - Get the current direction of the autosampler\n"
         "getFailSafePosition - Get the fail-safe position of the autosampler\n"
         "setFailSafePosition:position - Set the fail-safe position of the autosampler\n"
-        "moveTo:position - Move to a specific position\n"
+        "moveTo:position - Move to a specific position, the move runs in the background, a move sent during another one is queued\n"
+        "stop - Stop the current move and cancel the queued moves, the position is kept at the steps completed\n"
+        "plan:slot,slot,...:slot<slot,... - Get the visit order of the slots with the least predicted travel time, optionally with ordering constraints\n"
+        "visit:slot,slot,...:slot<slot,... - Move to the slots one after the other in the order of plan, queued like moveTo\n"
+        "estimate:from_position:to_position - Get the estimated time of a move between two positions\n"
+        "estimateSlot:from_slot:to_slot - Get the estimated time of a move between two slots\n"
+        "calibrate:distance,distance,... - Move back and forth over each distance and fit the move time model (default 25,100,400,1600), queued like moveTo\n"
+        "getTimeModel - Get the move time model, time = offset + scale * time predicted from the profile\n"
+        "setStreamInterval:interval_ms - Send the position every interval_ms during a move (0 to disable)\n"
+        "setProfile:acceleration:max_speed:jerk - Set the acceleration (steps/s^2, 0 for none), max speed (steps/s) and jerk (steps/s^3, 0 for trapezoidal) of the moves\n"
+        "getProfile - Get the motion profile of the moves\n"
         "moveToLeftMost - Move to the leftmost position\n"
         "moveToRightMost - Move to the rightmost position\n"
         "dumpSlotsConfig - Dump the current slots configuration\n"
-        "moveToSlot:slot - Move to a predefined slot in the configuration\n"
+        "moveToSlot:slot - Move to a predefined slot in the configuration, queued like moveTo\n"
         "setSlotPosition:slot:position - Set the position of a predefined slot\n"
         "deleteSlot:slot - Delete a predefined slot from the configuration\n"
         "gtime - Get the current RTC time\n"
         "stime:year:month:day:dayoftheweek:hour:minute:second - Set the RTC time\n"
         "reset - Perform a hard reset of the controller\n"
+        "diag - Report the free heap, garbage collections and heap allocated per command since the last diag\n"
+        "events - Dump the pin changes logged since the last dump as time_us,pin,old,new,command\n"
+        "bench_native:iterations - Compare the Python and viper versions of the hot paths (default 1000 iterations)\n"
         "set_mode:mode - Set bootloader mode (pump, autosampler, update_firmware)\n"
         "below are old commands for compatibility\n"
         "status - Send current status of the autosampler\n"
@@ -346,9 +807,12 @@ def help():
     )
 
 
-# Create a poll object to monitor stdin, which will block until there is input for reading
-poll_obj = select.poll()
-poll_obj.register(sys.stdin, select.POLLIN)
+# maximum number of commands executed back-to-back per wakeup, the rest of a burst is read on the next iteration
+MAX_BATCH = 8
+# longest wait for input during a move, the end of the move is detected within this time
+MOVE_POLL_MS = 1
+# Create a line reader to monitor stdin, which will block until there is input for reading
+reader = LineReader(max_batch=MAX_BATCH)
 
 
 def main():
@@ -372,17 +836,30 @@ def main():
         "getDirection": "getCurrentDirection",
         "getFailSafePosition": "getFailSafePosition",
         "setFailSafePosition": "setFailSafePosition",
-        "moveTo": "move_to_position",
+        "moveTo": "request_position",
         "moveToLeftMost": "moveToLeftMost",
         "moveToRightMost": "moveToRightMost",
         "dumpSlotsConfig": "dumpSlotsConfig",
-        "moveToSlot": "move_to_slot",
+        "moveToSlot": "request_slot",
         "setSlotPosition": "setSlotPosition",
         "deleteSlot": "deleteSlot",
         "gtime": "get_time",
         "stime": "set_time",
         "reset": "hard_reset",
         "set_mode": "set_bootloader_mode",
+        "diag": "diagnostics",
+        "events": "dump_events",
+        "stop": "stop",
+        "plan": "plan",
+        "estimate": "estimate",
+        "estimateSlot": "estimate_slot",
+        "calibrate": "calibrate",
+        "getTimeModel": "getTimeModel",
+        "visit": "visit",
+        "setStreamInterval": "setStreamInterval",
+        "setProfile": "setProfile",
+        "getProfile": "getProfile",
+        "bench_native": "bench_native",
         # old commands
         "status": "send_status",
         "config": "send_config",
@@ -391,103 +868,121 @@ def main():
         "shutdown": "shutdown",
     }
 
+    # the firmware is ready, record the boot time and the free heap for the ping reply
+    mark_ready()
     while True:
         try:
             if not led_blinking_mode:
                 led.value(1)
-            # Wait for input on stdin
-            poll_results = poll_obj.poll()
-
-            if poll_results:
-                data = sys.stdin.readline().strip()
-                if not led_blinking_mode:
-                    led.value(0)
-
+            # Wait for input on stdin and read all complete lines received, the wait is bounded during a move
+            lines = reader.read_lines(
+                MOVE_POLL_MS if autosampler.stepper.moving else -1
+            )
+            autosampler.poll_move()
+            if lines and not led_blinking_mode:
+                led.value(0)
+
+            for data in lines:
+                heap_monitor.before_command()
+                if data is None:
+                    autosampler.write_message("Error: Input too long.")
+                    continue
                 if not data or data == "":
                     autosampler.write_message("Error: Empty input.")
                     continue
 
-                parts = data.split(":")
-                # if the first item is a digit, then it's in format digit:command..., we don't care about the digit
-                if parts[0].isdigit() and len(parts) > 1:
-                    parts = parts[1:]
-                command = parts[0].strip()
-
-                if command == "help":
-                    help()
-                elif command == "stime":
-                    if len(parts) == 8:  # Adjusted length
-                        year = int(parts[1])
-                        month = int(parts[2])
-                        day = int(parts[3])
-                        hour = int(parts[5])
-                        minute = int(parts[6])
-                        second = int(parts[7])
-                        autosampler.set_time(year, month, day, hour, minute, second)
-                    else:
-                        autosampler.write_message(
-                            "Error: Invalid input, expected format 'stime:year:month:day:dayoftheweek:hour:minute:second'"
-                        )
-                elif command == "set_mode":
-                    if len(parts) >= 2:
-                        mode = str(parts[1])
-                    else:
-                        mode = "None"
-                    try:
-                        set_bootloader_mode(mode)
-                        autosampler.write_message(
-                            f"Success: controller set to {mode} mode"
-                        )
-                    except Exception as e:
-                        autosampler.write_message(f"Error: {e}")
-                elif command == "bootsel":
-                    try:
-                        autosampler.write_message("Success: Entering BOOTSEL mode")
-                        machine.bootloader()
-                    except Exception as e:
-                        autosampler.write_message(f"Error: {e}")
-                elif command == "blink_en":
-                    if not led_blinking_mode:
-                        led_blinking_mode = True
-                        timer.init(
-                            period=200,
-                            mode=machine.Timer.PERIODIC,
-                            callback=lambda t: blink_led(),
-                        )
-                        autosampler.write_message("Info: LED blinking mode enabled.")
-                    else:
-                        autosampler.write_message(
-                            "Info: LED blinking mode is already enabled."
-                        )
-                elif command == "blink_dis":
-                    if led_blinking_mode:
-                        led_blinking_mode = False
-                        timer.deinit()
-                        led.value(1)
-                        autosampler.write_message("Info: LED blinking mode disabled.")
-                elif command == "get_name":
-                    autosampler.get_name()
-                elif command == "set_name":
-                    if len(parts) == 3:
-                        name = parts[2].strip()
-                        autosampler.set_name(name)
-                    else:
-                        autosampler.write_message(
-                            "Error: Invalid input, expected format '0:set_name:name'"
-                        )
-                elif command in commands:
-                    method = getattr(autosampler, commands[command], None)
-                    if method:
-                        if len(parts) > 1:
-                            method(*parts[1:])
+                # an exception ends only the current command, the rest of the batch is still executed
+                try:
+                    parts = data.split(":")
+                    # if the first item is a digit, then it's in format digit:command..., we don't care about the digit
+                    if parts[0].isdigit() and len(parts) > 1:
+                        parts = parts[1:]
+                    command = parts[0].strip()
+
+                    if command == "help":
+                        help()
+                    elif command == "stime":
+                        if len(parts) == 8:  # Adjusted length
+                            year = int(parts[1])
+                            month = int(parts[2])
+                            day = int(parts[3])
+                            hour = int(parts[5])
+                            minute = int(parts[6])
+                            second = int(parts[7])
+                            autosampler.set_time(year, month, day, hour, minute, second)
+                        else:
+                            autosampler.write_message(
+                                "Error: Invalid input, expected format 'stime:year:month:day:dayoftheweek:hour:minute:second'"
+                            )
+                    elif command == "set_mode":
+                        if len(parts) >= 2:
+                            mode = str(parts[1])
+                        else:
+                            mode = "None"
+                        try:
+                            set_bootloader_mode(mode)
+                            autosampler.write_message(
+                                f"Success: controller set to {mode} mode"
+                            )
+                        except Exception as e:
+                            autosampler.write_message(f"Error: {e}")
+                    elif command == "bootsel":
+                        try:
+                            autosampler.write_message("Success: Entering BOOTSEL mode")
+                            machine.bootloader()
+                        except Exception as e:
+                            autosampler.write_message(f"Error: {e}")
+                    elif command == "blink_en":
+                        if not led_blinking_mode:
+                            led_blinking_mode = True
+                            timer.init(
+                                period=200,
+                                mode=machine.Timer.PERIODIC,
+                                callback=lambda t: blink_led(),
+                            )
+                            autosampler.write_message(
+                                "Info: LED blinking mode enabled."
+                            )
                         else:
-                            method()
+                            autosampler.write_message(
+                                "Info: LED blinking mode is already enabled."
+                            )
+                    elif command == "blink_dis":
+                        if led_blinking_mode:
+                            led_blinking_mode = False
+                            timer.deinit()
+                            led.value(1)
+                            autosampler.write_message(
+                                "Info: LED blinking mode disabled."
+                            )
+                    elif command == "get_name":
+                        autosampler.get_name()
+                    elif command == "set_name":
+                        if len(parts) == 3:
+                            name = parts[2].strip()
+                            autosampler.set_name(name)
+                        else:
+                            autosampler.write_message(
+                                "Error: Invalid input, expected format '0:set_name:name'"
+                            )
+                    elif command in commands:
+                        method = getattr(autosampler, commands[command], None)
+                        if method:
+                            if len(parts) > 1:
+                                method(*parts[1:])
+                            else:
+                                method()
+                        else:
+                            autosampler.write_message(
+                                f"Warning: Command '{command}' not found."
+                            )
                     else:
-                        autosampler.write_message(
-                            f"Warning: Command '{command}' not found."
-                        )
-                else:
-                    autosampler.write_message(f"Warning: Invalid command {command}")
+                        autosampler.write_message(f"Warning: Invalid command {command}")
+                except Exception as e:
+                    autosampler.write_message(
+                        f"Error: An exception occurred - {str(e)}"
+                    )
+                heap_monitor.after_command()
         except Exception as e:
             autosampler.write_message(f"Error: An exception occurred - {str(e)}")
 
@@ -1,4 +1,7 @@
+import os
 import json
+import time
+import bootloader_util
 
 CONFIG_FILE = "bootloader_config.json"
 
@@ -10,6 +13,23 @@ def create_default_config() -> dict:
     return default_config
 
 
+# import a firmware module and record the import time and where it was loaded from for the ping reply
+# the files are checked in the import order, X.py is imported before X.mpy
+def import_firmware(module_name):
+    files = os.listdir()
+    if module_name + ".py" in files:
+        source = "py"
+    elif module_name + ".mpy" in files:
+        source = "mpy"
+    else:
+        source = "frozen"
+    start = time.ticks_ms()
+    module = __import__(module_name)
+    bootloader_util.boot_info["import_ms"] = time.ticks_diff(time.ticks_ms(), start)
+    bootloader_util.boot_info["source"] = source
+    return module
+
+
 def bootloader():
     try:
         with open(CONFIG_FILE, "r") as f:
@@ -27,26 +47,15 @@ def bootloader():
 
     # Check if the bootloader is active
     mode = config.get("mode", "pump")
-    if mode == "pump":
-        import pump_control_pico
-
-        pump_control_pico.main()
-    elif mode == "autosampler":
-        import autosampler_control_pico
-
-        autosampler_control_pico.main()
-    elif mode == "update_firmware":
-        import bootloader_util
-
+    if mode == "update_firmware":
         bootloader_util.update_firmware()
+        return
+    if mode == "autosampler":
+        import_firmware("autosampler_control_pico").main()
     elif mode == "potentiostat":
-        import potentiostat_control_pico
-
-        potentiostat_control_pico.main()
+        import_firmware("potentiostat_control_pico").main()
     else:
-        import pump_control_pico
-
-        pump_control_pico.main()
+        import_firmware("pump_control_pico").main()
 
 
 if __name__ == "__main__":
@@ -3,11 +3,30 @@ import os
 import gc
 import sys
 import json
+import time
 import hashlib
 import machine
 import binascii
 
 CONFIG_FILE = "bootloader_config.json"
+# files that must stay as source, main.py is only run at boot when it is a .py
+KEEP_SOURCE = ("main", "boot")
+# boot measurement, the import is timed by the bootloader and the firmware calls mark_ready() before its main loop
+boot_info = {"source": "frozen", "import_ms": 0, "boot_ms": 0, "mem_free": 0}
+
+
+def mark_ready():
+    gc.collect()
+    boot_info["boot_ms"] = time.ticks_ms()
+    boot_info["mem_free"] = gc.mem_free()
+
+
+# summary for the ping reply, e.g. "boot: 812 ms, import: 402 ms (py), mem_free: 171232 bytes"
+def boot_summary() -> str:
+    return (
+        f"boot: {boot_info['boot_ms']} ms, import: {boot_info['import_ms']} ms "
+        f"({boot_info['source']}), mem_free: {boot_info['mem_free']} bytes"
+    )
 
 
 def set_bootloader_mode(mode: str):
@@ -52,6 +71,33 @@ def exit_bootloader_settings(bootsel: bool = False):
         machine.reset()
 
 
+# MicroPython imports X.py before X.mpy from the same directory, so the other form of an uploaded module is moved
+# to X.py.bak or X.mpy.bak, the form uploaded last is imported and the files are never changed at boot
+def keep_uploaded(filename):
+    for uploaded, other in ((".mpy", ".py"), (".py", ".mpy")):
+        if filename.endswith(uploaded):
+            module_name = filename[: -len(uploaded)]
+            break
+    else:
+        return
+    if module_name in KEEP_SOURCE:
+        return
+    other = module_name + other
+    if other not in os.listdir():
+        return
+    try:
+        os.remove(other + ".bak")
+    except OSError:
+        pass
+    try:
+        os.rename(other, other + ".bak")
+        sys.stdout.write(
+            f"Info: Moved {other} to {other}.bak, {filename} is imported.\n"
+        )
+    except OSError as e:
+        sys.stdout.write(f"Info: Failed to move {other} to {other}.bak: {e}.\n")
+
+
 def update_firmware():
     def blink_led():
         led = machine.Pin("LED", machine.Pin.OUT)
@@ -196,10 +242,12 @@ def update_firmware():
             )
             reset_fields()
             continue
+        received, size = filename, total_received
+        reset_fields()
+        keep_uploaded(received)
         sys.stdout.write(
-            f"Success: finished receiving {filename} of size {total_received} bytes.\n"
+            f"Success: finished receiving {received} of size {size} bytes.\n"
         )
-        reset_fields()
         continue
 
 
@@ -0,0 +1,77 @@
+# capture_util.py
+# edge timestamps of input pins, e.g. the digital outputs of the potentiostat, used by the potentiostat firmware
+import time
+import machine
+import micropython
+from event_util import EventLog
+
+CAPTURE_STREAM_MS = 10  # default interval between two streamed lines of edges
+
+# an exception raised in a hard interrupt handler is reported instead of being lost
+micropython.alloc_emergency_exception_buf(100)
+
+
+# the edges of the armed pins are timestamped with time.ticks_us() by a hard interrupt handler, a few microseconds
+# after the edge, into an event log written by the handlers only, the command loop streams the new edges to the host
+# an edge is logged as time_us,pin,old,new,command with the number of the last command received
+class EdgeCapture:
+    def __init__(self):
+        self.log = EventLog()
+        self.pins = {}  # armed machine.Pin by pin number
+        self.command_id = 0  # set by core0 for the current command
+        self.interval_ms = CAPTURE_STREAM_MS  # 0 only dumps on request
+        self.last_stream = 0
+
+    # handler of one pin, the pin number is bound so the handler does not allocate
+    def handler(self, pin_id):
+        log = self.log
+
+        def edge(pin):
+            flags = pin.irq().flags()
+            rising = flags & machine.Pin.IRQ_RISING
+            falling = flags & machine.Pin.IRQ_FALLING
+            # both flags are set for a pulse shorter than the interrupt latency, the level tells their order
+            if rising and falling and pin.value():
+                log.record(pin_id, 1, 0, self.command_id)
+                log.record(pin_id, 0, 1, self.command_id)
+            else:
+                if rising:
+                    log.record(pin_id, 0, 1, self.command_id)
+                if falling:
+                    log.record(pin_id, 1, 0, self.command_id)
+
+        return edge
+
+    # timestamp the rising and falling edges of the pins, the pins are inputs with a pull-down
+    def arm(self, pin_ids, interval_ms=CAPTURE_STREAM_MS):
+        if interval_ms < 0:
+            raise ValueError("interval must be positive")
+        self.disarm()
+        for pin_id in pin_ids:
+            pin = machine.Pin(pin_id, machine.Pin.IN, machine.Pin.PULL_DOWN)
+            pin.irq(
+                self.handler(pin_id),
+                machine.Pin.IRQ_RISING | machine.Pin.IRQ_FALLING,
+                hard=True,
+            )
+            self.pins[pin_id] = pin
+        self.interval_ms = interval_ms
+        self.last_stream = time.ticks_ms()
+
+    def disarm(self):
+        for pin in self.pins.values():
+            pin.irq(None)
+        self.pins.clear()
+
+    # longest wait of the command loop for input, -1 when nothing is streamed
+    def timeout_ms(self):
+        return self.interval_ms if self.pins and self.interval_ms else -1
+
+    # send the edges captured since the last line, at most once per interval
+    def stream(self, output):
+        if not self.timeout_ms() > 0 or self.log.total == self.log.dumped:
+            return
+        now = time.ticks_ms()
+        if time.ticks_diff(now, self.last_stream) >= self.interval_ms:
+            self.last_stream = now
+            self.log.dump(output, b"Captures")
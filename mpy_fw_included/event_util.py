@@ -0,0 +1,57 @@
+# event_util.py
+# ring buffer of timestamped pin events shared by the controller firmwares
+import time
+from array import array
+
+EVENT_LOG_SIZE = 256
+
+
+# the events are stored in preallocated arrays, the oldest ones are overwritten when the buffer is full
+# one core records and core0 dumps, the count is only advanced after the fields are written so no lock is needed
+class EventLog:
+    def __init__(self, size=EVENT_LOG_SIZE):
+        self.size = size
+        self.times = array("i", [0] * size)  # time.ticks_us() of the change
+        self.units = array("h", [0] * size)  # pin number
+        self.old_values = array("i", [0] * size)
+        self.new_values = array("i", [0] * size)
+        self.command_ids = array("I", [0] * size)  # command that caused the change
+        self.total = 0  # events recorded, written by the recording core only
+        self.dumped = 0  # events already dumped, written by core0 only
+
+    # time_us is the time.ticks_us() of the change, now when None, e.g. a scheduled edge of a pulse train
+    def record(self, unit, old_value, new_value, command_id, time_us=None):
+        i = self.total % self.size
+        self.times[i] = time.ticks_us() if time_us is None else time_us
+        self.units[i] = unit
+        self.old_values[i] = old_value
+        self.new_values[i] = new_value
+        self.command_ids[i] = command_id
+        self.total += 1
+
+    # send the events recorded since the last dump in one line, the current time lets the host align the timestamps
+    # "Events: now 1234567, count 2, dropped 0: 1230001,4,0,1,17;1230001,5,1,0,17"
+    # with the fields time_us,pin,old,new,command, label replaces "Events" for another log
+    def dump(self, output, label=b"Events"):
+        total = self.total
+        count = total - self.dumped
+        dropped = 0
+        if count > self.size:
+            dropped = count - self.size
+            count = self.size
+        output.add(label).add(b": now ").add_int(time.ticks_us())
+        output.add(b", count ").add_int(count)
+        output.add(b", dropped ").add_int(dropped).add(b":")
+        separator = b" "
+        i = total - count
+        while i < total:
+            j = i % self.size
+            output.add(separator).add_int(self.times[j])
+            output.add(b",").add_int(self.units[j])
+            output.add(b",").add_int(self.old_values[j])
+            output.add(b",").add_int(self.new_values[j])
+            output.add(b",").add_int(self.command_ids[j])
+            separator = b";"
+            i += 1
+        output.end_line()
+        self.dumped = total
@@ -0,0 +1,89 @@
+# input_util.py
+# buffered non-blocking line reader for stdin shared by the controller firmwares
+import sys
+import select
+
+INPUT_BUFFER_SIZE = 256  # longest accepted command line in bytes
+MAX_BATCH = 8  # default number of command lines returned per read
+
+
+# index of the first newline in buf[start:end], -1 when there is none
+def find_newline(buf, start, end):
+    while start < end:
+        if buf[start] == 10:
+            return start
+        start += 1
+    return -1
+
+
+# the viper version is used when the native emitter is available
+find_newline_python = find_newline
+try:
+    from native_util import find_newline
+except (ImportError, SyntaxError, ValueError):
+    pass
+
+
+# read the bytes already received on stdin without blocking on a partial line, and split them into lines,
+# so a burst of commands sent by the host in one USB packet is handled back-to-back in one wakeup
+class LineReader:
+    def __init__(self, max_batch=MAX_BATCH, size=INPUT_BUFFER_SIZE):
+        self.stream = getattr(sys.stdin, "buffer", sys.stdin)
+        self.poller = select.poll()
+        self.poller.register(sys.stdin, select.POLLIN)
+        self.max_batch = max_batch
+        self.buf = bytearray(size)
+        self.start = 0  # start of the unread bytes
+        self.length = 0  # end of the bytes received
+        self.overflow = False  # the current line is longer than the buffer
+        self.byte = bytearray(1)
+
+    # True if at least one byte can be read without blocking, ipoll does not allocate the result list
+    def available(self):
+        for _ in self.poller.ipoll(0):
+            return True
+        return False
+
+    # wait up to timeout_ms for input (-1 waits forever), then return the complete lines available, at most max_batch,
+    # stripped, a line longer than the buffer is returned as None
+    # the bytes received are moved into the buffer first and split afterwards, the bytes after the last complete
+    # line are kept for the next call, the rest of a burst stays in the USB buffer
+    def read_lines(self, timeout_ms=-1):
+        lines = []
+        buf = self.buf
+        size = len(buf)
+        if (
+            timeout_ms != 0
+            and find_newline(buf, self.start, self.length) < 0
+            and not self.available()
+        ):
+            self.poller.poll(timeout_ms)
+        if self.length == size and self.start:
+            # move the partial line to the front to make room
+            self.length -= self.start
+            for i in range(self.length):
+                buf[i] = buf[self.start + i]
+            self.start = 0
+        while self.length < size and self.available():
+            self.stream.readinto(self.byte, 1)
+            buf[self.length] = self.byte[0]
+            self.length += 1
+
+        while len(lines) < self.max_batch:
+            end = find_newline(buf, self.start, self.length)
+            if end < 0:
+                break
+            if self.overflow:
+                lines.append(None)
+                self.overflow = False
+            else:
+                lines.append(str(buf[self.start : end], "utf-8").strip())
+            self.start = end + 1
+        if self.start == self.length:
+            self.start = 0
+            self.length = 0
+        elif self.length == size and not self.start:
+            # a full buffer without a newline, drop the bytes up to the end of the line
+            self.overflow = True
+            self.length = 0
+        return lines
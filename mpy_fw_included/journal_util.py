@@ -0,0 +1,160 @@
+# journal_util.py
+# append-only journals used by the firmwares to persist their state on flash
+import os
+import json
+import struct
+
+JOURNAL_COMPACT_RECORDS = 64  # number of appended records that triggers a compaction
+
+
+# the state is a dictionary kept in a snapshot file (plain JSON, the format of the former save files) plus a journal
+# file where every save appends one JSON line with the changed keys, so a save is a small append instead of a
+# rewrite of the whole file, the journal is merged into the snapshot every JOURNAL_COMPACT_RECORDS records
+class Journal:
+    def __init__(
+        self, snapshot_file, journal_file, compact_records=JOURNAL_COMPACT_RECORDS
+    ):
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file
+        self.compact_records = compact_records
+        self.records = 0  # records in the journal file
+        self.data = {}
+
+    # read the snapshot and replay the journal, returns None when neither file exists
+    def load(self):
+        files = os.listdir(os.getcwd())
+        if self.snapshot_file not in files and self.journal_file not in files:
+            return None
+        data = {}
+        if self.snapshot_file in files:
+            with open(self.snapshot_file, "r") as file:
+                data = json.load(file)
+        self.records = 0
+        torn = False
+        if self.journal_file in files:
+            with open(self.journal_file, "r") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # the last line is incomplete when the power was lost during the append
+                        torn = True
+                        break
+                    self.apply(data, record)
+                    self.records += 1
+        self.data = data
+        # compact a torn journal too, otherwise the next record would be appended to the incomplete line
+        if torn or self.records >= self.compact_records:
+            self.compact()
+        return data
+
+    # merge a record into the data, a key with a None value is removed
+    @staticmethod
+    def apply(data, record):
+        for key in record:
+            if record[key] is None:
+                data.pop(key, None)
+            else:
+                data[key] = record[key]
+
+    # append a record with the changed keys
+    def update(self, record):
+        self.apply(self.data, record)
+        with open(self.journal_file, "a") as file:
+            file.write(json.dumps(record))
+            file.write("\n")
+        self.records += 1
+        if self.records >= self.compact_records:
+            self.compact()
+
+    # replace the whole state, written directly as a new snapshot
+    def replace(self, data):
+        self.data = data
+        self.compact()
+
+    # write the data to a new snapshot and drop the journal, the snapshot is renamed into place so a power loss
+    # leaves either the old snapshot and journal or the new snapshot, replaying an old journal again is harmless
+    def compact(self):
+        temp_file = self.snapshot_file + ".tmp"
+        with open(temp_file, "w") as file:
+            json.dump(self.data, file)
+        os.rename(temp_file, self.snapshot_file)
+        try:
+            os.remove(self.journal_file)
+        except OSError:
+            pass
+        self.records = 0
+
+
+RECORDS_PER_FILE = (
+    256  # fixed records written to a file before the next file is started
+)
+
+
+# small fixed-size records of a few integers (e.g. a position) with a sequence number, appended to one of several
+# files in turn, when a file is full the next one is truncated while the full one keeps the newest record, so the
+# last valid record survives a power loss during any write, each record ends with a check word so a torn record
+# is skipped, only the last records of each file are read at boot
+class RecordJournal:
+    def __init__(self, files, values, records_per_file=RECORDS_PER_FILE):
+        self.files = files
+        self.format = "<I" + "i" * values + "I"  # sequence number, values, check word
+        self.size = struct.calcsize(self.format)
+        self.records_per_file = records_per_file
+        self.sequence = 0  # sequence number of the last record
+        self.file_index = 0  # file written to
+        self.records = records_per_file  # records in that file, full until load() finds a file to append to
+
+    @staticmethod
+    def check(sequence, values):
+        check = sequence ^ 0xA5A5A5A5
+        for value in values:
+            check = (check * 31 + value) & 0xFFFFFFFF
+        return check
+
+    # the last valid record of a file as (sequence, values, records), None when it has none
+    def last_record(self, name):
+        try:
+            with open(name, "rb") as file:
+                data = file.read()
+        except OSError:
+            return None
+        records = len(data) // self.size
+        torn = len(data) % self.size != 0
+        for i in range(records - 1, -1, -1):
+            fields = struct.unpack_from(self.format, data, i * self.size)
+            values = fields[1:-1]
+            if fields[-1] == self.check(fields[0], values):
+                # a record after the valid one is torn, the file is not appended to anymore
+                if torn or i != records - 1:
+                    records = self.records_per_file
+                return fields[0], values, records
+            torn = True
+        return None
+
+    # the values of the newest valid record, None when there is none
+    def load(self):
+        newest = None
+        for index in range(len(self.files)):
+            last = self.last_record(self.files[index])
+            if last and (newest is None or last[0] > newest[0]):
+                newest = last
+                self.file_index = index
+        if newest is None:
+            return None
+        self.sequence, values, self.records = newest
+        return values
+
+    def append(self, values):
+        if self.records >= self.records_per_file:
+            self.file_index = (self.file_index + 1) % len(self.files)
+            self.records = 0
+        self.sequence += 1
+        record = struct.pack(
+            self.format, self.sequence, *values, self.check(self.sequence, values)
+        )
+        with open(
+            self.files[self.file_index], "wb" if self.records == 0 else "ab"
+        ) as file:
+            file.write(record)
+        self.records += 1
@@ -0,0 +1,35 @@
+# native_util.py
+# viper versions of the firmware hot paths, the modules import them with a fallback to their plain Python versions
+# when the native emitter is not available (or outside MicroPython), the bench_native command compares both
+import micropython
+from micropython import const
+
+# RP2040 SIO base address and the word offsets of the GPIO output registers
+SIO_BASE = const(0xD0000000)
+GPIO_OUT = const(4)  # 0x010
+GPIO_OUT_SET = const(5)  # 0x014
+GPIO_OUT_CLR = const(6)  # 0x018
+GPIO_OUT_XOR = const(7)  # 0x01C
+
+
+# same as actuator_util.write_pin_masks, the pins that change are flipped with one GPIO_OUT_XOR write
+@micropython.viper
+def write_pin_masks(set_mask: uint, clear_mask: uint):
+    sio = ptr32(SIO_BASE)
+    if set_mask == uint(0):
+        sio[GPIO_OUT_CLR] = clear_mask
+    elif clear_mask == uint(0):
+        sio[GPIO_OUT_SET] = set_mask
+    else:
+        out = uint(sio[GPIO_OUT])
+        sio[GPIO_OUT_XOR] = ((out ^ set_mask) & set_mask) | (out & clear_mask)
+
+
+# index of the first newline in buf[start:end], -1 when there is none
+@micropython.viper
+def find_newline(buf: ptr8, start: int, end: int) -> int:
+    while start < end:
+        if buf[start] == 10:
+            return start
+        start += 1
+    return -1
@@ -0,0 +1,120 @@
+# output_util.py
+# preallocated output buffer and heap diagnostics shared by the controller firmwares
+import gc
+import sys
+
+OUTPUT_BUFFER_SIZE = 512
+
+
+# a stream that drops everything, used to mute the output
+class NullStream:
+    def write(self, *args):
+        return 0
+
+
+# the responses are assembled in place in a preallocated bytearray and written with sys.stdout.buffer.write,
+# so the frequently polled lines (status, info, time) do not allocate strings on the heap
+class OutputBuffer:
+    def __init__(self, size=OUTPUT_BUFFER_SIZE):
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.length = 0
+        self.stream = getattr(sys.stdout, "buffer", sys.stdout)
+
+    def flush(self):
+        if self.length:
+            # MicroPython streams take the number of bytes to write, so no slice is created
+            self.stream.write(self.buf, self.length)
+            self.length = 0
+
+    # append bytes, use pre-encoded constants such as b"Status: " on the hot paths
+    def add(self, data):
+        end = self.length + len(data)
+        if end > len(self.buf):
+            self.flush()
+            if len(data) > len(self.buf):
+                self.stream.write(data)
+                return self
+            end = len(data)
+        self.mv[self.length : end] = data
+        self.length = end
+        return self
+
+    # append the decimal digits of an integer without creating a string
+    def add_int(self, value):
+        if value < 0:
+            self.add(b"-")
+            value = -value
+        digits = 1
+        remaining = value
+        while remaining >= 10:
+            remaining //= 10
+            digits += 1
+        if self.length + digits > len(self.buf):
+            self.flush()
+        i = self.length + digits
+        self.length = i
+        while True:
+            i -= 1
+            self.buf[i] = 48 + value % 10
+            value //= 10
+            if value == 0:
+                break
+        return self
+
+    # append a str, this allocates its encoded copy so it is meant for the less frequent messages
+    def add_str(self, text):
+        return self.add(text.encode())
+
+    # terminate the line and send it
+    def end_line(self):
+        self.add(b"\n")
+        self.flush()
+
+
+# track the heap around each command, a drop of gc.mem_alloc() between two samples means the garbage collector ran
+class HeapMonitor:
+    def __init__(self):
+        self.commands = 0
+        self.collections = 0
+        self.last_alloc = gc.mem_alloc()
+        self.last_command_alloc = 0
+        self.max_command_alloc = 0
+        # values at the previous report, for the deltas
+        self.report_free = gc.mem_free()
+        self.report_commands = 0
+        self.report_collections = 0
+
+    def before_command(self):
+        alloc = gc.mem_alloc()
+        if alloc < self.last_alloc:
+            self.collections += 1
+        self.last_alloc = alloc
+
+    def after_command(self):
+        alloc = gc.mem_alloc()
+        if alloc < self.last_alloc:
+            # collected during the command, the allocated size is unknown
+            self.collections += 1
+        else:
+            self.last_command_alloc = alloc - self.last_alloc
+            if self.last_command_alloc > self.max_command_alloc:
+                self.max_command_alloc = self.last_command_alloc
+        self.last_alloc = alloc
+        self.commands += 1
+
+    def report(self, output):
+        free = gc.mem_free()
+        output.add(b"Info: Diagnostics: mem_free: ").add_int(free)
+        output.add(b" (delta ").add_int(free - self.report_free)
+        output.add(b"), mem_alloc: ").add_int(gc.mem_alloc())
+        output.add(b", gc collections: ").add_int(self.collections)
+        output.add(b" (delta ").add_int(self.collections - self.report_collections)
+        output.add(b"), commands: ").add_int(self.commands)
+        output.add(b" (delta ").add_int(self.commands - self.report_commands)
+        output.add(b"), last command alloc: ").add_int(self.last_command_alloc)
+        output.add(b" bytes, max command alloc: ").add_int(self.max_command_alloc)
+        output.add(b" bytes").end_line()
+        self.report_free = free
+        self.report_commands = self.commands
+        self.report_collections = self.collections
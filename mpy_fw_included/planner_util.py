@@ -0,0 +1,92 @@
+# planner_util.py
+# order of a batch of autosampler slot visits with the least predicted travel time, used by the visit command
+from array import array
+
+VISIT_MAX_SLOTS = 8  # the plan is exact, its cost grows with 2^slots * slots^2
+
+
+# parse "a<b,c<d" into (before, after) pairs, a must be visited before b
+def parse_constraints(text):
+    pairs = []
+    for item in text.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        before, sep, after = item.partition("<")
+        if not sep or not before.strip() or not after.strip():
+            raise ValueError(f"invalid constraint {item}, expected format 'slot<slot'")
+        pairs.append((before.strip(), after.strip()))
+    return pairs
+
+
+# order of the positions starting from start with the least total cost, the travel time between two positions is
+# cost(distance in steps), before[j] is the bit mask of the positions that must be visited before position j
+# dynamic programming over the subsets visited and the last position, returns (order, total cost)
+# a state is reached or not on its own, any cost value is valid, the costs are 64-bit so the sums of microseconds
+# do not overflow, and a move costs at least 0 as a time model with a negative offset can predict negative times
+def plan_order(start, positions, before, cost):
+    n = len(positions)
+    full = (1 << n) - 1
+    # travel cost from the start (index n) and between the positions
+    costs = [
+        [
+            max(0, cost(abs(positions[j] - (positions[i] if i < n else start))))
+            for j in range(n)
+        ]
+        for i in range(n + 1)
+    ]
+    best = array("q", [0] * ((full + 1) * n))
+    reached = bytearray((full + 1) * n)
+    parent = array("b", [-1] * ((full + 1) * n))
+    for j in range(n):
+        if not before[j]:
+            best[(1 << j) * n + j] = costs[n][j]
+            reached[(1 << j) * n + j] = 1
+    for mask in range(1, full + 1):
+        for last in range(n):
+            if not reached[mask * n + last]:
+                continue
+            current = best[mask * n + last]
+            for j in range(n):
+                bit = 1 << j
+                if mask & bit or before[j] & mask != before[j]:
+                    continue
+                index = (mask | bit) * n + j
+                total = current + costs[last][j]
+                if not reached[index] or total < best[index]:
+                    best[index] = total
+                    reached[index] = 1
+                    parent[index] = last
+    last = -1
+    for j in range(n):
+        if reached[full * n + j] and (
+            last < 0 or best[full * n + j] < best[full * n + last]
+        ):
+            last = j
+    if last < 0:
+        raise ValueError("the ordering constraints form a cycle")
+    total = best[full * n + last]
+    order = []
+    mask = full
+    while last >= 0:
+        order.append(last)
+        previous = parent[mask * n + last]
+        mask &= ~(1 << last)
+        last = previous
+    order.reverse()
+    return order, total
+
+
+# plan the visit of the slots, a dictionary of slot name to position, constraints are (before, after) slot pairs
+# returns the slots in the visit order and the total cost
+def plan_visit(start, slots, constraints, cost):
+    names = list(slots)
+    if len(names) > VISIT_MAX_SLOTS:
+        raise ValueError(f"at most {VISIT_MAX_SLOTS} slots per visit")
+    before = [0] * len(names)
+    for first, second in constraints:
+        if first not in slots or second not in slots:
+            raise ValueError(f"constraint {first}<{second} uses a slot not visited")
+        before[names.index(second)] |= 1 << names.index(first)
+    order, total = plan_order(start, [slots[name] for name in names], before, cost)
+    return [names[i] for i in order], total
@@ -1,9 +1,17 @@
 import os
 import sys
 import json
-import select
 import machine
-from bootloader_util import set_bootloader_mode
+from bootloader_util import set_bootloader_mode, mark_ready, boot_summary
+from output_util import OutputBuffer, HeapMonitor
+from input_util import LineReader
+from actuator_util import Actuator
+from event_util import EventLog
+from trigger_util import PulseTrain, TRIGGER_STATE_MACHINES
+from capture_util import EdgeCapture, CAPTURE_STREAM_MS
+from waveform_util import WaveformEngine
+from adc_util import AdcStream
+from bench_util import bench_native
 
 # a dictionary to store the potentiostat config
 rtc = machine.RTC()
@@ -12,11 +20,46 @@ config = {}
 version = "1.00"
 SAVE_FILE = "potentiostat_config.json"
 CONFIG_FILE = "potentiostat_control_config.json"
+# preallocated buffer for the frequently polled responses and the heap statistics for the diag command
+output = OutputBuffer()
+heap_monitor = HeapMonitor()
+# pre-encoded trigger status values for the output buffer
+STATUS_BYTES = {"LOW": b"LOW", "HIGH": b"HIGH"}
+# the pin writes are applied on core1, started in main(), and the pin changes are logged for the events command
+events = EventLog()
+actuator = Actuator(events=events)
+# PIO state machines of the trigger pulse trains, on PIO1
+pulse_trains = [PulseTrain(4 + i) for i in range(TRIGGER_STATE_MACHINES)]
+# edge timestamps of the digital outputs of the potentiostats, on spare input pins
+capture = EdgeCapture()
+# potential waveforms played to the AD5761 DAC by DMA, on PIO0
+waveform = WaveformEngine()
+# ADC conversions streamed to the host in binary blocks
+adc = AdcStream()
+# waveform commands calling the engine with the numeric arguments, e.g. '0:wave_step:0.5:100'
+waveform_commands = {
+    "dac_setup": "setup",
+    "dac_write": "write",
+    "wave_clear": "clear",
+    "wave_step": "step",
+    "wave_ramp": "ramp",
+    "wave_sine": "sine",
+}
 
 
-# generic function to write a message to the console
+# generic function to write a message to the console, the newline is written separately to avoid a new string
 def write_message(message):
-    sys.stdout.write(f"{message}\n")
+    sys.stdout.write(message)
+    sys.stdout.write("\n")
+
+
+# append a status value to the output buffer, pre-encoded when possible
+def add_status_value(value):
+    data = STATUS_BYTES.get(value)
+    if data is None:
+        output.add_str(value)
+    else:
+        output.add(data)
 
 
 # Each Potentiostat class will have only a trigger pin
@@ -38,36 +81,123 @@ class Potentiostat:
 
         self.initial_trigger_status = initial_trigger_status.upper()
         self.trigger_status = self.initial_trigger_status
+        # the PulseTrain driving the trigger pin, None when the pin is set through the actuator
+        self.pulse_train = None
 
     def toggle_trigger(self):
-        # flip the trigger pin value and update the trigger status
-        self.trigger_pin.value(not self.trigger_pin.value())
-        # update the trigger status
+        # flip the trigger status, the pin value follows from the status since the write may still be queued
         if self.trigger_status == "LOW":
-            self.trigger_status = "HIGH"
+            self.set_trigger("HIGH")
         else:
-            self.trigger_status = "LOW"
+            self.set_trigger("LOW")
 
     def set_trigger(self, status: str):
         status = status.upper()
         if status not in ["HIGH", "LOW"]:
             write_message("Error: Invalid power status, expected 'ON' or 'OFF'")
             return
+        if self.pulse_train:
+            write_message("Error: A pulse train is running on the trigger pin.")
+            return
         if status == self.initial_trigger_status:
-            self.trigger_pin.value(self.initial_trigger_pin_value)
+            actuator.write_pin(self.trigger_pin_id, self.initial_trigger_pin_value)
         else:
-            self.trigger_pin.value(not self.initial_trigger_pin_value)
+            actuator.write_pin(self.trigger_pin_id, not self.initial_trigger_pin_value)
         self.trigger_status = status
 
+    # pin value of the trigger status
+    def pin_value(self):
+        if self.trigger_status == self.initial_trigger_status:
+            return self.initial_trigger_pin_value
+        return 1 - self.initial_trigger_pin_value
+
+    # count pulses of width_us, one every period_us, the first one delay_us after the command, generated by a PIO
+    # state machine, a pulse is the opposite of the current trigger level, e.g. '1:pulse:100:10:1000:500'
+    def pulse(self, width_us, count="1", period_us="0", delay_us="0"):
+        if self.pulse_train:
+            write_message("Error: A pulse train is running on the trigger pin.")
+            return
+        train = None
+        for candidate in pulse_trains:
+            if not candidate.running():
+                train = candidate
+                break
+        if train is None:
+            write_message("Error: All pulse generators are busy.")
+            return
+        try:
+            width_us = int(width_us)
+            count = int(count)
+            period_us = int(period_us)
+            delay_us = int(delay_us)
+            # the queued pin writes are applied before the pin is handed to the PIO
+            actuator.wait_idle()
+            idle = self.pin_value()
+            start = train.start(
+                self.trigger_pin_id, idle, width_us, count, period_us, delay_us
+            )
+        except ValueError as e:
+            write_message(
+                f"Error: Invalid input, expected format 'potentiostat_number:pulse:width_us:count:period_us:delay_us', {e}"
+            )
+            return
+        self.pulse_train = train
+        # the event log is written by core1, it is idle after wait_idle() and core0 queues no write until the next
+        # command, the edges are recorded at their scheduled times
+        events.record(
+            self.trigger_pin_id, idle, 1 - idle, actuator.command_id, train.first_edge
+        )
+        # timestamped acknowledgement with the scheduled edges, in time.ticks_us() like the events
+        output.add(b"Success: Pulse: pin ").add_int(self.trigger_pin_id)
+        output.add(b", start ").add_int(start)
+        output.add(b" us, first edge ").add_int(train.first_edge)
+        output.add(b" us, last edge ").add_int(train.last_edge)
+        output.add(b" us, count ").add_int(count).end_line()
+
+    # called by the command loop, gives the pin back to the SIO when the pulse train is done
+    def poll_pulse(self, stop=False):
+        train = self.pulse_train
+        if train is None or not (stop or train.done()):
+            return
+        train.release()
+        self.pulse_train = None
+        # a stopped train ends now instead of at its scheduled last edge
+        actuator.wait_idle()
+        events.record(
+            self.trigger_pin_id,
+            1 - train.idle,
+            train.idle,
+            actuator.command_id,
+            None if stop else train.last_edge,
+        )
+        if stop:
+            write_message(f"Info: Pulse train on pin {self.trigger_pin_id} stopped.")
+        else:
+            output.add(b"Info: Pulse done: pin ").add_int(self.trigger_pin_id)
+            output.add(b", last edge ").add_int(train.last_edge).add(b" us").end_line()
+
+    def stop_pulse(self):
+        if self.pulse_train:
+            self.poll_pulse(stop=True)
+        else:
+            write_message("Info: No pulse train running.")
+
     def hard_reset(self):
         write_message("Info: Performing hard reset.")
         machine.reset()
 
-    def get_status(self):
-        return f"Trigger: {self.trigger_status}"
+    # append the status to the output buffer, e.g. "Trigger: LOW"
+    def add_status(self):
+        output.add(b"Trigger: ")
+        add_status_value(self.trigger_status)
 
-    def get_info(self):
-        return f"Trigger Pin: {self.trigger_pin_id}, Initial Trigger Pin Value: {self.initial_trigger_pin_value}, Current Trigger Status: {self.trigger_status}"
+    def add_info(self):
+        output.add(b"Trigger Pin: ").add_int(self.trigger_pin_id)
+        output.add(b", Initial Trigger Pin Value: ").add_int(
+            self.initial_trigger_pin_value
+        )
+        output.add(b", Current Trigger Status: ")
+        add_status_value(self.trigger_status)
 
     def to_dict(self):
         return {
@@ -86,37 +216,40 @@ class Potentiostat:
 
 
 # functions to assemble and send status, when potentiostat_name is 0, it will send status/info for all potentiostats
+# the line is assembled in the output buffer, iterating the keys avoids the (key, value) tuples of items()
 def potentiostat_status(potentiostat_name):
     global potentiostats
     if potentiostat_name == 0:
-        status = ", ".join(
-            [
-                f"Potentiostat{i} Status: {potentiostat.get_status()}"
-                for i, potentiostat in potentiostats.items()
-            ]
-        )
-        write_message(status)
+        separator = False
+        for i in potentiostats:
+            if separator:
+                output.add(b", ")
+            separator = True
+            output.add(b"Potentiostat").add_int(i).add(b" Status: ")
+            potentiostats[i].add_status()
+        output.end_line()
     elif potentiostat_name in potentiostats:
-        write_message(
-            f"Potentiostat{potentiostat_name} Status: {potentiostats[potentiostat_name].get_status()}"
-        )
+        output.add(b"Potentiostat").add_int(potentiostat_name).add(b" Status: ")
+        potentiostats[potentiostat_name].add_status()
+        output.end_line()
 
 
 # functions to assemble and send info, when potentiostat_name is 0, it will send status/info for all potentiostats
 def potentiostat_info(potentiostat_name):
     global potentiostats
     if potentiostat_name == 0:
-        info = ", ".join(
-            [
-                f"Potentiostat{i} Info: {potentiostat.get_info()}"
-                for i, potentiostat in potentiostats.items()
-            ]
-        )
-        write_message(info)
+        separator = False
+        for i in potentiostats:
+            if separator:
+                output.add(b", ")
+            separator = True
+            output.add(b"Potentiostat").add_int(i).add(b" Info: ")
+            potentiostats[i].add_info()
+        output.end_line()
     elif potentiostat_name in potentiostats:
-        write_message(
-            f"Potentiostat{potentiostat_name} Info: {potentiostats[potentiostat_name].get_info()}"
-        )
+        output.add(b"Potentiostat").add_int(potentiostat_name).add(b" Info: ")
+        potentiostats[potentiostat_name].add_info()
+        output.end_line()
 
 
 # function to register a potentiostat, if a potentiostat already exists, it will update the pins
@@ -178,10 +311,73 @@ def global_shutdown():
     write_message("Success: Shutdown, all potentiostats are set to LOW.")
 
 
+# timestamp the edges of the pins, e.g. the digital outputs of the potentiostats, and stream them to the host
+def start_capture(pin_ids, interval_ms):
+    pin_ids = [int(pin_id) for pin_id in pin_ids.split(",")]
+    for potentiostat in potentiostats.values():
+        if potentiostat.trigger_pin_id in pin_ids:
+            write_message(
+                f"Error: pin {potentiostat.trigger_pin_id} is a trigger pin, it cannot be captured."
+            )
+            return
+    capture.arm(pin_ids, interval_ms)
+    write_message(
+        f"Success: Capturing the edges of pins {pin_ids}, streamed every {interval_ms} ms."
+    )
+
+
+def stop_capture():
+    capture.disarm()
+    write_message("Success: Capture stopped.")
+
+
+def waveform_info():
+    write_message(
+        f"Info: Waveform: rate {waveform.rate} Hz, points {waveform.count}, range {waveform.low} to {waveform.high} V, playing {waveform.playing}"
+    )
+
+
+# play the waveform cycles times (0 until stopped), the CPU is not involved until it is done
+def play_waveform(cycles=1):
+    start = waveform.play(cycles)
+    output.add(b"Success: Waveform playing: start ").add_int(start)
+    output.add(b" us, cycles ").add_int(waveform.cycles)
+    if waveform.cycles:
+        output.add(b", duration ").add_int(waveform.duration_us // 1000).add(b" ms")
+    output.end_line()
+
+
+def stop_waveform():
+    if not waveform.playing:
+        write_message("Info: No waveform playing.")
+        return
+    cycle, point = waveform.stop()
+    write_message(f"Success: Waveform stopped at cycle {cycle}, point {point}.")
+
+
+# stream the conversions of the ADC channels, rate_hz per channel, see pump_control_gui/adc_receiver.py
+def start_adc(channels, rate_hz):
+    channels = [int(channel) for channel in channels.split(",")]
+    start = adc.start(channels, int(rate_hz))
+    write_message(
+        f"Success: ADC streaming: channels {','.join(map(str, adc.channels))}, conversion rate {adc.rate} Hz, block {adc.block_bytes // 2} samples, start {start} us"
+    )
+
+
+def stop_adc():
+    if not adc.running:
+        write_message("Info: No ADC streaming.")
+        return
+    adc.stop()
+    write_message(f"Info: ADC stopped: blocks {adc.sent}, dropped {adc.dropped}")
+
+
 # function to return the version of the script
 def ping():
     global version
-    write_message(f"Ping: Pico Potentiostats Control Version {version}")
+    write_message(
+        f"Ping: Pico Potentiostats Control Version {version}, {boot_summary()}"
+    )
 
 
 # a function to reset the device, equivalent to a hard reset
@@ -194,6 +390,8 @@ def hard_reset():
 def save_potentiostats(potentiostat_num=0):
     global potentiostats, SAVE_FILE
     try:
+        # the saved pin values are read back from the pins, so the queued writes are applied first
+        actuator.wait_idle()
         if potentiostat_num == 0:
             # Overwrite the file completely when saving all potentiostats
             data = {
@@ -257,7 +455,9 @@ def load_potentiostats():
 def get_time():
     try:
         year, month, day, _, hour, minute, second, _ = rtc.datetime()
-        write_message(f"RTC Time: {year}-{month}-{day} {hour}:{minute}:{second}")
+        output.add(b"RTC Time: ").add_int(year).add(b"-").add_int(month)
+        output.add(b"-").add_int(day).add(b" ").add_int(hour)
+        output.add(b":").add_int(minute).add(b":").add_int(second).end_line()
     except Exception as e:
         write_message(f"Error: Could not get RTC time, {e}")
 
@@ -353,6 +553,8 @@ def set_name(name):
 commands = {
     "toggle_trigger": "toggle_trigger",
     "set_trigger": "set_trigger",
+    "pulse": "pulse",
+    "stop_pulse": "stop_pulse",
     "reset": "hard_reset",
 }
 
@@ -382,13 +584,35 @@ def help(simple=True):
         "  - shutdown: Shutdown all potentiostats or a specific potentiostat (potentiostat_number:0 for all).\n"
         "  - toggle_trigger: Toggle the trigger pin of a specific potentiostat.\n"
         "  - set_trigger: Set the trigger pin of a specific potentiostat to either 'HIGH' or 'LOW'.\n"
+        "  - pulse:width_us:count:period_us:delay_us: Send count pulses (default 1) of width_us on the trigger pin, one every period_us, the first one delay_us after the command, timed by a PIO state machine.\n"
+        "  - stop_pulse: Stop the pulse train on the trigger pin.\n"
         "  - reset: Perform a hard reset of the controller.\n"
+        "  - latency: Report the latency from a queued pin write to the pin change on core1.\n"
+        "  - bench_native:iterations: Compare the Python and viper versions of the hot paths (default 1000 iterations).\n"
+        "  - events: Dump the pin changes logged since the last dump as time_us,pin,old,new,command.\n"
+        "  - capture:pin,pin,...:interval_ms: Timestamp the rising and falling edges of the input pins, e.g. the digital outputs of the potentiostats, and stream the new ones every interval_ms (default 10, 0 only with captures) as 'Captures:' lines in the events format.\n"
+        "  - stop_capture: Stop timestamping the edges of the input pins.\n"
+        "  - captures: Dump the edges captured since the last dump.\n"
+        "  - dac_setup:sclk_pin:sdi_pin:sync_pin:range: Drive the AD5761 DAC from a PIO state machine, reset it and set its output range (0: -10 to 10 V, 1: 0 to 10 V, 2: -5 to 5 V, 3: 0 to 5 V, 4: -2.5 to 7.5 V, 5: -3 to 3 V, 6: 0 to 16 V, 7: 0 to 20 V), default '0:dac_setup:6:7:5:1'.\n"
+        "  - dac_write:volts: Write a potential to the DAC.\n"
+        "  - wave_clear:rate_hz: Start a new waveform updated rate_hz times per second (about 2 kHz to 100 kHz).\n"
+        "  - wave_step:volts:duration_ms: Append a constant potential to the waveform.\n"
+        "  - wave_ramp:start_volts:end_volts:duration_ms: Append a linear ramp to the waveform.\n"
+        "  - wave_sine:offset_volts:amplitude_volts:frequency_hz:duration_ms: Append a sine to the waveform.\n"
+        "  - wave_play:cycles: Play the waveform cycles times (default 1, 0 until wave_stop) by DMA, paced by the DMA timer.\n"
+        "  - wave_stop: Stop the waveform, the DAC keeps the last potential.\n"
+        "  - wave_info: Get the rate, points and range of the waveform.\n"
+        "  - adc_start:channel,channel,...:rate_hz: Convert the ADC channels (0 to 3, 4 for the temperature) rate_hz times per second each, up to 100000 conversions per second in total, and stream them in binary blocks, a line 'ADC block: seq n, time time_us, bytes size' followed by the little-endian uint16 conversions in round-robin order.\n"
+        "  - adc_stop: Stop the ADC streaming.\n"
+        "  - diag: Report the free heap, garbage collections and heap allocated per command since the last diag.\n"
         "  - help: Show this help message.\n"
         "Example usage:\n"
         "  - To register a potentiostat 1: '1:reg:0:0:LOW'\n"
         "    (potentiostat_number: 1, trigger_pin_id: 0, initial_trigger_pin_value: 0, initial_trigger_status: LOW)\n"
         "  - To toggle the trigger pin of potentiostat 1: '1:toggle_trigger'\n"
         "  - To set the trigger pin of potentiostat 1 to HIGH: '1:set_trigger:HIGH'\n"
+        "  - To timestamp the edges of pins 14 and 15: '0:capture:14,15:10'\n"
+        "  - To play 10 periods of a 50 Hz sine around 5 V: '0:wave_clear:10000', '0:wave_sine:5:1:50:20', '0:wave_play:10'\n"
         "Note:\n"
         "  - global commands for potentiostat 0: 'status', 'info', 'clear_po', 'save_po', 'shutdown'.\n"
         "  - potentiostat specific commands for potentiostat 0: 'toggle_power', 'set_power', 'toggle_direction', 'set_direction', 'reset'.\n"
@@ -399,9 +623,16 @@ def help(simple=True):
         write_message(help_text_simple + help_text)
 
 
-# Create a poll object to monitor stdin, which will block until there is input for reading
-poll_obj = select.poll()
-poll_obj.register(sys.stdin, select.POLLIN)
+# maximum number of commands executed back-to-back per wakeup, the rest of a burst is read on the next iteration
+MAX_BATCH = 8
+# longest wait for input while a pulse train runs, the end of the train is detected within this time
+PULSE_POLL_MS = 1
+# same for the end of a waveform
+WAVEFORM_POLL_MS = 10
+# same for the ADC blocks, a block takes 10 ms at the highest rate
+ADC_POLL_MS = 2
+# Create a line reader to monitor stdin, which will block until there is input for reading
+reader = LineReader(max_batch=MAX_BATCH)
 
 
 def main():
@@ -420,20 +651,43 @@ def main():
 
     # Load the potentiostats at startup
     load_potentiostats()
+    # run the actuation loop on core1, core0 keeps the serial parsing and the saves
+    actuator.start()
+    # the firmware is ready, record the boot time and the free heap for the ping reply
+    mark_ready()
     while True:
         try:
             if not led_blinking_mode:
                 led.value(1)
-            # Wait for input on stdin
-            poll_results = poll_obj.poll()
-
-            if poll_results:
-                # Read the data from stdin (PC console input) and strip the newline character
-                data = sys.stdin.readline().strip()
-                if not led_blinking_mode:
-                    led.value(0)
-
+            # Wait for input on stdin and read all complete lines received (PC console input)
+            # the wait is bounded while a pulse train runs, a waveform plays or the captured edges are streamed
+            timeout_ms = capture.timeout_ms()
+            if waveform.done():
+                write_message("Info: Waveform done.")
+            elif waveform.playing and waveform.cycles:
+                if timeout_ms < 0 or timeout_ms > WAVEFORM_POLL_MS:
+                    timeout_ms = WAVEFORM_POLL_MS
+            if adc.running:
+                adc.send(output)
+                if timeout_ms < 0 or timeout_ms > ADC_POLL_MS:
+                    timeout_ms = ADC_POLL_MS
+            for potentiostat in potentiostats.values():
+                if potentiostat.pulse_train:
+                    timeout_ms = PULSE_POLL_MS
+                    potentiostat.poll_pulse()
+            capture.stream(output)
+            lines = reader.read_lines(timeout_ms)
+            if lines and not led_blinking_mode:
+                led.value(0)
+
+            for data in lines:
+                heap_monitor.before_command()
+                actuator.command_id = heap_monitor.commands
+                capture.command_id = heap_monitor.commands
                 # Validate the input data
+                if data is None:
+                    write_message("Error: Input too long.")
+                    continue
                 if not data or data == "":
                     write_message("Error: Empty input.")
                     continue
@@ -454,6 +708,47 @@ def main():
                         help(simple=False)
                     elif command == "ping":
                         ping()
+                    elif command == "diag":
+                        heap_monitor.report(output)
+                    elif command == "latency":
+                        actuator.report(output)
+                    elif command == "events":
+                        events.dump(output)
+                    elif command == "capture":
+                        if len(parts) in (3, 4):
+                            start_capture(
+                                parts[2],
+                                int(parts[3]) if len(parts) == 4 else CAPTURE_STREAM_MS,
+                            )
+                        else:
+                            write_message(
+                                "Error: Invalid input, expected format '0:capture:pin,pin,...:interval_ms'"
+                            )
+                    elif command == "stop_capture":
+                        stop_capture()
+                    elif command == "captures":
+                        capture.log.dump(output, b"Captures")
+                    elif command in waveform_commands:
+                        method = getattr(waveform, waveform_commands[command])
+                        method(*[float(value) for value in parts[2:]])
+                        waveform_info()
+                    elif command == "wave_play":
+                        play_waveform(int(parts[2]) if len(parts) > 2 else 1)
+                    elif command == "wave_stop":
+                        stop_waveform()
+                    elif command == "wave_info":
+                        waveform_info()
+                    elif command == "adc_start":
+                        if len(parts) == 4:
+                            start_adc(parts[2], parts[3])
+                        else:
+                            write_message(
+                                "Error: Invalid input, expected format '0:adc_start:channel,channel,...:rate_hz'"
+                            )
+                    elif command == "adc_stop":
+                        stop_adc()
+                    elif command == "bench_native":
+                        bench_native(output, int(parts[2]) if len(parts) > 2 else 1000)
                     elif command == "reg":
                         if len(parts) == 5:
                             trigger_pin_id = int(parts[2])
@@ -588,6 +883,7 @@ def main():
                         )
                 except Exception as cmd_error:
                     write_message(f"Error: {cmd_error}")
+                heap_monitor.after_command()
         except Exception as e:
             global_shutdown()
             write_message(f"Error: {e}")
@@ -1,9 +1,14 @@
-import os
+import gc
 import sys
-import json
-import select
+import time
 import machine
-from bootloader_util import set_bootloader_mode
+from bootloader_util import set_bootloader_mode, mark_ready, boot_summary
+from output_util import OutputBuffer, HeapMonitor, NullStream
+from input_util import LineReader
+from journal_util import Journal
+from actuator_util import Actuator
+from event_util import EventLog
+from bench_util import bench_native
 
 # a dictionary to store the pumps, the key is the pump number and the value is the pump instance
 rtc = machine.RTC()
@@ -12,11 +17,34 @@ config = {}
 version = "1.00"
 SAVE_FILE = "pumps_config.json"
 CONFIG_FILE = "pump_control_config.json"
+# the saves are appended to the journal files and merged into the save files on compaction
+SAVE_JOURNAL_FILE = "pumps_config.log"
+CONFIG_JOURNAL_FILE = "pump_control_config.log"
+pumps_journal = Journal(SAVE_FILE, SAVE_JOURNAL_FILE)
+config_journal = Journal(CONFIG_FILE, CONFIG_JOURNAL_FILE)
+# preallocated buffer for the frequently polled responses and the heap statistics for the diag command
+output = OutputBuffer()
+heap_monitor = HeapMonitor()
+# pre-encoded status values for the output buffer
+STATUS_BYTES = {"ON": b"ON", "OFF": b"OFF", "CW": b"CW", "CCW": b"CCW"}
+# the pin writes are applied on core1, started in main(), and the pin changes are logged for the events command
+events = EventLog()
+actuator = Actuator(events=events)
+
+
+# generic function to write a message to the console, the newline is written separately to avoid a new string
+def write_message(message):
+    sys.stdout.write(message)
+    sys.stdout.write("\n")
 
 
-# generic function to write a message to the console
-def write_message(message):
-    sys.stdout.write(f"{message}\n")
+# append a status value to the output buffer, pre-encoded when possible
+def add_status_value(value):
+    data = STATUS_BYTES.get(value)
+    if data is None:
+        output.add_str(value)
+    else:
+        output.add(data)
 
 
 # Each pump class will have a power and direction Pin, defined at initialization
@@ -55,41 +83,43 @@ class Pump:
         self.direction_status = self.initial_direction_status
 
     def toggle_power(self):
-        # flip the power Pin value and update the power status
-        self.power_pin.value(not self.power_pin.value())
-        # update the power status
+        # flip the power status, the pin value follows from the status since the write may still be queued
         if self.power_status == "ON":
-            self.power_status = "OFF"
+            self.set_power("OFF")
         else:
-            self.power_status = "ON"
+            self.set_power("ON")
 
     def set_power(self, status: str):
         status = status.upper()
         if status not in ["ON", "OFF"]:
             write_message("Error: Invalid power status, expected 'ON' or 'OFF'")
             return
-        if status == self.initial_power_status:
-            self.power_pin.value(self.initial_power_pin_value)
-        else:
-            self.power_pin.value(not self.initial_power_pin_value)
+        actuator.write_pin(self.power_pin_id, self.power_pin_value(status))
         self.power_status = status
 
+    # pin values for a power or direction status
+    def power_pin_value(self, status):
+        if status == self.initial_power_status:
+            return self.initial_power_pin_value
+        return int(not self.initial_power_pin_value)
+
+    def direction_pin_value(self, direction):
+        if direction == self.initial_direction_status:
+            return self.initial_direction_pin_value
+        return int(not self.initial_direction_pin_value)
+
     def toggle_direction(self):
-        self.direction_pin.value(not self.direction_pin.value())
         if self.direction_status == "CW":
-            self.direction_status = "CCW"
+            self.set_direction("CCW")
         else:
-            self.direction_status = "CW"
+            self.set_direction("CW")
 
     def set_direction(self, direction: str):
         direction = direction.upper()
         if direction not in ["CW", "CCW"]:
             write_message("Error: Invalid direction status, expected 'CW' or 'CCW'")
             return
-        if direction == self.initial_direction_status:
-            self.direction_pin.value(self.initial_direction_pin_value)
-        else:
-            self.direction_pin.value(not self.initial_direction_pin_value)
+        actuator.write_pin(self.direction_pin_id, self.direction_pin_value(direction))
         self.direction_status = direction
 
     def hard_reset(self):
@@ -100,11 +130,24 @@ class Pump:
     def shutdown(self):
         self.set_power("OFF")
 
-    def get_status(self):
-        return f"Power: {self.power_status}, Direction: {self.direction_status}"
-
-    def get_info(self):
-        return f"Power Pin: {self.power_pin_id}, Direction Pin: {self.direction_pin_id}, Initial Power Pin Value: {self.initial_power_pin_value}, Initial Direction Pin Value: {self.initial_direction_pin_value}, Current Power Status: {self.power_status}, Current Direction Status: {self.direction_status}"
+    # append the status to the output buffer, e.g. "Power: ON, Direction: CW"
+    def add_status(self):
+        output.add(b"Power: ")
+        add_status_value(self.power_status)
+        output.add(b", Direction: ")
+        add_status_value(self.direction_status)
+
+    def add_info(self):
+        output.add(b"Power Pin: ").add_int(self.power_pin_id)
+        output.add(b", Direction Pin: ").add_int(self.direction_pin_id)
+        output.add(b", Initial Power Pin Value: ").add_int(self.initial_power_pin_value)
+        output.add(b", Initial Direction Pin Value: ").add_int(
+            self.initial_direction_pin_value
+        )
+        output.add(b", Current Power Status: ")
+        add_status_value(self.power_status)
+        output.add(b", Current Direction Status: ")
+        add_status_value(self.direction_status)
 
     def to_dict(self):
         return {
@@ -129,27 +172,40 @@ class Pump:
 
 
 # functions to assemble and send status, when pump_name is 0, it will send status/info for all pumps
+# the line is assembled in the output buffer, iterating the keys avoids the (key, value) tuples of items()
 def pump_status(pump_name=0):
     global pumps
     if pump_name == 0:
-        status = ", ".join(
-            [f"Pump{i} Status: {pump.get_status()}" for i, pump in pumps.items()]
-        )
-        write_message(status)
+        separator = False
+        for i in pumps:
+            if separator:
+                output.add(b", ")
+            separator = True
+            output.add(b"Pump").add_int(i).add(b" Status: ")
+            pumps[i].add_status()
+        output.end_line()
     elif pump_name in pumps:
-        write_message(f"Pump{pump_name} Status: {pumps[pump_name].get_status()}")
+        output.add(b"Pump").add_int(pump_name).add(b" Status: ")
+        pumps[pump_name].add_status()
+        output.end_line()
 
 
 # functions to assemble and send info, when pump_name is 0, it will send status/info for all pumps
 def pump_info(pump_name=0):
     global pumps
     if pump_name == 0:
-        info = ", ".join(
-            [f"Pump{i} Info: {pump.get_info()}" for i, pump in pumps.items()]
-        )
-        write_message(info)
+        separator = False
+        for i in pumps:
+            if separator:
+                output.add(b", ")
+            separator = True
+            output.add(b"Pump").add_int(i).add(b" Info: ")
+            pumps[i].add_info()
+        output.end_line()
     elif pump_name in pumps:
-        write_message(f"Pump{pump_name} Info: {pumps[pump_name].get_info()}")
+        output.add(b"Pump").add_int(pump_name).add(b" Info: ")
+        pumps[pump_name].add_info()
+        output.end_line()
 
 
 # function to register a pump, if the pump already exists, it will update the pins
@@ -198,6 +254,35 @@ def register_pump(
         write_message(f"Error: registering pump {pump_num} failed, {e}")
 
 
+# switch several pumps at once, targets is a list of (pump_num, power_status, direction_status) where a status
+# of None is left unchanged, the pin masks of all pumps are computed first and applied in a single register write
+# by the actuation loop on core1
+def set_pumps(targets):
+    set_mask = 0
+    clear_mask = 0
+    for pump_num, power, direction in targets:
+        pump = pumps[pump_num]
+        if power is not None:
+            if pump.power_pin_value(power):
+                set_mask |= 1 << pump.power_pin_id
+            else:
+                clear_mask |= 1 << pump.power_pin_id
+        if direction is not None:
+            if pump.direction_pin_value(direction):
+                set_mask |= 1 << pump.direction_pin_id
+            else:
+                clear_mask |= 1 << pump.direction_pin_id
+    if set_mask & clear_mask:
+        raise ValueError("Conflicting pin values, a pin is set both high and low")
+    actuator.submit(set_mask, clear_mask)
+    for pump_num, power, direction in targets:
+        pump = pumps[pump_num]
+        if power is not None:
+            pump.power_status = power
+        if direction is not None:
+            pump.direction_status = direction
+
+
 # function to reset the controller, it will remove all pumps
 def clear_pumps(pump_num=0):
     global pumps
@@ -224,51 +309,36 @@ def global_shutdown():
 # function to return the version of the script
 def ping():
     global version
-    write_message(f"Ping: Pico Pump Control Version {version}")
+    write_message(f"Ping: Pico Pump Control Version {version}, {boot_summary()}")
 
 
 # function to save the current state of the pumps to a JSON file
 def save_pumps(pump_num=0):
     global pumps, SAVE_FILE
     try:
+        # the saved pin values are read back from the pins, so the queued writes are applied first
+        actuator.wait_idle()
         if pump_num == 0:
             # Overwrite the file completely when saving all pumps
             data = {str(num): pump.to_dict() for num, pump in pumps.items()}
-            with open(SAVE_FILE, "w") as file:
-                json.dump(data, file)
+            pumps_journal.replace(data)
             write_message(f"Success: All pumps saved to {SAVE_FILE}.")
         else:
-            # Save a specific pump, check if it's new or existing
-            pump_data = {str(pump_num): pumps[pump_num].to_dict()}
-            files = os.listdir(os.getcwd())
-
-            if SAVE_FILE in files:
-                with open(SAVE_FILE, "r") as file:
-                    existing_data = json.load(file)
-            else:
-                existing_data = {}
-
-            # Update the entire file
-            existing_data.update(pump_data)
-            with open(SAVE_FILE, "w") as file:
-                json.dump(existing_data, file)
-
+            # Save a specific pump, only its record is appended to the journal
+            pumps_journal.update({str(pump_num): pumps[pump_num].to_dict()})
             write_message(f"Success: Pump {pump_num} saved to {SAVE_FILE}.")
     except Exception as e:
         write_message(f"Error: Could not save pumps, {e}")
 
 
-# function to load the pumps state from a JSON file
+# function to load the pumps state from the save file and its journal
 def load_pumps():
     global pumps, SAVE_FILE
     try:
-        # Check if the file exists using os.listdir() and os.getcwd()
-        files = os.listdir(os.getcwd())
-        if SAVE_FILE in files:
-            with open(SAVE_FILE, "r") as file:
-                data = json.load(file)
-                for key, value in data.items():
-                    pumps[int(key)] = Pump.from_dict(value)
+        data = pumps_journal.load()
+        if data is not None:
+            for key, value in data.items():
+                pumps[int(key)] = Pump.from_dict(value)
         else:
             write_message(
                 f"Info: No save file found ({SAVE_FILE}). Starting with default pumps."
@@ -286,29 +356,26 @@ def load_pumps():
         write_message(f"Error: Could not load pumps, {e}")
 
 
-# function to load the configuration from a JSON file
+# function to load the configuration from the config file and its journal
 def load_config():
     global config, CONFIG_FILE
     try:
-        # Check if the file exists using os.listdir() and os.getcwd()
-        files = os.listdir(os.getcwd())
-        if CONFIG_FILE in files:
-            with open(CONFIG_FILE, "r") as file:
-                data = json.load(file)
-                config = data
-                # set the RTC time to the config time
-                rtc.datetime(
-                    (
-                        config["year"],
-                        config["month"],
-                        config["day"],
-                        0,
-                        config["hour"],
-                        config["minute"],
-                        config["second"],
-                        0,
-                    )
+        data = config_journal.load()
+        if data is not None:
+            config = data
+            # set the RTC time to the config time
+            rtc.datetime(
+                (
+                    config["year"],
+                    config["month"],
+                    config["day"],
+                    0,
+                    config["hour"],
+                    config["minute"],
+                    config["second"],
+                    0,
                 )
+            )
         else:
             config = {
                 "name": "Not Set",
@@ -319,7 +386,7 @@ def load_config():
                 "minute": 0,
                 "second": 0,
             }
-            save_config()
+            save_config(*config)
             write_message(
                 f"Info: No config file found ({CONFIG_FILE}). Starting with default config."
             )
@@ -327,19 +394,21 @@ def load_config():
         write_message(f"Error: Could not load config, {e}")
 
 
-# function to save the current configuration to a JSON file
-def save_config():
+# function to save the current configuration, the RTC time and the changed keys are appended to the config journal
+def save_config(*keys):
     global config, CONFIG_FILE
     try:
-        with open(CONFIG_FILE, "w") as file:
-            year, month, day, _, hour, minute, second, _ = rtc.datetime()
-            config["year"] = year
-            config["month"] = month
-            config["day"] = day
-            config["hour"] = hour
-            config["minute"] = minute
-            config["second"] = second
-            json.dump(config, file)
+        year, month, day, _, hour, minute, second, _ = rtc.datetime()
+        config["year"] = year
+        config["month"] = month
+        config["day"] = day
+        config["hour"] = hour
+        config["minute"] = minute
+        config["second"] = second
+        record = {key: config[key] for key in keys}
+        for key in ("year", "month", "day", "hour", "minute", "second"):
+            record[key] = config[key]
+        config_journal.update(record)
         write_message("Info: Config saved.")
     except Exception as e:
         write_message(f"Error: Could not save config, {e}")
@@ -349,7 +418,9 @@ def save_config():
 def get_time():
     try:
         year, month, day, _, hour, minute, second, _ = rtc.datetime()
-        write_message(f"RTC Time: {year}-{month}-{day} {hour}:{minute}:{second}")
+        output.add(b"RTC Time: ").add_int(year).add(b"-").add_int(month)
+        output.add(b"-").add_int(day).add(b" ").add_int(hour)
+        output.add(b":").add_int(minute).add(b":").add_int(second).end_line()
     except Exception as e:
         write_message(f"Error: Could not get RTC time, {e}")
 
@@ -377,21 +448,375 @@ def get_name():
 def set_name(name):
     try:
         config["name"] = name
-        save_config()
+        save_config("name")
         write_message(f"Success: Name set to {name}")
     except Exception as e:
         write_message(f"Error: Could not set name, {e}")
 
 
-# Define a dictionary for pump specific commands
+# validators check and convert the arguments of a command before the handler is called,
+# they raise ValueError with the expected format
+def no_args(args):
+    return ()
+
+
+def reg_args(args):
+    if len(args) != 6:
+        raise ValueError(
+            "Invalid input, expected format 'pump_number:reg:power_pin:direction_pin:initial_power_pin_value:initial_direction_pin_value:initial_power_status:initial_direction_status'"
+        )
+    # check if the initial power and direction status are valid
+    if args[4].upper() not in ("ON", "OFF"):
+        raise ValueError("Invalid initial power status, expected 'ON' or 'OFF'")
+    if args[5].upper() not in ("CW", "CCW"):
+        raise ValueError("Invalid initial direction status, expected 'CW' or 'CCW'")
+    return (int(args[0]), int(args[1]), int(args[2]), int(args[3]), args[4], args[5])
+
+
+def stime_args(args):
+    if len(args) != 6:
+        raise ValueError(
+            "Invalid input, expected format '0:stime:year:month:day:hour:minute:second'"
+        )
+    return (
+        int(args[0]),
+        int(args[1]),
+        int(args[2]),
+        int(args[3]),
+        int(args[4]),
+        int(args[5]),
+    )
+
+
+def mode_args(args):
+    return (str(args[0]) if args else "None",)
+
+
+def name_args(args):
+    if len(args) != 1:
+        raise ValueError("Invalid input, expected format '0:set_name:name'")
+    return (args[0].strip(),)
+
+
+def power_args(args):
+    if len(args) != 1:
+        raise ValueError("Invalid input, expected format 'pump_number:set_power:ON'")
+    return (args[0],)
+
+
+def direction_args(args):
+    if len(args) != 1:
+        raise ValueError(
+            "Invalid input, expected format 'pump_number:set_direction:CW'"
+        )
+    return (args[0],)
+
+
+# parse the pump targets, e.g. '1=ON/CW;2=OFF;5=ON/CCW', the power or the direction can be omitted
+def pump_targets_args(args):
+    if len(args) != 1 or not args[0].strip():
+        raise ValueError(
+            "Invalid input, expected format '0:batch:pump_number=ON/CW;pump_number=OFF'"
+        )
+    targets = []
+    for item in args[0].split(";"):
+        if not item.strip():
+            continue
+        num, _, values = item.partition("=")
+        if not num.strip().isdigit() or int(num) not in pumps:
+            raise ValueError(
+                f"Invalid pump number '{num.strip()}', available pumps are: "
+                + ", ".join(map(str, pumps.keys()))
+            )
+        power = None
+        direction = None
+        for value in values.split("/"):
+            value = value.strip().upper()
+            if value in ("ON", "OFF"):
+                power = value
+            elif value in ("CW", "CCW"):
+                direction = value
+            else:
+                raise ValueError(
+                    f"Invalid status '{value}' for pump {num.strip()}, expected 'ON', 'OFF', 'CW' or 'CCW'"
+                )
+        targets.append((int(num), power, direction))
+    return (targets,)
+
+
+def bench_args(args):
+    iterations = int(args[0]) if args else 100
+    if iterations < 1:
+        raise ValueError("Invalid input, expected format '0:bench:iterations'")
+    return (iterations,)
+
+
+def bench_native_args(args):
+    return (int(args[0]) if args else 1000,)
+
+
+# LED state, initialized in main()
+led = None
+led_timer = None
+led_blinking_mode = False
+
+
+def blink_led(timer):
+    led.toggle()
+
+
+# handlers of the controller commands, called with the pump number and the validated arguments
+def cmd_help(pump_num):
+    help(simple=False)
+
+
+def cmd_ping(pump_num):
+    ping()
+
+
+def cmd_reg(pump_num, *args):
+    register_pump(pump_num, *args)
+
+
+def cmd_time(pump_num):
+    get_time()
+
+
+def cmd_stime(pump_num, *args):
+    set_time(*args)
+
+
+def cmd_set_mode(pump_num, mode):
+    try:
+        set_bootloader_mode(mode)
+        write_message(f"Success: bootloader set to {mode} mode")
+    except Exception as e:
+        write_message(f"Error: {e}")
+
+
+def cmd_bootsel(pump_num):
+    try:
+        write_message("Success: Entering BOOTSEL mode")
+        machine.bootloader()
+    except Exception as e:
+        write_message(f"Error: {e}")
+
+
+def cmd_blink_en(pump_num):
+    global led_blinking_mode
+    if not led_blinking_mode:
+        led_blinking_mode = True
+        led_timer.init(period=200, mode=machine.Timer.PERIODIC, callback=blink_led)
+        write_message("Info: LED blinking mode enabled.")
+    else:
+        write_message("Info: LED blinking mode is already enabled.")
+
+
+def cmd_blink_dis(pump_num):
+    global led_blinking_mode
+    if led_blinking_mode:
+        led_blinking_mode = False
+        led_timer.deinit()
+        led.value(1)
+        write_message("Info: LED blinking mode disabled.")
+
+
+def cmd_get_name(pump_num):
+    get_name()
+
+
+def cmd_set_name(pump_num, name):
+    set_name(name)
+
+
+def cmd_status(pump_num):
+    pump_status(pump_num)
+
+
+def cmd_info(pump_num):
+    pump_info(pump_num)
+
+
+def cmd_clear_pumps(pump_num):
+    clear_pumps(pump_num)
+
+
+def cmd_save_pumps(pump_num):
+    save_pumps(pump_num)
+
+
+def cmd_shutdown(pump_num):
+    if pump_num == 0:
+        global_shutdown()
+    else:
+        run_pump_command(pump_num, Pump.shutdown, ())
+
+
+def cmd_set_pumps(pump_num, targets):
+    set_pumps(targets)
+    write_message(
+        "Success: Pumps " + ", ".join(str(target[0]) for target in targets) + " set."
+    )
+
+
+# apply all pump targets together and reply with one status line of the pumps in the batch
+def cmd_batch(pump_num, targets):
+    set_pumps(targets)
+    separator = False
+    for target in targets:
+        if separator:
+            output.add(b", ")
+        separator = True
+        output.add(b"Pump").add_int(target[0]).add(b" Status: ")
+        pumps[target[0]].add_status()
+    output.end_line()
+
+
+def cmd_bench(pump_num, iterations):
+    bench(iterations)
+
+
+def cmd_bench_native(pump_num, iterations):
+    bench_native(output, iterations)
+
+
+def cmd_diag(pump_num):
+    heap_monitor.report(output)
+
+
+def cmd_latency(pump_num):
+    actuator.report(output)
+
+
+def cmd_events(pump_num):
+    events.dump(output)
+
+
+# Define a dictionary for the controller commands, the value is (handler, validator)
 commands = {
-    "toggle_power": "toggle_power",
-    "set_power": "set_power",
-    "toggle_direction": "toggle_direction",
-    "set_direction": "set_direction",
-    "reset": "hard_reset",
+    "help": (cmd_help, no_args),
+    "ping": (cmd_ping, no_args),
+    "reg": (cmd_reg, reg_args),
+    "time": (cmd_time, no_args),
+    "stime": (cmd_stime, stime_args),
+    "set_mode": (cmd_set_mode, mode_args),
+    "bootsel": (cmd_bootsel, no_args),
+    "blink_en": (cmd_blink_en, no_args),
+    "blink_dis": (cmd_blink_dis, no_args),
+    "get_name": (cmd_get_name, no_args),
+    "set_name": (cmd_set_name, name_args),
+    "status": (cmd_status, no_args),
+    "info": (cmd_info, no_args),
+    "clear_pumps": (cmd_clear_pumps, no_args),
+    "save_pumps": (cmd_save_pumps, no_args),
+    "shutdown": (cmd_shutdown, no_args),
+    "set_pumps": (cmd_set_pumps, pump_targets_args),
+    "batch": (cmd_batch, pump_targets_args),
+    "bench": (cmd_bench, bench_args),
+    "bench_native": (cmd_bench_native, bench_native_args),
+    "diag": (cmd_diag, no_args),
+    "latency": (cmd_latency, no_args),
+    "events": (cmd_events, no_args),
 }
 
+# Define a dictionary for pump specific commands, the value is (Pump method, validator),
+# the methods are looked up once here instead of with getattr on every command
+pump_commands = {
+    "toggle_power": (Pump.toggle_power, no_args),
+    "set_power": (Pump.set_power, power_args),
+    "toggle_direction": (Pump.toggle_direction, no_args),
+    "set_direction": (Pump.set_direction, direction_args),
+    "reset": (Pump.hard_reset, no_args),
+}
+pump_commands_string = ", ".join(pump_commands)
+
+
+# run a pump method on a specific pump, or on all pumps for pump 0
+def run_pump_command(pump_num, method, args):
+    if pump_num == 0:
+        for pump in pumps.values():
+            method(pump, *args)
+    elif pump_num in pumps:
+        method(pumps[pump_num], *args)
+    else:
+        write_message(
+            f"Error: Invalid pump number '{pump_num}', available pumps are: "
+            + ", ".join(map(str, pumps.keys()))
+        )
+
+
+# parse a command line and call its handler, the format is [pump_number]:[command]:[additional_parameters]
+def dispatch(data):
+    parts = data.split(":")
+    if parts[0].isdigit():
+        pump_num = int(parts[0])
+        command = parts[1] if len(parts) > 1 else ""
+        args = parts[2:]
+    else:
+        pump_num = 0
+        command = parts[0]
+        args = parts[1:]
+
+    # the host sends lower case commands, only normalize when the exact lookup misses
+    entry = commands.get(command)
+    if entry is None:
+        entry = commands.get(command.strip().lower())
+    if entry is not None:
+        handler, validator = entry
+        handler(pump_num, *validator(args))
+        return
+
+    entry = pump_commands.get(command)
+    if entry is None:
+        entry = pump_commands.get(command.strip().lower())
+    if entry is None:
+        write_message(
+            f"Error: Invalid command '{command}', available pump commands are: "
+            + pump_commands_string
+        )
+        return
+    method, validator = entry
+    run_pump_command(pump_num, method, validator(args))
+
+
+# run a canned command mix through the dispatcher with the output muted and report the command rate
+def bench(iterations=100):
+    global write_message
+    mix = ["0:status", "0:info", "time", "get_name", "ping"]
+    for pump_num, pump in pumps.items():
+        # setting the current state again leaves the pins unchanged
+        mix.append(f"{pump_num}:set_power:{pump.power_status}")
+        mix.append(f"{pump_num}:set_direction:{pump.direction_status}")
+        break
+    message_writer = write_message
+    write_message = lambda message: None
+    stream = output.stream
+    output.stream = NullStream()
+    try:
+        # heap allocated by one pass of the mix, with the garbage collector paused
+        gc.collect()
+        gc.disable()
+        alloc_start = gc.mem_alloc()
+        for data in mix:
+            dispatch(data)
+        alloc_bytes = gc.mem_alloc() - alloc_start
+        gc.enable()
+
+        start = time.ticks_us()
+        for _ in range(iterations):
+            for data in mix:
+                dispatch(data)
+        elapsed_us = max(1, time.ticks_diff(time.ticks_us(), start))
+    finally:
+        gc.enable()
+        write_message = message_writer
+        output.stream = stream
+    count = iterations * len(mix)
+    write_message(
+        f"Info: Bench {count} commands in {elapsed_us // 1000} ms, {count * 1000000 // elapsed_us} commands/s, "
+        f"{elapsed_us // count} us/command, {alloc_bytes // len(mix)} bytes/command."
+    )
+
 
 def help(simple=True):
     # assemble commands help text
@@ -421,6 +846,13 @@ def help(simple=True):
         "  - toggle_direction: Toggle the direction of a specific pump.\n"
         "  - set_direction: Set the direction of a specific pump to 'CW' or 'CCW'.\n"
         "  - reset: Perform a hard reset of the controller.\n"
+        "  - set_pumps: Switch several pumps in the same clock cycle, e.g. '0:set_pumps:1=ON/CW;2=OFF;5=ON/CCW'.\n"
+        "  - batch: Same as set_pumps, all targets are validated first and the reply is the status of the pumps in the batch.\n"
+        "  - bench:iterations: Measure the command rate with a canned command mix (default 100 iterations).\n"
+        "  - bench_native:iterations: Compare the Python and viper versions of the hot paths (default 1000 iterations).\n"
+        "  - latency: Report the latency from a queued pin write to the pin change on core1.\n"
+        "  - events: Dump the pin changes logged since the last dump as time_us,pin,old,new,command.\n"
+        "  - diag: Report the free heap, garbage collections and heap allocated per command since the last diag.\n"
         "  - help: Show this help message.\n"
         "Example usage:\n"
         "  - To register a pump: '1:reg:2:3:1:0:ON:CW'\n"
@@ -435,205 +867,49 @@ def help(simple=True):
         write_message(help_text_simple + help_text)
 
 
-# Create a poll object to monitor stdin, which will block until there is input for reading
-poll_obj = select.poll()
-poll_obj.register(sys.stdin, select.POLLIN)
+# maximum number of commands executed back-to-back per wakeup, the rest of a burst is read on the next iteration
+MAX_BATCH = 8
+# Create a line reader to monitor stdin, which will block until there is input for reading
+reader = LineReader(max_batch=MAX_BATCH)
 
 
 def main():
+    global led, led_timer
     led = machine.Pin("LED", machine.Pin.OUT, value=1)  # Initialize the LED Pin
-
-    def blink_led():
-        led.toggle()
-
-    timer = machine.Timer()  # Timer for blinking the LED
-    led_blinking_mode = False
-
-    # assemble a mapping from key to value in the commands dictionary
-    commands_mapping_string = ", ".join(
-        [f"'{key}': '{value}'" for key, value in commands.items()]
-    )
+    led_timer = machine.Timer()  # Timer for blinking the LED
 
     load_config()
     load_pumps()
+    # run the actuation loop on core1, core0 keeps the serial parsing and the saves
+    actuator.start()
+    # the firmware is ready, record the boot time and the free heap for the ping reply
+    mark_ready()
     while True:
         try:
             if not led_blinking_mode:
                 led.value(1)
-            # Wait for input on stdin
-            poll_results = poll_obj.poll()
-
-            if poll_results:
-                # Read the data from stdin (PC console input) and strip the newline character
-                data = sys.stdin.readline().strip()
-                if not led_blinking_mode:
-                    led.value(0)
-
+            # Wait for input on stdin and read all complete lines received (PC console input)
+            lines = reader.read_lines()
+            if lines and not led_blinking_mode:
+                led.value(0)
+
+            for data in lines:
+                heap_monitor.before_command()
+                actuator.command_id = heap_monitor.commands
                 # Validate the input data
-                if not data or data == "":
+                if data is None:
+                    write_message("Error: Input too long.")
+                    continue
+                if not data:
                     write_message("Error: Empty input.")
                     continue
-                parts = data.split(":")  # Split the data into pump id and command
-                if parts[0].isdigit():
-                    pump_num = int(parts[0])
-                    command = parts[1].strip().lower()
-                else:
-                    pump_num = 0
-                    command = parts[0].strip().lower()
-                    # insert a 0 to the first position of parts
-                    parts.insert(0, "0")
 
                 # check the input and call the appropriate function
                 try:
-                    # general global commands
-                    if command == "help":
-                        help(simple=False)
-                    elif command == "ping":
-                        ping()
-                    elif command == "reg":
-                        if len(parts) == 8:
-                            power_pin = int(parts[2])
-                            direction_pin = int(parts[3])
-                            initial_power_pin_value = int(parts[4])
-                            initial_direction_pin_value = int(parts[5])
-                            # check if the initial power status is valid
-                            if parts[6].upper() not in ["ON", "OFF"]:
-                                write_message(
-                                    "Error: Invalid initial power status, expected 'ON' or 'OFF'"
-                                )
-                                continue
-                            initial_power = parts[6]
-                            # check if the initial direction status is valid
-                            if parts[7].upper() not in ["CW", "CCW"]:
-                                write_message(
-                                    "Error: Invalid initial direction status, expected 'CW' or 'CCW'"
-                                )
-                                continue
-                            initial_direction = parts[7]
-
-                            register_pump(
-                                pump_num,
-                                power_pin,
-                                direction_pin,
-                                initial_power_pin_value,
-                                initial_direction_pin_value,
-                                initial_power,
-                                initial_direction,
-                            )
-                        else:
-                            write_message(
-                                "Error: Invalid input, expected format 'pump_number:reg:power_pin:direction_pin:initial_power_pin_value:initial_direction_pin_value:initial_power_status:initial_direction_status'"
-                            )
-                    elif command == "time":
-                        # Get current RTC time
-                        get_time()
-                    elif command == "stime":
-                        if len(parts) == 8:  # Adjusted length
-                            year = int(parts[2])
-                            month = int(parts[3])
-                            day = int(parts[4])
-                            hour = int(parts[5])
-                            minute = int(parts[6])
-                            second = int(parts[7])
-                            set_time(year, month, day, hour, minute, second)
-                        else:
-                            write_message(
-                                "Error: Invalid input, expected format '0:stime:year:month:day:day_of_week:hour:minute:second'"
-                            )
-                    elif command == "set_mode":
-                        if len(parts) >= 3:
-                            mode = str(parts[2])
-                        else:
-                            mode = "None"
-                        try:
-                            set_bootloader_mode(mode)
-                            write_message(f"Success: bootloader set to {mode} mode")
-                        except Exception as e:
-                            write_message(f"Error: {e}")
-                    elif command == "bootsel":
-                        try:
-                            write_message("Success: Entering BOOTSEL mode")
-                            machine.bootloader()
-                        except Exception as e:
-                            write_message(f"Error: {e}")
-                    elif command == "blink_en":
-                        if not led_blinking_mode:
-                            led_blinking_mode = True
-                            timer.init(
-                                period=200,
-                                mode=machine.Timer.PERIODIC,
-                                callback=lambda t: blink_led(),
-                            )
-                            write_message("Info: LED blinking mode enabled.")
-                        else:
-                            write_message("Info: LED blinking mode is already enabled.")
-                    elif command == "blink_dis":
-                        if led_blinking_mode:
-                            led_blinking_mode = False
-                            timer.deinit()
-                            led.value(1)
-                            write_message("Info: LED blinking mode disabled.")
-                    elif command == "get_name":
-                        get_name()
-                    elif command == "set_name":
-                        if len(parts) == 3:
-                            name = parts[2].strip()
-                            set_name(name)
-                        else:
-                            write_message(
-                                "Error: Invalid input, expected format '0:set_name:name'"
-                            )
-                    # start of global commands for pumps
-                    elif command == "status":
-                        pump_status(pump_num)
-                    elif command == "info":
-                        pump_info(pump_num)
-                    elif command == "clear_pumps":
-                        clear_pumps(pump_num)
-                    elif command == "save_pumps":
-                        save_pumps(pump_num)
-                    # start of pump specific commands
-                    elif pump_num == 0:
-                        if command == "shutdown":
-                            global_shutdown()
-                        elif command in commands:
-                            for pump in pumps.values():
-                                method = getattr(pump, commands[command], None)
-                                if method:
-                                    if len(parts) > 2:
-                                        method(*parts[2:])
-                                    else:
-                                        method()
-                        else:
-                            write_message(
-                                f"Error: Invalid command for pump '0' '{command}', available commands are: "
-                                + commands_mapping_string
-                            )
-                    elif pump_num in pumps:
-                        pump = pumps[pump_num]  # get the pump instance
-                        if command in commands:  # check if the command is valid
-                            method = getattr(pump, commands[command], None)
-                            if method:
-                                if len(parts) > 2:
-                                    method(*parts[2:])
-                                else:
-                                    method()
-                            else:
-                                write_message(
-                                    f"Error: Invalid instance specific command '{command}'"
-                                )
-                        else:
-                            write_message(
-                                f"Error: Invalid global command for pump '{pump_num}', available commands are: "
-                                + commands_mapping_string
-                            )
-                    else:
-                        write_message(
-                            f"Error: Invalid pump number '{pump_num}', available pumps are: "
-                            + ", ".join(map(str, pumps.keys()))
-                        )
+                    dispatch(data)
                 except Exception as cmd_error:
                     write_message(f"Error: {cmd_error}")
+                heap_monitor.after_command()
         except Exception as e:
             global_shutdown()
             write_message(f"Error: {e}")
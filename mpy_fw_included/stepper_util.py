@@ -0,0 +1,218 @@
+# stepper_util.py
+# stepper pulse train generated by a PIO state machine fed by DMA, used by the autosampler firmware
+import time
+import rp2
+import machine
+import uctypes
+from array import array
+
+STEPPER_SM_FREQ = 1_000_000  # state machine clock, one cycle per microsecond
+STEPPER_LOOP_CYCLES = 6  # cycles of a pulse period outside the two delay loops
+STEPPER_RAMP_SIZE = 1024  # longest acceleration ramp in steps
+# added to the predicted duration of a move before it is aborted
+STEPPER_TIMEOUT_MARGIN_MS = 1000
+# TX FIFO register of PIO0 state machine 0, the next state machines follow every 4 bytes
+PIO0_TXF0 = 0x50200010
+# DMA request of the PIO0 state machine 0 TX FIFO, the next state machines follow
+DREQ_PIO0_TX0 = 0
+# DMA abort register
+DMA_CHAN_ABORT = 0x50000444
+
+
+# ported from the gate_pwm.pio program of the Arduino autosampler_control_pio sketch, the pulses are timed by the
+# state machine itself instead of gating an external PWM signal
+# the number of pulses minus one is pulled into x, then the delay of each half period is pulled before every pulse,
+# the pulse pin idles high and each pulse is a low then a high half period, a 0 is pushed when the pulses are done
+@rp2.asm_pio(sideset_init=rp2.PIO.OUT_HIGH)
+def step_pulses():
+    pull(block).side(1)
+    mov(x, osr).side(1)
+    label("step")
+    pull(block).side(1)
+    mov(y, osr).side(0)
+    label("low")
+    jmp(y_dec, "low").side(0)
+    mov(y, osr).side(1)
+    label("high")
+    jmp(y_dec, "high").side(1)
+    jmp(x_dec, "step").side(1)
+    push(block).side(1)
+
+
+# delay loop count of a half period at rate steps per second
+def half_period_delay(rate):
+    return max(0, (int(STEPPER_SM_FREQ / rate) - STEPPER_LOOP_CYCLES) // 2)
+
+
+# half period delays of the steps accelerating from start_rate to max_rate, and the rate reached
+# acceleration is in steps/s^2, with a jerk in steps/s^3 the acceleration itself ramps up and down (S-curve),
+# a jerk of 0 gives a trapezoidal profile, without acceleration the rate is the lower of start_rate and max_rate
+def build_ramp(start_rate, max_rate, acceleration, jerk, size=STEPPER_RAMP_SIZE):
+    ramp = array("I")
+    rate = start_rate
+    if acceleration <= 0 or max_rate <= start_rate:
+        return ramp, min(start_rate, max_rate)
+    accel = 0.0 if jerk else acceleration
+    while rate < max_rate and len(ramp) < size:
+        ramp.append(half_period_delay(rate))
+        dt = 1 / rate
+        if jerk:
+            # reduce the acceleration when max_rate would be overshot while it decreases to 0
+            if max_rate - rate <= accel * accel / (2 * jerk):
+                accel = max(accel - jerk * dt, jerk * dt)
+            else:
+                accel = min(acceleration, accel + jerk * dt)
+        rate = min(max_rate, rate + accel * dt)
+    return ramp, rate
+
+
+# counted pulse train on one pin, the CPU only queues the count and starts a chain of DMA transfers that feed the
+# delay of every step to the state machine: the ramp table, the cruise delay repeated, then the ramp table reversed
+# the CPU is free during the move, it polls done() and counts the pulses completed from the remaining transfers of
+# the DMA channels, the state machine and its pin are not touched during the move
+class Stepper:
+    def __init__(self, pulse_pin, state_machine=0):
+        self.pin = machine.Pin(pulse_pin, machine.Pin.OUT, machine.Pin.PULL_UP, value=1)
+        self.sm_id = state_machine
+        self.sm = rp2.StateMachine(state_machine)
+        # one DMA channel per segment of a move: ramp up, cruise, ramp down
+        self.dmas = (rp2.DMA(), rp2.DMA(), rp2.DMA())
+        self.ramp = array("I")
+        self.ramp_reversed = array("I")
+        # duration of the first i steps of the ramp in microseconds
+        self.ramp_times = array("I", [0])
+        self.cruise_delay = array("I", [0])
+        self.counts = [0, 0, 0]  # transfers of the segment of each DMA channel
+        self.steps = 0  # pulses of the current move
+        self.moving = False
+        self.start_time = 0
+        self.set_profile(200, 200, 0, 0)
+        self.init()
+
+    def init(self):
+        self.sm.init(step_pulses, freq=STEPPER_SM_FREQ, sideset_base=self.pin)
+        self.sm.active(1)
+
+    # precompute the step delays of the acceleration ramp, the move then runs at the rate reached
+    def set_profile(self, start_rate, max_rate, acceleration, jerk):
+        ramp, rate = build_ramp(start_rate, max_rate, acceleration, jerk)
+        self.ramp = ramp
+        self.ramp_reversed = array("I", ramp)
+        n = len(ramp)
+        times = array("I", [0] * (n + 1))
+        for i in range(n):
+            self.ramp_reversed[n - 1 - i] = ramp[i]
+            times[i + 1] = times[i] + 2 * ramp[i] + STEPPER_LOOP_CYCLES
+        self.ramp_times = times
+        self.cruise_delay[0] = half_period_delay(rate)
+
+    # steps of the ramp up, cruise and ramp down of a move
+    def segments(self, steps):
+        n = len(self.ramp)
+        up = min(n, steps // 2)
+        down = min(n, steps - up)
+        return up, steps - up - down, down
+
+    # predicted duration of a move of steps pulses in microseconds
+    def predict_us(self, steps):
+        up, cruise, down = self.segments(steps)
+        cruise_period = 2 * self.cruise_delay[0] + STEPPER_LOOP_CYCLES
+        return self.ramp_times[up] + cruise * cruise_period + self.ramp_times[down]
+
+    # start steps pulses with the profile, returns the predicted duration in microseconds
+    def start(self, steps):
+        n = len(self.ramp)
+        up, cruise, down = self.segments(steps)
+        # (read address, count, increment the read address) of the non-empty segments
+        segments = []
+        if up:
+            segments.append((uctypes.addressof(self.ramp), up, True))
+        if cruise:
+            segments.append((uctypes.addressof(self.cruise_delay), cruise, False))
+        if down:
+            address = uctypes.addressof(self.ramp_reversed) + 4 * (n - down)
+            segments.append((address, down, True))
+        for i in range(3):
+            self.counts[i] = segments[i][1] if i < len(segments) else 0
+        # configure the last segment first, each one chains to the next, a channel chained to itself stops
+        next_channel = self.dmas[len(segments) - 1].channel
+        for i in range(len(segments) - 1, -1, -1):
+            read, count, inc_read = segments[i]
+            dma = self.dmas[i]
+            ctrl = dma.pack_ctrl(
+                size=2,
+                inc_read=inc_read,
+                inc_write=False,
+                treq_sel=DREQ_PIO0_TX0 + self.sm_id,
+                chain_to=next_channel,
+            )
+            dma.config(
+                read=read, write=PIO0_TXF0 + 4 * self.sm_id, count=count, ctrl=ctrl
+            )
+            next_channel = dma.channel
+        self.steps = steps
+        self.moving = True
+        self.start_time = time.ticks_us()
+        self.sm.put(steps - 1)
+        self.dmas[0].active(1)
+        return self.predict_us(steps)
+
+    def done(self):
+        return self.sm.rx_fifo() > 0
+
+    # microseconds since the start of the current move
+    def elapsed_us(self):
+        return time.ticks_diff(time.ticks_us(), self.start_time)
+
+    # pulses completed of a move, a pulse that was started is counted
+    def completed(self):
+        if not self.moving or self.done():
+            return self.steps
+        return self.pulled()
+
+    # delays pulled by the state machine, one per pulse started: the words transferred by the DMA channels minus the
+    # words still in the TX FIFO, which also holds the count of the move until it is pulled
+    # the count of a channel that was not triggered yet is stale, the first channel is triggered by start() and each
+    # one triggers the next when it finishes, so the channels before the busy one are finished and the ones after it
+    # did not start, a paused channel stays busy
+    def pulled(self):
+        transferred = 0
+        for i in range(3):
+            if not self.counts[i]:
+                break
+            if self.dmas[i].active():
+                transferred += self.counts[i] - self.dmas[i].count
+                break
+            transferred += self.counts[i]
+        return min(self.steps, max(0, transferred - self.sm.tx_fifo()))
+
+    # end of a move once done() is True, returns the pulses completed
+    def finish(self):
+        # pop the word pushed on completion
+        while self.sm.rx_fifo():
+            self.sm.get()
+        self.moving = False
+        return self.steps
+
+    # stop the DMA and the state machine, returns the pulses completed, a pulse that was started is completed when
+    # the state machine is restarted for the next move, which drives the pin high
+    def abort(self):
+        # a disabled channel is only paused, it is counted then aborted, otherwise the next config() would resume it
+        # the channels are disabled first so the abort does not trigger the chained channel (RP2040-E13)
+        for dma in self.dmas:
+            dma.active(0)
+        self.sm.active(0)
+        if self.sm.rx_fifo():
+            self.sm.get()
+            completed = self.steps
+        else:
+            completed = self.pulled()
+        mask = 0
+        for dma in self.dmas:
+            mask |= 1 << dma.channel
+        machine.mem32[DMA_CHAN_ABORT] = mask
+        while machine.mem32[DMA_CHAN_ABORT] & mask:
+            pass
+        self.init()
+        self.moving = False
+        return completed
@@ -0,0 +1,108 @@
+# trigger_util.py
+# trigger pulses and pulse trains timed by PIO state machines, used by the potentiostat firmware
+import time
+import rp2
+import machine
+
+TRIGGER_SM_FREQ = 1_000_000  # state machine clock, one cycle per microsecond
+# pulse trains that can run at the same time, PIO1 state machines 4 to 7
+TRIGGER_STATE_MACHINES = 4
+# cycles of the program outside the delay loops, before the first edge, in a pulse and between two pulses
+TRIGGER_DELAY_CYCLES = 8
+TRIGGER_WIDTH_CYCLES = 2
+TRIGGER_GAP_CYCLES = 3
+
+
+# the program drives the pin with side-set, idle is the level between the pulses, the program is assembled once per
+# idle level, the delay before the first edge, the width of a pulse, the number of pulses minus one and the time
+# between two pulses are pulled in that order, a word is pushed after the last pulse
+def trigger_program(idle):
+    active = 1 - idle
+
+    @rp2.asm_pio(sideset_init=rp2.PIO.OUT_HIGH if idle else rp2.PIO.OUT_LOW)
+    def trigger_pulses():
+        pull(block).side(idle)
+        mov(x, osr).side(idle)
+        label("delay")
+        jmp(x_dec, "delay").side(idle)
+        pull(block).side(idle)
+        mov(isr, osr).side(idle)
+        pull(block).side(idle)
+        mov(x, osr).side(idle)
+        pull(block).side(idle)
+        label("pulse")
+        mov(y, isr).side(active)
+        label("high")
+        jmp(y_dec, "high").side(active)
+        mov(y, osr).side(idle)
+        label("low")
+        jmp(y_dec, "low").side(idle)
+        jmp(x_dec, "pulse").side(idle)
+        push(block).side(idle)
+
+    return trigger_pulses
+
+
+# the programs of both idle levels, assembled on the first use
+programs = {}
+
+
+# a pulse train on a trigger pin, the pin is handed to the state machine for the train and back to the SIO after it
+# the pulse times are scheduled from the start time taken when the state machine is enabled
+class PulseTrain:
+    def __init__(self, state_machine):
+        self.sm = rp2.StateMachine(state_machine)
+        # pin of the running train, None when the state machine is free
+        self.pin_id = None
+        self.idle = 0
+        self.first_edge = 0  # time.ticks_us() of the first edge
+        self.last_edge = 0  # time.ticks_us() of the end of the last pulse
+
+    # start count pulses of width_us, one every period_us, the first one delay_us after the start
+    # returns the time.ticks_us() of the start
+    def start(self, pin_id, idle, width_us, count=1, period_us=0, delay_us=0):
+        if count < 1:
+            raise ValueError("count must be at least 1")
+        if width_us < TRIGGER_WIDTH_CYCLES:
+            raise ValueError(f"width must be at least {TRIGGER_WIDTH_CYCLES} us")
+        if count > 1 and period_us < width_us + TRIGGER_GAP_CYCLES:
+            raise ValueError(
+                f"period must be at least the width + {TRIGGER_GAP_CYCLES} us"
+            )
+        if delay_us < 0:
+            raise ValueError("delay must be positive")
+        delay_us = max(delay_us, TRIGGER_DELAY_CYCLES)
+        gap_us = max(period_us - width_us, TRIGGER_GAP_CYCLES)
+        if idle not in programs:
+            programs[idle] = trigger_program(idle)
+        pin = machine.Pin(pin_id, machine.Pin.OUT, value=idle)
+        self.sm.init(programs[idle], freq=TRIGGER_SM_FREQ, sideset_base=pin)
+        self.sm.put(delay_us - TRIGGER_DELAY_CYCLES)
+        self.sm.put(width_us - TRIGGER_WIDTH_CYCLES)
+        self.sm.put(count - 1)
+        self.sm.put(gap_us - TRIGGER_GAP_CYCLES)
+        start = time.ticks_us()
+        self.sm.active(1)
+        self.pin_id = pin_id
+        self.idle = idle
+        self.first_edge = time.ticks_add(start, delay_us)
+        self.last_edge = time.ticks_add(
+            self.first_edge, (count - 1) * (width_us + gap_us) + width_us
+        )
+        return start
+
+    def running(self):
+        return self.pin_id is not None
+
+    def done(self):
+        return self.pin_id is not None and self.sm.rx_fifo() > 0
+
+    # stop the state machine and give the pin back to the SIO at the idle level
+    def release(self):
+        self.sm.active(0)
+        while self.sm.rx_fifo():
+            self.sm.get()
+        machine.Pin(
+            self.pin_id, machine.Pin.OUT, value=self.idle, pull=machine.Pin.PULL_DOWN
+        )
+        self.pin_id = None
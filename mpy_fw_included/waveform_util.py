@@ -0,0 +1,277 @@
+# waveform_util.py
+# potential waveforms played to the AD5761 DAC by DMA, used by the potentiostat firmware
+import math
+import time
+import rp2
+import machine
+import uctypes
+from array import array
+
+# AD5761 input shift register commands, see pico_testing/AD5761.py
+CMD_WR_UPDATE_DAC_REG = 0x3
+CMD_WR_CTRL_REG = 0x4
+CMD_SW_FULL_RESET = 0xF
+# output range (low, high) in volts of each RA[2:0] value of the control register
+DAC_RANGES = (
+    (-10, 10),
+    (0, 10),
+    (-5, 5),
+    (0, 5),
+    (-2.5, 7.5),
+    (-3, 3),
+    (0, 16),
+    (0, 20),
+)
+DAC_RANGE_DEFAULT = 1  # 0 V to 10 V
+# control register: clear to zero scale, no overrange, straight binary, thermal shutdown, zero scale at power-up
+DAC_CONTROL = 1 << 6
+
+DAC_SM_FREQ = 20_000_000  # 5 MHz SPI clock, a 24-bit frame takes 100 cycles
+# points per second, a frame is sent before the next one is queued
+WAVEFORM_MAX_RATE = 100_000
+WAVEFORM_MAX_POINTS = 8192  # 32 KB of frames
+WAVEFORM_MAX_CYCLES = 1024  # repetitions of the waveform, 0 repeats it until stopped
+# DMA registers: the read address trigger alias of a channel, the pacing timer 0 and the abort register
+DMA_BASE = 0x50000000
+DMA_AL3_READ_ADDR_TRIG = 0x3C
+DMA_TIMER0 = DMA_BASE + 0x420
+DMA_CHAN_ABORT = DMA_BASE + 0x444
+DREQ_DMA_TIMER0 = 0x3B
+DREQ_PERMANENT = 0x3F
+# TX FIFO register of PIO0 state machine 0, the next state machines follow every 4 bytes
+PIO0_TXF0 = 0x50200010
+
+
+# one 24-bit frame per word pulled, left aligned, SYNC is driven by set, SCLK by side-set and SDI by out
+# the data changes while SCLK is high and the DAC samples it on the falling edge, it is applied when SYNC rises
+@rp2.asm_pio(
+    out_init=rp2.PIO.OUT_LOW,
+    set_init=rp2.PIO.OUT_HIGH,
+    sideset_init=rp2.PIO.OUT_HIGH,
+    out_shiftdir=rp2.PIO.SHIFT_LEFT,
+)
+def dac_frames():
+    pull(block).side(1)
+    set(pins, 0).side(1)
+    set(x, 23).side(1)
+    label("bit")
+    out(pins, 1).side(1)[1]
+    jmp(x_dec, "bit").side(0)[1]
+    set(pins, 1).side(1)
+
+
+# word of a 24-bit frame for the state machine
+def dac_frame(command, data):
+    return ((command << 16) | data) << 8
+
+
+# X and Y of the DMA pacing timer, the rate of the requests is sys_freq * X / Y with X and Y on 16 bits
+def timer_fraction(rate, sys_freq):
+    best = None
+    x = 1
+    while x * sys_freq <= 0xFFFF * rate:
+        y = round(x * sys_freq / rate)
+        error = abs(sys_freq * x / y - rate)
+        if best is None or error < best[2]:
+            best = (x, y, error)
+        x += 1
+    if best is None:
+        raise ValueError(f"rate must be at least {sys_freq // 0xFFFF + 1} Hz")
+    return best[0], best[1]
+
+
+# the waveform is a buffer of DAC frames, one per point at the update rate, built by steps, ramps and sines
+# playing it queues no work on the CPU: one DMA channel copies the frames to the state machine, paced by the DMA
+# timer, and chains to a second channel that writes the start of the buffer back to its read address trigger,
+# one restart per cycle, a restart of 0 is a null trigger that ends the playback
+class WaveformEngine:
+    def __init__(self, state_machine=0, max_points=WAVEFORM_MAX_POINTS):
+        self.sm_id = state_machine
+        self.sm = rp2.StateMachine(state_machine)
+        self.frames = array("I", bytearray(4 * max_points))
+        self.count = 0  # points of the waveform
+        self.rate = 0  # points per second
+        self.low, self.high = DAC_RANGES[DAC_RANGE_DEFAULT]
+        self.ready = False  # the state machine drives the DAC
+        # playback and restart channels
+        self.dmas = (rp2.DMA(), rp2.DMA())
+        self.restarts = array("I", [0])
+        self.cycles = 0
+        self.playing = False
+        self.start_time = 0
+        self.duration_us = 0  # of a finite playback
+
+    # hand the pins to the state machine, reset the DAC and set its output range (RA[2:0] of the control register)
+    def setup(self, sclk_pin=6, sdi_pin=7, sync_pin=5, output_range=DAC_RANGE_DEFAULT):
+        output_range = int(output_range)
+        if not 0 <= output_range < len(DAC_RANGES):
+            raise ValueError(f"output range must be 0 to {len(DAC_RANGES) - 1}")
+        self.stop()
+        self.sm.init(
+            dac_frames,
+            freq=DAC_SM_FREQ,
+            out_base=machine.Pin(int(sdi_pin)),
+            set_base=machine.Pin(int(sync_pin)),
+            sideset_base=machine.Pin(int(sclk_pin)),
+        )
+        self.sm.active(1)
+        self.sm.put(dac_frame(CMD_SW_FULL_RESET, 0))
+        self.sm.put(dac_frame(CMD_WR_CTRL_REG, DAC_CONTROL | output_range))
+        self.low, self.high = DAC_RANGES[output_range]
+        self.ready = True
+
+    # DAC frame of a potential in volts
+    def frame(self, volts):
+        if not self.low <= volts <= self.high:
+            raise ValueError(
+                f"{volts} V is outside the range {self.low} to {self.high} V"
+            )
+        return self.point(volts)
+
+    # DAC frame of a point of a segment whose range was checked, the rounding errors are clamped
+    def point(self, volts):
+        code = round((volts - self.low) * 0xFFFF / (self.high - self.low))
+        return dac_frame(CMD_WR_UPDATE_DAC_REG, min(0xFFFF, max(0, code)))
+
+    # write a potential now, outside a playback
+    def write(self, volts):
+        if not self.ready:
+            raise ValueError("the DAC is not set up")
+        if self.playing:
+            raise ValueError("a waveform is playing")
+        self.sm.put(self.frame(volts))
+
+    # start a new waveform updated rate times per second
+    def clear(self, rate):
+        rate = int(rate)
+        if rate > WAVEFORM_MAX_RATE:
+            raise ValueError(f"rate must be at most {WAVEFORM_MAX_RATE} Hz")
+        timer_fraction(rate, machine.freq())
+        if self.playing:
+            raise ValueError("a waveform is playing")
+        self.rate = rate
+        self.count = 0
+
+    # number of points of a segment of duration_ms, checked against the room left
+    def points(self, duration_ms):
+        if not self.rate:
+            raise ValueError("the waveform has no rate, clear it first")
+        if self.playing:
+            raise ValueError("a waveform is playing")
+        n = max(1, round(duration_ms * self.rate / 1000))
+        if self.count + n > len(self.frames):
+            raise ValueError(f"the waveform is limited to {len(self.frames)} points")
+        return n
+
+    def step(self, volts, duration_ms):
+        n = self.points(duration_ms)
+        frame = self.frame(volts)
+        for i in range(self.count, self.count + n):
+            self.frames[i] = frame
+        self.count += n
+
+    # linear from start to end volts, end is the last point
+    def ramp(self, start, end, duration_ms):
+        n = self.points(duration_ms)
+        # the range is checked before the buffer is written
+        self.frame(start)
+        self.frame(end)
+        slope = (end - start) / (n - 1) if n > 1 else 0
+        for i in range(n):
+            self.frames[self.count + i] = self.point(start + slope * i)
+        self.count += n
+
+    def sine(self, offset, amplitude, frequency, duration_ms):
+        n = self.points(duration_ms)
+        self.frame(offset - abs(amplitude))
+        self.frame(offset + abs(amplitude))
+        omega = 2 * math.pi * frequency / self.rate
+        for i in range(n):
+            self.frames[self.count + i] = self.point(
+                offset + amplitude * math.sin(omega * i)
+            )
+        self.count += n
+
+    # play the waveform cycles times, 0 repeats it until stopped, returns the time.ticks_us() of the start
+    def play(self, cycles=1):
+        cycles = int(cycles)
+        if not self.ready:
+            raise ValueError("the DAC is not set up")
+        if self.playing:
+            raise ValueError("a waveform is playing")
+        if not self.count:
+            raise ValueError("the waveform is empty")
+        if not 0 <= cycles <= WAVEFORM_MAX_CYCLES:
+            raise ValueError(f"cycles must be 0 to {WAVEFORM_MAX_CYCLES}")
+        x, y = timer_fraction(self.rate, machine.freq())
+        machine.mem32[DMA_TIMER0] = (x << 16) | y
+        playback, restart = self.dmas
+        start = uctypes.addressof(self.frames)
+        # one restart per cycle after the first then the null trigger, or the same restart read again forever
+        if cycles:
+            self.restarts = array("I", [start] * (cycles - 1) + [0])
+        else:
+            self.restarts = array("I", [start])
+        restart.config(
+            read=uctypes.addressof(self.restarts),
+            write=DMA_BASE + 0x40 * playback.channel + DMA_AL3_READ_ADDR_TRIG,
+            count=1,
+            ctrl=restart.pack_ctrl(
+                size=2,
+                inc_read=cycles != 0,
+                inc_write=False,
+                treq_sel=DREQ_PERMANENT,
+                chain_to=restart.channel,
+            ),
+        )
+        playback.config(
+            read=start,
+            write=PIO0_TXF0 + 4 * self.sm_id,
+            count=self.count,
+            ctrl=playback.pack_ctrl(
+                size=2,
+                inc_read=True,
+                inc_write=False,
+                treq_sel=DREQ_DMA_TIMER0,
+                chain_to=restart.channel,
+            ),
+        )
+        self.cycles = cycles
+        self.duration_us = cycles * self.count * 1_000_000 * y // (x * machine.freq())
+        self.playing = True
+        self.start_time = time.ticks_us()
+        playback.active(1)
+        return self.start_time
+
+    # called by the command loop, True once a finite playback ended
+    def done(self):
+        if not self.playing or not self.cycles:
+            return False
+        if time.ticks_diff(time.ticks_us(), self.start_time) < self.duration_us:
+            return False
+        if self.dmas[0].active() or self.dmas[1].active():
+            return False
+        self.playing = False
+        return True
+
+    # abort the playback, returns (cycle, point) reached, the DAC keeps the last potential written
+    def stop(self):
+        if not self.playing:
+            return 0, 0
+        playback, restart = self.dmas
+        # the channels are disabled first so the abort does not trigger the chained channel (RP2040-E13)
+        playback.active(0)
+        restart.active(0)
+        mask = (1 << playback.channel) | (1 << restart.channel)
+        machine.mem32[DMA_CHAN_ABORT] = mask
+        while machine.mem32[DMA_CHAN_ABORT] & mask:
+            pass
+        point = self.count - playback.count
+        if self.cycles:
+            # restarts read so far
+            cycle = (restart.read - uctypes.addressof(self.restarts)) // 4
+        else:
+            elapsed_us = time.ticks_diff(time.ticks_us(), self.start_time)
+            cycle = elapsed_us * self.rate // (self.count * 1_000_000)
+        self.playing = False
+        return cycle, point
@@ -0,0 +1,217 @@
+"""
+Receiver of the ADC conversions streamed by the potentiostat firmware (`0:adc_start:channel,...:rate_hz`).
+
+The firmware sends each block of conversions as a header line followed by the raw bytes:
+
+    ADC block: seq 12, time 123456789, bytes 2048
+    <1024 little-endian uint16 conversions, the channels in round-robin order>
+
+`seq` counts the blocks from 0 (a gap means the blocks were overwritten before they were sent) and `time` is the
+`time.ticks_us()` of the controller when the block completed, i.e. of its last conversion. A block refilled while it
+was sent is followed by `ADC block overwritten: seq 12` and discarded.
+
+The conversions are appended to one raw file per column while the acquisition runs, so the receiver keeps up with
+the full rate, and merged into a columnar `.npz` when it stops: for each channel `n`, `adc{n}` (uint16, 12-bit
+values) and `adc{n}_time_us` (float64, controller time in microseconds from the start of the conversions).
+
+Usage:
+    python adc_receiver.py COM5 -c 0,1,2 -r 10000 -d 60 -o adc_run.npz
+    data = np.load("adc_run.npz"); t, v = data["adc0_time_us"], data["adc0"]
+"""
+
+# other library
+import os
+import re
+import sys
+import time
+import json
+import logging
+import argparse
+import numpy as np
+import serial
+
+BLOCK_PATTERN = re.compile(rb"ADC block: seq (\d+), time (\d+), bytes (\d+)")
+OVERWRITTEN_PATTERN = re.compile(rb"ADC block overwritten: seq (\d+)")
+START_PATTERN = re.compile(
+    r"ADC streaming: channels ([\d,]+), conversion rate ([\d.]+) Hz, block (\d+) samples, start (\d+) us"
+)
+# time.ticks_us() of MicroPython wraps every 2^30 us
+TICKS_PERIOD = 1 << 30
+
+
+class AdcBlockWriter:
+    """Converts the blocks into per channel columns, spooled to raw files next to the output until close()."""
+
+    def __init__(self, path, channels, conversion_rate, block_samples, start_ticks):
+        self.path = path
+        self.channels = channels
+        self.period_us = 1e6 / conversion_rate
+        self.block_samples = block_samples
+        self.last_ticks = start_ticks
+        self.time_us = 0  # unwrapped time of the last block from the start
+        self.last_seq = -1
+        self.blocks = 0
+        self.dropped = 0
+        self.spools = {}
+        for channel in channels:
+            for column in (f"adc{channel}", f"adc{channel}_time_us"):
+                self.spools[column] = open(f"{path}.{column}.tmp", "wb")
+        # position of a conversion in its block and the channel of each position, the blocks are contiguous
+        self.positions = np.arange(block_samples)
+
+    def write(self, seq, ticks, payload):
+        """Append a block, seq and ticks are its header fields and payload its bytes."""
+        values = np.frombuffer(payload, dtype="<u2")
+        if len(values) != self.block_samples:
+            raise ValueError(
+                f"block {seq} has {len(values)} conversions, expected {self.block_samples}"
+            )
+        self.time_us += (ticks - self.last_ticks) % TICKS_PERIOD
+        self.last_ticks = ticks
+        if seq != self.last_seq + 1:
+            self.dropped += seq - self.last_seq - 1
+            logging.warning(
+                f"ADC blocks {self.last_seq + 1} to {seq - 1} were dropped."
+            )
+        self.last_seq = seq
+        self.blocks += 1
+        # the last conversion completed the block
+        times = (
+            self.time_us - (self.block_samples - 1 - self.positions) * self.period_us
+        )
+        channel_index = (seq * self.block_samples + self.positions) % len(self.channels)
+        for i, channel in enumerate(self.channels):
+            mask = channel_index == i
+            values[mask].tofile(self.spools[f"adc{channel}"])
+            times[mask].tofile(self.spools[f"adc{channel}_time_us"])
+
+    def close(self):
+        """Merge the spools into the columnar .npz, the layout is stored as JSON in `meta`."""
+        try:
+            arrays = {}
+            for column, spool in self.spools.items():
+                spool.close()
+                dtype = np.float64 if column.endswith("_time_us") else np.uint16
+                arrays[column] = np.fromfile(spool.name, dtype=dtype)
+            meta = {
+                "channels": self.channels,
+                "period_us": self.period_us,
+                "blocks": self.blocks,
+                "dropped": self.dropped,
+            }
+            arrays["meta"] = np.array(json.dumps(meta))
+            # write to a temporary file first so a reader never sees a partial file
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(temp_path, self.path)
+        finally:
+            self.discard()
+
+    def discard(self):
+        """Close and remove the spools, without writing the .npz when close() was not called."""
+        for spool in self.spools.values():
+            spool.close()
+            if os.path.exists(spool.name):
+                os.remove(spool.name)
+
+
+def receive(port, channels, rate, duration_s, path) -> AdcBlockWriter:
+    """Stream the ADC channels of the controller on port at rate conversions per second each for duration_s."""
+    writer = None
+    try:
+        with serial.Serial(port, timeout=1) as ser:
+            ser.reset_input_buffer()
+            ser.write(f"0:adc_start:{','.join(map(str, channels))}:{rate}\n".encode())
+            end = time.monotonic() + duration_s
+            stopping = False
+            # the last block, written once the next line shows it was not overwritten while it was sent
+            pending = None
+            while True:
+                if not stopping and time.monotonic() >= end:
+                    ser.write(b"0:adc_stop\n")
+                    stopping = True
+                line = ser.readline()
+                if not line:
+                    if stopping:
+                        break
+                    continue
+                match = OVERWRITTEN_PATTERN.match(line)
+                if match:
+                    if pending and pending[0] == int(match.group(1)):
+                        logging.warning(
+                            f"ADC block {pending[0]} was overwritten while it was sent."
+                        )
+                        pending = None
+                    continue
+                if pending:
+                    writer.write(*pending)
+                    pending = None
+                match = BLOCK_PATTERN.match(line)
+                if match:
+                    seq, ticks, size = map(int, match.groups())
+                    payload = ser.read(size)
+                    if len(payload) != size:
+                        raise ValueError(f"block {seq} is truncated")
+                    if writer:
+                        pending = (seq, ticks, payload)
+                    continue
+                text = line.decode("utf-8", errors="replace").strip()
+                logging.info(f"Potentiostat -> PC: {text}")
+                match = START_PATTERN.search(text)
+                if match:
+                    writer = AdcBlockWriter(
+                        path,
+                        [int(channel) for channel in match.group(1).split(",")],
+                        float(match.group(2)),
+                        int(match.group(3)),
+                        int(match.group(4)),
+                    )
+                elif text.startswith("Error:"):
+                    raise RuntimeError(text)
+                elif "ADC stopped" in text or "No ADC streaming" in text:
+                    break
+            if pending:
+                writer.write(*pending)
+        if writer is None:
+            raise RuntimeError("the controller did not start the ADC streaming")
+        writer.close()
+    finally:
+        # the spools are removed when the acquisition failed
+        if writer is not None:
+            writer.discard()
+    return writer
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Stream the ADC channels of the potentiostat controller to a columnar .npz file."
+    )
+    parser.add_argument("port", help="Serial port of the potentiostat controller.")
+    parser.add_argument(
+        "-c", "--channels", default="0", help="Comma-separated ADC channels, 0 to 4."
+    )
+    parser.add_argument(
+        "-r",
+        "--rate",
+        type=int,
+        default=1000,
+        help="Conversions per second per channel.",
+    )
+    parser.add_argument(
+        "-d", "--duration", type=float, default=10, help="Acquisition time in seconds."
+    )
+    parser.add_argument("-o", "--output", default="adc_stream.npz", help="Output file.")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s: %(message)s")
+
+    channels = [int(channel) for channel in args.channels.split(",")]
+    writer = receive(args.port, channels, args.rate, args.duration, args.output)
+    logging.info(
+        f"Wrote {writer.blocks} blocks to {args.output}, {writer.dropped} dropped."
+    )
+    return 1 if writer.dropped else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
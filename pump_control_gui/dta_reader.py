@@ -0,0 +1,551 @@
+"""
+Reader for the Gamry DTA output files, e.g. the `PWRCHARGE {n}.DTA` files of the charge steps.
+
+A DTA file is tab separated text, a header of `NAME<TAB>TYPE<TAB>VALUE<TAB>DESCRIPTION` lines followed by one or more tables:
+
+    CURVE	TABLE	3
+        Pt	T	Vf	Im	...
+        #	s	V vs. Ref.	A	...
+        0	1.0	-0.5	0.01	...
+
+The file is parsed in a single pass, each table is tokenized at once and converted column by column into numpy arrays.
+The result is cached as a columnar `.npz` file next to the source and reused until the source changes.
+
+Usage:
+    dta = read_dta("PWRCHARGE 1.DTA")
+    t, v = dta.curve["T"], dta.curve["Vf"]
+    index = index_directory("results")  # one row per DTA file, parsed in parallel
+    python dta_reader.py results -o dta_index.csv
+"""
+
+# other library
+import os
+import sys
+import re
+import json
+import glob
+import time
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# bump this when the cache layout changes, older cache files will be rebuilt
+CACHE_VERSION = 1
+CACHE_SUFFIX = ".npz"
+# Gamry writes the files in the Windows ANSI code page
+DTA_ENCODING = "cp1252"
+# a table ends at the first line not starting with a tab
+TABLE_END = re.compile(r"\n(?!\t)")
+# number of samples kept for the live plot
+LIVE_MAX_POINTS = 2000
+
+
+class DTATable:
+    """A table of a DTA file, one numpy array per column (float64, or str for non-numeric columns such as `Over`)."""
+
+    def __init__(self, name, columns, units, arrays):
+        self.name = name
+        self.columns = columns
+        self.units = units
+        self.arrays = arrays
+
+    def __len__(self):
+        return len(self.arrays[0]) if self.arrays else 0
+
+    def __contains__(self, column):
+        return column in self.columns
+
+    def __getitem__(self, column) -> np.ndarray:
+        try:
+            return self.arrays[self.columns.index(column)]
+        except ValueError:
+            raise KeyError(
+                f"'{column}' not found in table {self.name}, available columns are: {self.columns}"
+            ) from None
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame(dict(zip(self.columns, self.arrays)), columns=self.columns)
+
+
+class DTAFile:
+    """
+    A parsed DTA file.
+
+    Attributes:
+        path (str): Path of the source file.
+        header (dict[str, str]): Header values by name, e.g. header["TAG"] == "PWRCHARGE".
+        notes (str): The free text of the NOTES block.
+        tables (dict[str, DTATable]): Tables by name, e.g. "OCVCURVE" and "CURVE".
+    """
+
+    def __init__(self, path, header, notes, tables):
+        self.path = path
+        self.header = header
+        self.notes = notes
+        self.tables = tables
+
+    @property
+    def tag(self) -> str:
+        return self.header.get("TAG", "")
+
+    @property
+    def curve(self) -> DTATable:
+        """The main data table, "CURVE" if present, otherwise the last table of the file."""
+        if "CURVE" in self.tables:
+            return self.tables["CURVE"]
+        if not self.tables:
+            raise KeyError(f"No data table in {self.path}")
+        return list(self.tables.values())[-1]
+
+
+def convert_column(values: list[str]) -> np.ndarray:
+    """Convert the tokens of a column to float64, keep them as str if the column is not numeric."""
+    try:
+        return np.fromiter(map(float, values), np.float64, len(values))
+    except ValueError:
+        pass
+    # decimal comma of some Windows locales
+    try:
+        return np.fromiter(
+            (float(value.replace(",", ".")) for value in values),
+            np.float64,
+            len(values),
+        )
+    except ValueError:
+        return np.array(values, dtype=str)
+
+
+def parse_table_block(block: str, num_columns: int) -> list[np.ndarray]:
+    """
+    Tokenize the data rows of a table at once and convert them into one array per column.
+    Every row starts with a tab, so the rows with the newlines removed split into exactly `num_columns` tokens per row.
+    Rows with a different number of fields (e.g. a line still being written) are dropped.
+    """
+    num_rows = block.count("\n") + (0 if block.endswith("\n") or not block else 1)
+    tokens = block.replace("\n", "").split("\t")[1:]
+    if len(tokens) != num_rows * num_columns:
+        rows = [row for row in block.split("\n") if row.count("\t") == num_columns]
+        tokens = "".join(rows).split("\t")[1:]
+    return [
+        convert_column(tokens[column::num_columns]) for column in range(num_columns)
+    ]
+
+
+def read_line(text: str, position: int) -> tuple[str, int]:
+    """Return the line starting at `position` and the position of the next line."""
+    end = text.find("\n", position)
+    if end == -1:
+        return text[position:], len(text)
+    return text[position:end], end + 1
+
+
+def parse_dta_text(text: str, path: str = "") -> DTAFile:
+    """
+    Parse the content of a DTA file (read in text mode) in a single pass.
+    The header is read line by line, the end of each table is located with one regex search
+    so the data rows are never iterated in Python.
+    """
+    header = {}
+    notes = ""
+    tables = {}
+    position = 0
+    while position < len(text):
+        line, position = read_line(text, position)
+        fields = line.split("\t")
+        if len(fields) < 2 or fields[0] == "":
+            continue
+        name, field_type = fields[0], fields[1]
+        if field_type == "TABLE":
+            columns_line, position = read_line(text, position)
+            units_line, position = read_line(text, position)
+            columns = columns_line.split("\t")[1:]
+            match = TABLE_END.search(text, position)
+            end = match.start() + 1 if match else len(text)
+            tables[name] = DTATable(
+                name,
+                columns,
+                units_line.split("\t")[1:],
+                parse_table_block(text[position:end], len(columns)),
+            )
+            position = end
+        elif field_type == "NOTES" and len(fields) > 2 and fields[2].isdigit():
+            note_lines = []
+            for _ in range(int(fields[2])):
+                note_line, position = read_line(text, position)
+                note_lines.append(note_line.strip())
+            notes = "\n".join(note_lines)
+        else:
+            header[name] = fields[2] if len(fields) > 2 else fields[1]
+    return DTAFile(path, header, notes, tables)
+
+
+def cache_path_for(path: str) -> str:
+    return f"{path}{CACHE_SUFFIX}"
+
+
+def source_signature(path: str) -> list:
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def save_dta_cache(dta: DTAFile, cache_path: str, signature: list) -> None:
+    """Save the parsed file as a columnar .npz, one entry per column and the layout as JSON."""
+    meta = {
+        "version": CACHE_VERSION,
+        "source": signature,
+        "header": dta.header,
+        "notes": dta.notes,
+        "tables": [
+            {"name": table.name, "columns": table.columns, "units": table.units}
+            for table in dta.tables.values()
+        ],
+    }
+    arrays = {"meta": np.array(json.dumps(meta))}
+    for table_index, table in enumerate(dta.tables.values()):
+        for column_index, array in enumerate(table.arrays):
+            arrays[f"{table_index}_{column_index}"] = array
+    # write to a temporary file first so a reader never sees a partial cache
+    temp_path = f"{cache_path}.tmp"
+    with open(temp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(temp_path, cache_path)
+
+
+def load_dta_cache(path: str, cache_path: str, signature: list) -> DTAFile | None:
+    """Load the cached file, None if the cache is missing, outdated or unreadable."""
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with np.load(cache_path, allow_pickle=False) as cached:
+            meta = json.loads(str(cached["meta"]))
+            if meta.get("version") != CACHE_VERSION or meta.get("source") != signature:
+                return None
+            tables = {}
+            for table_index, layout in enumerate(meta["tables"]):
+                arrays = [
+                    cached[f"{table_index}_{column_index}"]
+                    for column_index in range(len(layout["columns"]))
+                ]
+                tables[layout["name"]] = DTATable(
+                    layout["name"], layout["columns"], layout["units"], arrays
+                )
+        return DTAFile(path, meta["header"], meta["notes"], tables)
+    except Exception as e:
+        logging.error(f"Error loading DTA cache {cache_path}: {e}")
+        return None
+
+
+def read_dta(path: str, use_cache: bool = True) -> DTAFile:
+    """
+    Read a DTA file, from the columnar cache next to it when it is up to date.
+
+    Args:
+        path (str): Path of the DTA file.
+        use_cache (bool): Read and write the `.npz` cache, False to always parse the source.
+
+    Returns:
+        DTAFile: The parsed file.
+    """
+    signature = source_signature(path)
+    cache_path = cache_path_for(path)
+    if use_cache:
+        dta = load_dta_cache(path, cache_path, signature)
+        if dta is not None:
+            return dta
+    with open(path, "r", encoding=DTA_ENCODING, errors="replace") as f:
+        dta = parse_dta_text(f.read(), path)
+    if use_cache:
+        try:
+            save_dta_cache(dta, cache_path, signature)
+        except Exception as e:
+            logging.error(f"Error saving DTA cache {cache_path}: {e}")
+    return dta
+
+
+def summarize_dta(path: str, use_cache: bool = True) -> dict:
+    """Read a DTA file and return its index row, errors are reported in the `error` column."""
+    summary = {"path": path}
+    try:
+        dta = read_dta(path, use_cache)
+        curve = dta.curve
+        summary.update(
+            {
+                "tag": dta.tag,
+                "title": dta.header.get("TITLE", ""),
+                "date": dta.header.get("DATE", ""),
+                "time": dta.header.get("TIME", ""),
+                "tables": ",".join(dta.tables.keys()),
+                "points": len(curve),
+                "duration_s": float(curve["T"][-1])
+                if "T" in curve and len(curve)
+                else None,
+                "error": "",
+            }
+        )
+    except Exception as e:
+        summary["error"] = str(e)
+    return summary
+
+
+def find_dta_files(directory: str, recursive: bool = True) -> list[str]:
+    pattern = (
+        os.path.join(directory, "**", "*")
+        if recursive
+        else os.path.join(directory, "*")
+    )
+    return sorted(
+        path
+        for path in glob.glob(pattern, recursive=recursive)
+        if path.upper().endswith(".DTA") and os.path.isfile(path)
+    )
+
+
+def index_directory(
+    directory: str,
+    recursive: bool = True,
+    jobs: int | None = None,
+    use_cache: bool = True,
+) -> pd.DataFrame:
+    """
+    Parse every DTA file of a results directory in parallel and return one summary row per file.
+    The columnar caches are written as a side effect, so later `read_dta` calls only load them.
+
+    Args:
+        directory (str): The results directory.
+        recursive (bool): Include the subdirectories.
+        jobs (int | None): Number of worker processes, default to the number of CPU cores.
+        use_cache (bool): Read and write the `.npz` caches.
+
+    Returns:
+        pd.DataFrame: Columns path, tag, title, date, time, tables, points, duration_s and error.
+    """
+    paths = find_dta_files(directory, recursive)
+    num_workers = max(1, min(jobs or os.cpu_count() or 1, len(paths)))
+    if num_workers == 1:
+        rows = [summarize_dta(path, use_cache) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            rows = list(
+                executor.map(
+                    summarize_dta,
+                    paths,
+                    [use_cache] * len(paths),
+                    chunksize=max(1, len(paths) // (num_workers * 4)),
+                )
+            )
+    return pd.DataFrame(
+        rows,
+        columns=[
+            "path",
+            "tag",
+            "title",
+            "date",
+            "time",
+            "tables",
+            "points",
+            "duration_s",
+            "error",
+        ],
+    )
+
+
+class DTATailer:
+    """
+    Follow a DTA file while Gamry appends to it.
+    Each poll reads only the bytes written since the previous one and parses the complete new lines,
+    an incomplete last line is kept until the rest of it is written.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0  # bytes of the file consumed so far
+        self.pending = b""  # incomplete last line
+        self.header = {}
+        self.table = None  # name of the table being read
+        self.columns = []
+        self.units = []
+        self.table_lines_left = 0  # column and unit lines of the table still to read
+
+    def poll(self) -> list[tuple[str, list[str], list[np.ndarray]]]:
+        """
+        Read the new data of the file.
+
+        Returns:
+            list[tuple[str, list[str], list[np.ndarray]]]: The new rows as (table name, columns, arrays) batches.
+        """
+        size = os.path.getsize(self.path)
+        if size < self.offset:
+            # the file was rewritten, start over
+            self.__init__(self.path)
+        if size == self.offset:
+            return []
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            chunk = f.read(size - self.offset)
+        self.offset += len(chunk)
+        data = self.pending + chunk
+        end = data.rfind(b"\n") + 1
+        self.pending = data[end:]
+        if end == 0:
+            return []
+        text = data[:end].decode(DTA_ENCODING, errors="replace").replace("\r\n", "\n")
+        return self.parse(text)
+
+    def parse(self, text: str) -> list[tuple[str, list[str], list[np.ndarray]]]:
+        batches = []
+        position = 0
+        while position < len(text):
+            if self.table is not None and self.table_lines_left == 0:
+                if text.startswith("\t", position):
+                    match = TABLE_END.search(text, position)
+                    end = match.start() + 1 if match else len(text)
+                    arrays = parse_table_block(text[position:end], len(self.columns))
+                    if arrays and len(arrays[0]):
+                        batches.append((self.table, self.columns, arrays))
+                    position = end
+                    continue
+                self.table = None
+            line, position = read_line(text, position)
+            fields = line.split("\t")
+            if self.table_lines_left == 2:
+                self.columns = fields[1:]
+                self.table_lines_left = 1
+            elif self.table_lines_left == 1:
+                self.units = fields[1:]
+                self.table_lines_left = 0
+            elif len(fields) < 2 or fields[0] == "":
+                continue
+            elif fields[1] == "TABLE":
+                self.table = fields[0]
+                self.table_lines_left = 2
+            else:
+                self.header[fields[0]] = fields[2] if len(fields) > 2 else fields[1]
+        return batches
+
+
+class DTADirectoryWatcher:
+    """Tail every DTA file of a directory (and its subdirectories) modified after the watcher was created."""
+
+    def __init__(self, directory, since_ns=None):
+        self.directory = directory
+        self.since_ns = time.time_ns() if since_ns is None else since_ns
+        self.tailers = {}
+
+    def poll(self) -> list[tuple[str, str, list[str], list[np.ndarray]]]:
+        """
+        Returns:
+            list[tuple[str, str, list[str], list[np.ndarray]]]: The new rows as (path, table name, columns, arrays) batches.
+        """
+        batches = []
+        for path in find_dta_files(self.directory):
+            tailer = self.tailers.get(path)
+            if tailer is None:
+                try:
+                    if os.stat(path).st_mtime_ns < self.since_ns:
+                        continue
+                except OSError:
+                    continue
+                tailer = self.tailers[path] = DTATailer(path)
+            try:
+                batches.extend((path, *batch) for batch in tailer.poll())
+            except OSError as e:
+                # the file can be briefly locked by the Gamry software, retry on the next poll
+                logging.error(f"Error reading {path}: {e}")
+        return batches
+
+
+class DTALiveSeries:
+    """
+    Voltage and cumulative charge samples of the CURVE tables of a run, for the live plot.
+    The samples are kept in fixed-size buffers, so an update costs the same however long the files grow.
+    """
+
+    def __init__(self, max_points=LIVE_MAX_POINTS):
+        self.time_s = deque(maxlen=max_points)
+        self.voltage = deque(maxlen=max_points)
+        self.charge_mAh = deque(maxlen=max_points)
+        self.total_charge_mAh = 0.0
+        self.time_offsets = {}  # path: offset of the file T column in the run time
+        self.last_rows = {}  # path: (T, |Im|) of the last row, to integrate across batches
+
+    def add(self, path, table_name, columns, arrays, run_time_s) -> int:
+        """
+        Add a batch of new rows from a DTADirectoryWatcher.
+
+        Args:
+            run_time_s (float): The current run time, the last row of a new file is placed at this time.
+
+        Returns:
+            int: The number of samples added.
+        """
+        if table_name != "CURVE" or "T" not in columns or "Vf" not in columns:
+            return 0
+        t = arrays[columns.index("T")]
+        voltage = arrays[columns.index("Vf")]
+        if not len(t) or t.dtype.kind != "f" or voltage.dtype.kind != "f":
+            return 0
+        # T restarts at 0 for every file
+        if path not in self.time_offsets:
+            self.time_offsets[path] = run_time_s - float(t[-1])
+        charge = np.full(len(t), self.total_charge_mAh)
+        if "Im" in columns and arrays[columns.index("Im")].dtype.kind == "f":
+            current = np.abs(arrays[columns.index("Im")])
+            last_t, last_current = self.last_rows.get(path, (t[0], current[0]))
+            t_all = np.concatenate(([last_t], t))
+            current_all = np.concatenate(([last_current], current))
+            # trapezoidal integration, A s to mA h
+            charge_As = np.cumsum(
+                (current_all[1:] + current_all[:-1]) / 2 * np.diff(t_all)
+            )
+            charge = self.total_charge_mAh + charge_As / 3.6
+            self.total_charge_mAh = float(charge[-1])
+            self.last_rows[path] = (t[-1], current[-1])
+        # only the newest samples fit in the buffers
+        keep = self.time_s.maxlen
+        self.time_s.extend((t[-keep:] + self.time_offsets[path]).tolist())
+        self.voltage.extend(voltage[-keep:].tolist())
+        self.charge_mAh.extend(charge[-keep:].tolist())
+        return min(len(t), keep)
+
+    def clear(self):
+        self.__init__(self.time_s.maxlen)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Index and cache the Gamry DTA files of a results directory."
+    )
+    parser.add_argument("directory", help="The results directory.")
+    parser.add_argument(
+        "-o", "--output", default=None, help="Write the index to this CSV file."
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of worker processes, default to the number of CPU cores.",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Do not read or write the .npz caches."
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s: %(message)s")
+
+    index = index_directory(args.directory, jobs=args.jobs, use_cache=not args.no_cache)
+    failed = index[index["error"] != ""]
+    logging.info(f"Indexed {len(index)} DTA files, {len(failed)} failed.")
+    for path, error in zip(failed["path"], failed["error"]):
+        logging.error(f"{path}: {error}")
+    if args.output:
+        index.to_csv(args.output, index=False)
+    else:
+        print(index.to_string(index=False))
+    return 1 if len(failed) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,354 @@
+import os
+import copy
+import json
+import logging
+import functools
+import xml.etree.ElementTree as ET
+
+# bump this when the compiled format changes, older cache files will be rebuilt
+REGISTRY_VERSION = 1
+
+# parameter kinds that hold a single free text / number in the "value" attribute
+VALUE_KINDS = {
+    "explain_quant",
+    "explain_iquant",
+    "explain_poten",
+    "explain_label",
+    "explain_output",
+    "explain_notes",
+    "explain_aeselect",
+}
+# parameter kinds that expose a list of choices, the attribute prefix of the choices
+CHOICE_PREFIXES = {
+    "explain_selector": "item",
+    "explain_mltparam": "item",
+    "explain_varunits": "unit",
+}
+TRUE_STRINGS = {"true", "yes", "on", "1", "checked"}
+FALSE_STRINGS = {"false", "no", "off", "0", "unchecked"}
+
+
+def parse_checked(value) -> str:
+    """Convert a user value (bool, 1/0, yes/no, ...) to the "True"/"False" string used by Gamry."""
+    if isinstance(value, bool):
+        return "True" if value else "False"
+    text = str(value).strip().lower()
+    if text in TRUE_STRINGS:
+        return "True"
+    if text in FALSE_STRINGS:
+        return "False"
+    raise ValueError(f"Invalid checked value '{value}', expected True or False.")
+
+
+def parse_choice(value, choices: list[str]) -> str:
+    """Resolve a user value to a choice index, either the index itself or the (case-insensitive) choice label."""
+    text = str(value).strip()
+    if text.isdigit() and int(text) < len(choices):
+        return text
+    lowered = text.lower()
+    for index, choice in enumerate(choices):
+        if choice.lower() == lowered:
+            return str(index)
+    # allow "hour" for "hour(s)"
+    for index, choice in enumerate(choices):
+        if choice.lower().startswith(lowered):
+            return str(index)
+    raise ValueError(f"Invalid choice '{value}', available choices are: {choices}")
+
+
+def split_compound(value, count: int) -> list[str]:
+    """Split a compound cell such as "True;0.001;3600" into at most `count` stripped fields."""
+    fields = [field.strip() for field in str(value).split(";")]
+    if len(fields) > count:
+        raise ValueError(
+            f"Invalid value '{value}', expected at most {count} fields separated by ';'."
+        )
+    return fields
+
+
+def set_value(param: ET.Element, value, choices: list[str]) -> None:
+    param.set("value", str(value).strip())
+
+
+def set_toggle(param: ET.Element, value, choices: list[str]) -> None:
+    param.set("checked", parse_checked(value))
+
+
+def set_selector(param: ET.Element, value, choices: list[str]) -> None:
+    param.set("index", parse_choice(value, choices))
+
+
+def set_varunits(param: ET.Element, value, choices: list[str]) -> None:
+    # "value" or "value;unit", e.g. "2;hour"
+    fields = split_compound(value, 2)
+    param.set("value", fields[0])
+    if len(fields) > 1 and fields[1] != "":
+        param.set("index", parse_choice(fields[1], choices))
+
+
+def set_mltparam(param: ET.Element, value, choices: list[str]) -> None:
+    # "item;value" e.g. "|Charge| > Limit;0.1", or a single number for the current item
+    fields = split_compound(value, 2)
+    if len(fields) == 1:
+        param.set("value", fields[0])
+        return
+    param.set("index", parse_choice(fields[0], choices))
+    param.set("value", fields[1])
+
+
+def set_oneparam(param: ET.Element, value, choices: list[str]) -> None:
+    # "checked;value1", a single number enables the parameter with that value
+    fields = split_compound(value, 2)
+    if len(fields) == 1:
+        try:
+            float(fields[0])
+        except ValueError:
+            param.set("checked", parse_checked(fields[0]))
+            return
+        param.set("checked", "True")
+        param.set("value1", fields[0])
+        return
+    param.set("checked", parse_checked(fields[0]))
+    param.set("value1", fields[1])
+
+
+def set_twoparam(param: ET.Element, value, choices: list[str]) -> None:
+    # "checked;value1;value2", empty fields keep the template value
+    fields = split_compound(value, 3)
+    param.set("checked", parse_checked(fields[0]))
+    for attribute, field in zip(("value1", "value2"), fields[1:]):
+        if field != "":
+            param.set(attribute, field)
+
+
+# the compiled setter for each parameter kind
+PARAMETER_SETTERS = {kind: set_value for kind in VALUE_KINDS}
+PARAMETER_SETTERS.update(
+    {
+        "explain_toggle": set_toggle,
+        "explain_selector": set_selector,
+        "explain_varunits": set_varunits,
+        "explain_mltparam": set_mltparam,
+        "explain_oneparam": set_oneparam,
+        "explain_twoparam": set_twoparam,
+    }
+)
+
+
+class GamryMethod:
+    """
+    A Gamry sequencer method compiled from an `element` block of a sequencer XML file.
+
+    The template block is kept as XML text and parsed on first use, every parameter is compiled
+    into a setter keyed by its tag, so building a step is a copy plus one dictionary lookup per value.
+    """
+
+    def __init__(self, name, classname, template_xml, parameters):
+        self.name = name
+        self.classname = classname
+        self.template_xml = template_xml
+        # list of [tag, kind, desc, choices]
+        self.parameters = parameters
+        self.setters = {}
+        self.column_to_tag = {}
+        for tag, kind, desc, choices in parameters:
+            setter = PARAMETER_SETTERS.get(kind)
+            if setter is None:
+                continue
+            self.setters[tag] = (setter, choices)
+            self.column_to_tag[tag.lower()] = tag
+            if desc:
+                self.column_to_tag.setdefault(desc.strip().lower(), tag)
+        self._template = None
+
+    @property
+    def template(self) -> ET.Element:
+        if self._template is None:
+            self._template = ET.fromstring(self.template_xml)
+        return self._template
+
+    @classmethod
+    def from_element(cls, element: ET.Element):
+        parameters = []
+        parameters_element = element.find("parameters")
+        if parameters_element is not None:
+            for param in parameters_element:
+                tag = param.attrib.get("tag")
+                if tag is None:
+                    continue
+                prefix = CHOICE_PREFIXES.get(param.tag)
+                choices = []
+                if prefix:
+                    while f"{prefix}{len(choices)}" in param.attrib:
+                        choices.append(param.attrib[f"{prefix}{len(choices)}"])
+                parameters.append(
+                    [tag, param.tag, param.attrib.get("desc", ""), choices]
+                )
+        return cls(
+            name=element.findtext("name"),
+            classname=element.findtext("classname"),
+            template_xml=ET.tostring(element, encoding="unicode"),
+            parameters=parameters,
+        )
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "classname": self.classname,
+            "template_xml": self.template_xml,
+            "parameters": self.parameters,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            name=data["name"],
+            classname=data["classname"],
+            template_xml=data["template_xml"],
+            parameters=data["parameters"],
+        )
+
+    def build(self, values: dict) -> ET.Element:
+        """
+        Create a new element block from the template with the given parameter values.
+
+        Args:
+            values (dict): Mapping from parameter tag to the user value.
+
+        Returns:
+            ET.Element: The new element block.
+
+        Raises:
+            ValueError: If a tag is not a parameter of this method or a value is invalid.
+        """
+        element = copy.deepcopy(self.template)
+        if values:
+            parameters = element.find("parameters")
+            params = {}
+            if parameters is not None:
+                params = {param.attrib.get("tag"): param for param in parameters}
+            for tag, value in values.items():
+                if tag not in self.setters:
+                    raise ValueError(
+                        f"'{tag}' is not a parameter of '{self.name}', available parameters are: {list(self.setters.keys())}"
+                    )
+                setter, choices = self.setters[tag]
+                try:
+                    setter(params[tag], value, choices)
+                except ValueError as e:
+                    raise ValueError(f"{self.name} {tag}: {e}") from e
+        return element
+
+    def values_from_row(self, row) -> dict:
+        """
+        Collect the parameter values of this method from a sequence table row.
+        A column is used when its header matches a parameter tag or description (case-insensitive), empty cells are skipped.
+        """
+        values = {}
+        for column, value in row.items():
+            if not isinstance(column, str):
+                continue
+            tag = self.column_to_tag.get(column.strip().lower())
+            if tag is None or value is None or value != value or str(value) == "":
+                continue
+            values[tag] = value
+        return values
+
+
+def compile_method_registry(xml_paths) -> dict[str, GamryMethod]:
+    """
+    Scan sequencer XML files and compile every element block into a GamryMethod.
+
+    Args:
+        xml_paths (Iterable[str]): Paths of the sequencer XML files, earlier files take precedence.
+
+    Returns:
+        dict[str, GamryMethod]: Mapping from the method name to the compiled method.
+    """
+    registry = {}
+    for xml_path in xml_paths:
+        root = ET.parse(xml_path).getroot()
+        for element in root.iter("element"):
+            name = element.findtext("name")
+            if name is None or name in registry:
+                continue
+            registry[name] = GamryMethod.from_element(element)
+    return registry
+
+
+def sources_signature(xml_paths) -> list:
+    """The cache key of the sources: absolute path, modification time and size of each file."""
+    signature = []
+    for xml_path in xml_paths:
+        stat = os.stat(xml_path)
+        signature.append([os.path.abspath(xml_path), stat.st_mtime_ns, stat.st_size])
+    return signature
+
+
+@functools.lru_cache(maxsize=None)
+def load_method_registry(
+    xml_paths: tuple[str, ...], cache_path: str | None = None
+) -> dict[str, GamryMethod]:
+    """
+    Load the compiled method registry, once per process.
+    The compiled registry is cached to `cache_path` as JSON and rebuilt when any of the source files change.
+
+    Args:
+        xml_paths (tuple[str, ...]): Paths of the sequencer XML files, earlier files take precedence.
+        cache_path (str | None): Path of the JSON cache file, None to disable the disk cache.
+
+    Returns:
+        dict[str, GamryMethod]: Mapping from the method name to the compiled method.
+    """
+    signature = sources_signature(xml_paths)
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r") as f:
+                cached = json.load(f)
+            if (
+                cached.get("version") == REGISTRY_VERSION
+                and cached.get("sources") == signature
+            ):
+                return {
+                    data["name"]: GamryMethod.from_dict(data)
+                    for data in cached["methods"]
+                }
+        except Exception as e:
+            logging.error(f"Error loading Gamry method registry cache: {e}")
+
+    registry = compile_method_registry(xml_paths)
+    if cache_path:
+        try:
+            if os.path.dirname(cache_path):
+                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(cache_path, "w") as f:
+                json.dump(
+                    {
+                        "version": REGISTRY_VERSION,
+                        "sources": signature,
+                        "methods": [method.to_dict() for method in registry.values()],
+                    },
+                    f,
+                )
+        except Exception as e:
+            logging.error(f"Error saving Gamry method registry cache: {e}")
+    return registry
+
+
+def find_method(registry: dict[str, GamryMethod], method_name: str) -> GamryMethod:
+    """
+    Look up a method by its name or class name, case-insensitive, e.g. "Open Circuit Potential" or "OCP".
+
+    Raises:
+        ValueError: If the method is not in the registry.
+    """
+    method = registry.get(method_name)
+    if method is not None:
+        return method
+    lowered = method_name.strip().lower()
+    for method in registry.values():
+        if method.name.lower() == lowered or (
+            method.classname and method.classname.lower() == lowered
+        ):
+            return method
+    raise ValueError(f"Unknown method: {method_name}")
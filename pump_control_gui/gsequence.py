@@ -0,0 +1,469 @@
+# other library
+import os
+import copy
+import datetime
+import functools
+import pandas as pd
+import xml.etree.ElementTree as ET
+from gamry_methods import load_method_registry, find_method
+
+if os.name == "nt":
+    METHOD_REGISTRY_CACHE_FILE = os.path.join(
+        str(os.getenv("APPDATA")), "pump_control", "gamry_method_registry.json"
+    )
+else:
+    METHOD_REGISTRY_CACHE_FILE = os.path.join("log", "gamry_method_registry.json")
+
+
+@functools.lru_cache(maxsize=None)
+def load_method_template(template_method_path: str) -> dict[str, ET.Element]:
+    """
+    Parse the methods template XML once per process and index its element blocks by method name.
+
+    Args:
+        template_method_path (str): Path to the template method XML file.
+
+    Returns:
+        dict[str, ET.Element]: Mapping from the element `name` to the element block.
+        When a name appears in several categories, the first occurrence is kept (same as `find`).
+        The cached blocks are shared and must not be modified, use `copy_method_element` instead.
+    """
+    with open(template_method_path, "r") as file:
+        template_method_tree = ET.parse(file)
+    template = {}
+    for element in template_method_tree.getroot().iter("element"):
+        name = element.findtext("name")
+        if name is not None and name not in template:
+            template[name] = element
+    return template
+
+
+def copy_method_element(
+    template: dict[str, ET.Element], method_name: str
+) -> tuple[ET.Element, dict[str, ET.Element]]:
+    """
+    Copy an element block from the template index, with its parameters indexed by `tag`.
+
+    Args:
+        template (dict[str, ET.Element]): The template index returned by `load_method_template`.
+        method_name (str): The `name` of the element block, e.g. "Charge".
+
+    Returns:
+        tuple[ET.Element, dict[str, ET.Element]]: The copied element block and a mapping from tag to parameter.
+
+    Raises:
+        ValueError: If the element block is not found in the template.
+    """
+    template_element = template.get(method_name)
+    if template_element is None:
+        raise ValueError(f"'{method_name}' not found in the methods template.")
+    element = copy.deepcopy(template_element)
+    parameters = element.find("parameters")
+    params_by_tag = {}
+    if parameters is not None:
+        for param in parameters:
+            tag = param.attrib.get("tag")
+            if tag is not None:
+                params_by_tag[tag] = param
+    return element, params_by_tag
+
+
+def set_parameter(params: dict[str, ET.Element], tag: str, **attributes) -> None:
+    """
+    Set attributes on the parameter with the given tag, skip silently if the tag is absent (same as the template).
+
+    Args:
+        params (dict[str, ET.Element]): Parameters indexed by tag, as returned by `copy_method_element`.
+        tag (str): The parameter tag, e.g. "CHARGEMODE".
+        **attributes: Attribute names and values to set, e.g. value="0.01", index="0".
+    """
+    param = params.get(tag)
+    if param is not None:
+        for key, value in attributes.items():
+            param.set(key, value)
+
+
+def wait_for_digital(
+    template: dict[str, ET.Element],
+    DIGIN0: str,
+    DIGIN1: str,
+    DIGIN2: str,
+    DIGIN3: str,
+) -> ET.ElementTree:
+    """
+    Create a 'Wait for Digital In' element block from the template based on user inputs for digital inputs.
+    There are 4 digital inputs, DIGIN0, DIGIN1, DIGIN2, DIGIN3, and we expect user to specify either Low or High for each input.
+    Args:
+        template (dict[str, ET.Element]): The template index returned by `load_method_template`.
+        DIGIN0 (str): User input for Digital Input 0, expected values are 'Low' or 'High'.
+        DIGIN1 (str): User input for Digital Input 1, expected values are 'Low' or 'High'.
+        DIGIN2 (str): User input for Digital Input 2, expected values are 'Low' or 'High'.
+        DIGIN3 (str): User input for Digital Input 3, expected values are 'Low' or 'High'.
+
+    Returns:
+        ET.ElementTree: A new ElementTree with the root being the modified 'Wait for Digital In' element.
+
+    Raises:
+        ValueError: If the 'Wait for Digital In' element block is not found in the template.
+    """
+    wait_for_digital_in, params = copy_method_element(template, "Wait for Digital In")
+
+    # Modify the digital inputs according to user input
+    for tag, user_input in (
+        ("DIGIN0", DIGIN0),
+        ("DIGIN1", DIGIN1),
+        ("DIGIN2", DIGIN2),
+        ("DIGIN3", DIGIN3),
+    ):
+        param = params.get(tag)
+        if param is None or param.tag != "explain_selector":
+            continue
+        # Determine which index corresponds to "High" and "Low"
+        item0 = param.attrib.get("item0")
+        index_high = "0" if item0 == "High" else "1"
+        index_low = "1" if item0 == "High" else "0"
+        # Set the index based on the user input
+        param.set("index", index_high if user_input == "High" else index_low)
+
+    # Create a new ElementTree with the modified element block as the root
+    new_tree = ET.ElementTree(wait_for_digital_in)
+    ET.indent(new_tree)
+    return new_tree
+
+
+def group_data_files(
+    template: dict[str, ET.Element],
+    group_name: str,
+    group_type_index: int = 0,
+    runtime_setup_checked: bool = False,
+) -> ET.ElementTree:
+    """
+    Modify the "Group Data Files" element in the XML template.
+
+    Args:
+        template (dict[str, ET.Element]): The template index returned by `load_method_template`.
+        group_name (str): The value for the `GROUPNAME` parameter.
+        group_type_index (int): The index for the `GROUPTYPE` parameter.
+        runtime_setup_checked (bool): The state (True/False) for `RUNTIMESETUP`.
+
+    Returns:
+        ET.ElementTree: The new tree with the modified "Group Data Files" element.
+    """
+    group_data_files_element, params = copy_method_element(template, "Group Data Files")
+
+    # Modify parameters within the element
+    set_parameter(params, "GROUPTYPE", index=str(group_type_index))
+    set_parameter(params, "GROUPNAME", value=group_name)
+    set_parameter(
+        params, "RUNTIMESETUP", checked="True" if runtime_setup_checked else "False"
+    )
+
+    # Modify the usecount
+    usecount = group_data_files_element.find("usecount")
+    if usecount is not None:
+        usecount.text = "1"
+
+    # Create a new ElementTree with the modified element block as the root
+    new_tree = ET.ElementTree(group_data_files_element)
+    ET.indent(new_tree)
+    return new_tree
+
+
+def charge(
+    template: dict[str, ET.Element],
+    title: str,
+    output: str,
+    capacity: float,
+    cell_type_index: int,
+    working_connection_index: int,
+    expected_max_v: float,
+    charge_mode_value: float,
+    charge_mode_index: int,
+    max_charge_time_index: int,
+    max_charge_time_value: float,
+    sample_time_value: float,
+    charge_stop_at1_index: int,
+    charge_stop_at1_value: float,
+    charge_stop_at2_index: int,
+    charge_stop_at2_value: float,
+    voltage_finish_checked: bool,
+    ir_comp_checked: bool,
+    capacity_variable: str = "None",
+    expected_max_v_variable: str = "None",
+    charge_mode_variable: str = "None",
+    max_charge_time_variable: str = "None",
+    sample_time_variable: str = "None",
+    charge_stop_at1_variable: str = "None",
+    charge_stop_at2_variable: str = "None",
+    voltage_finish_variable: str = "None",
+) -> ET.ElementTree:
+    """
+    Modify the "Charge" element in the XML template.
+
+    Args:
+        template (dict[str, ET.Element]): The template index returned by `load_method_template`.
+        title (str): The value for the `TITLE` parameter (e.g., "PWR Charge 1").
+        output (str): The value for the `OUTPUT` parameter (e.g., "PWRCHARGE 1.DTA").
+        capacity (float): The value for the `CAPACITY` parameter (A-hr).
+        cell_type_index (int): The index for the `CELLTYPE` parameter (0: Half Cell, 1: Full Cell, 2: Both).
+        working_connection_index (int): The index for the `WORKINGCONNECTION` parameter (0: Positive, 1: Negative).
+        expected_max_v (float): The value for the `EXPECTEDMAXV` parameter (e.g., 10.0).
+        charge_mode_value (float): The value for the `CHARGEMODE` parameter (e.g., 0.01).
+        charge_mode_index (int): The index for the `CHARGEMODE` parameter (0: Constant Current, 1: Capacity * N, 2: Capacity / N).
+        max_charge_time_index (int): The index for the `MAXCHARGETIME` parameter (0: Seconds, 1: Minutes, 2: Hours, 3: Days).
+        max_charge_time_value (float): The value for the `MAXCHARGETIME` parameter.
+        sample_time_value (float): The value for the `SAMPLETIME` parameter (e.g., 10.0).
+        charge_stop_at1_index (int): The index for the `CHARGESTOPAT1` parameter.
+        charge_stop_at1_value (float): The value for the `CHARGESTOPAT1` parameter.
+        charge_stop_at2_index (int): The index for the `CHARGESTOPAT2` parameter.
+        charge_stop_at2_value (float): The value for the `CHARGESTOPAT2` parameter.
+        voltage_finish_checked (bool): Whether the `VOLTAGEFINISH` parameter is checked.
+        ir_comp_checked (bool): Whether the `IRCOMP` parameter is checked.
+        voltage_finish_variable (str): Variable for `VOLTAGEFINISH`.
+        capacity_variable (str): Variable for `CAPACITY`.
+        charge_mode_variable (str): Variable for `CHARGEMODE`.
+        max_charge_time_variable (str): Variable for `MAXCHARGETIME`.
+        sample_time_variable (str): Variable for `SAMPLETIME`.
+        charge_stop_at1_variable (str): Variable for `CHARGESTOPAT1`.
+        charge_stop_at2_variable (str): Variable for `CHARGESTOPAT2`.
+
+    Returns:
+        ET.ElementTree: The new tree with the modified "Charge" element.
+    """
+    charge_element, params = copy_method_element(template, "Charge")
+
+    # Modify parameters within the element
+    set_parameter(params, "TITLE", value=title)
+    set_parameter(params, "OUTPUT", value=output)
+    set_parameter(params, "CAPACITY", value=str(capacity), variable=capacity_variable)
+    set_parameter(params, "CELLTYPE", index=str(cell_type_index))
+    set_parameter(params, "WORKINGCONNECTION", index=str(working_connection_index))
+    set_parameter(
+        params,
+        "EXPECTEDMAXV",
+        value=str(expected_max_v),
+        variable=expected_max_v_variable,
+    )
+    set_parameter(
+        params,
+        "CHARGEMODE",
+        value=str(charge_mode_value),
+        index=str(charge_mode_index),
+        variable=charge_mode_variable,
+    )
+    set_parameter(
+        params,
+        "MAXCHARGETIME",
+        index=str(max_charge_time_index),
+        value=str(max_charge_time_value),
+        variable=max_charge_time_variable,
+    )
+    set_parameter(
+        params,
+        "SAMPLETIME",
+        value=str(sample_time_value),
+        variable=sample_time_variable,
+    )
+    set_parameter(
+        params,
+        "CHARGESTOPAT1",
+        index=str(charge_stop_at1_index),
+        value=str(charge_stop_at1_value),
+        variable=charge_stop_at1_variable,
+    )
+    set_parameter(
+        params,
+        "CHARGESTOPAT2",
+        index=str(charge_stop_at2_index),
+        value=str(charge_stop_at2_value),
+        variable=charge_stop_at2_variable,
+    )
+    set_parameter(
+        params,
+        "VOLTAGEFINISH",
+        checked="True" if voltage_finish_checked else "False",
+        variable=voltage_finish_variable,
+    )
+    set_parameter(params, "IRCOMP", checked="True" if ir_comp_checked else "False")
+
+    # Create a new ElementTree with the modified element block as the root
+    new_tree = ET.ElementTree(charge_element)
+    ET.indent(new_tree)
+    return new_tree
+
+
+def delay(
+    template: dict[str, ET.Element],
+    delay_value: float,
+    delay_style_index: int,
+    delay_variable: str = "None",
+) -> ET.ElementTree:
+    """
+    Modify the "Delay" element in the XML template.
+
+    Args:
+        template (dict[str, ET.Element]): The template index returned by `load_method_template`.
+        delay_value (float): The value for the `DELAY` parameter (e.g., 9.58).
+        delay_style_index (int): The index for the `DELAYSTYLE` parameter (0: Hours, 1: Minutes, 2: Seconds).
+        delay_variable (str): Variable for the `DELAY` parameter.
+
+    Returns:
+        ET.ElementTree: The new tree with the modified "Delay" element.
+    """
+    delay_element, params = copy_method_element(template, "Delay")
+
+    # Modify parameters within the element
+    set_parameter(params, "DELAY", value=f"{delay_value:.2f}", variable=delay_variable)
+    set_parameter(params, "DELAYSTYLE", index=str(delay_style_index))
+
+    # Create a new ElementTree with the modified element block as the root
+    new_tree = ET.ElementTree(delay_element)
+    ET.indent(new_tree)
+    return new_tree
+
+
+def extract_eChem_sequence(recipe_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Extract the EChem sequence from a recipe DataFrame, that is every column from the "Echem Steps" anchor onwards.
+
+    Args:
+        recipe_df (pd.DataFrame): The recipe as read from the recipe file.
+
+    Returns:
+        pd.DataFrame: The EChem sequence, rows with an empty "Echem Steps" cell are dropped.
+
+    Raises:
+        ValueError: If the recipe has no "Echem Steps" column.
+    """
+    echem_headers = [
+        (col_idx, cell)
+        for col_idx, cell in enumerate(recipe_df.columns)
+        if isinstance(cell, str) and "echem steps" in cell.lower()
+    ]
+    if not echem_headers:
+        raise ValueError("The recipe does not contain an 'Echem Steps' column.")
+    echem_header_col_idx, echem_header = echem_headers[0]
+    eChem_sequence_df = recipe_df.iloc[:, echem_header_col_idx:]
+    # drop rows where echem_header has NaN or empty string
+    eChem_sequence_df = eChem_sequence_df.dropna(axis=0, subset=[echem_header])
+    eChem_sequence_df = eChem_sequence_df.drop(
+        eChem_sequence_df[eChem_sequence_df[echem_header] == ""].index,
+    )
+    return eChem_sequence_df.reset_index(drop=True)
+
+
+def generate_gsequence(
+    df, template_method_path, method_xml_paths=None
+) -> ET.ElementTree | None:
+    """
+    Generate GSequence XML from the provided DataFrame and template method XML.
+    Besides the built-in steps below, any method of the sequencer XML files can be referenced by its name
+    or class name (e.g. "Open Circuit Potential" or "OCP"), its parameters are read from the columns named
+    after the parameter tag or description, see `gamry_methods.GamryMethod.values_from_row`.
+
+    Args:
+        df (pd.DataFrame): DataFrame containing the methods to be included in the GSequence.
+        template_method_path (str): Path to the template method XML file.
+        method_xml_paths (list[str] | None): Sequencer XML files for the method registry, default to the template only.
+
+    Returns:
+        ET.ElementTree: The generated GSequence XML tree.
+    """
+    # Parse the template method XML file once, every step copies its block from the index
+    template_method = load_method_template(template_method_path)
+    steps_header = df.columns[0]  # Get the first column name
+    # Create the root element
+    new_method_root = ET.Element("GamrySequence")
+    name_tag = ET.SubElement(new_method_root, "name")
+    name_tag.text = "Gamry Sequence"
+    version_tag = ET.SubElement(new_method_root, "version")
+    version_tag.text = "7.10.3.14563"
+    charge_counter = 1  # filename counter for the output data files
+    for _, row in df.iterrows():  # Add methods to the sequence
+        method_name = row[steps_header]
+        if method_name == "wait_for_digital":
+            # "Wait for Digital In" method, hardcoded to wait for all inputs to be low
+            method_tree = wait_for_digital(
+                template_method,
+                DIGIN0="Low",
+                DIGIN1="Low",
+                DIGIN2="Low",
+                DIGIN3="Low",
+            )
+            new_method_root.append(method_tree.getroot())
+        elif method_name == "group_data_files":
+            # Add "Group Data Files" method
+            date_string = datetime.datetime.now().strftime("%Y-%m-%d")
+            method_tree = group_data_files(
+                template=template_method,
+                group_name=f"{date_string} Auto Echem Sequence",
+                group_type_index=0,
+                runtime_setup_checked=False,
+            )
+            new_method_root.append(method_tree.getroot())
+
+        elif method_name == "charge":
+            reaction_charge = float(row.get("Reaction Charge (mA h)", "None"))
+            current = float(row.get("Current (A)", "None"))
+            working_connection = row.get("Working Connection", "None")
+            if (
+                reaction_charge == "None"
+                or current == "None"
+                or working_connection == "None"
+            ):
+                raise ValueError(
+                    "Missing at least one required values for charge method: "
+                    "'Reaction Charge (mA h)', 'Current (A)', or 'Working Connection'."
+                )
+            # Add "Charge" method
+            method_tree = charge(
+                template=template_method,
+                title=f"PWR Charge {charge_counter}",
+                output=f"PWRCHARGE {charge_counter}.DTA",
+                capacity=10,
+                cell_type_index=1,
+                working_connection_index=1
+                if "negative" in working_connection.lower()
+                else 0,
+                expected_max_v=10.0,
+                charge_mode_value=current,
+                charge_mode_index=0,
+                max_charge_time_index=3,
+                max_charge_time_value=2.0,
+                sample_time_value=10.0,
+                charge_stop_at1_index=7,
+                charge_stop_at1_value=reaction_charge,
+                charge_stop_at2_index=0,
+                charge_stop_at2_value=0,
+                voltage_finish_checked=False,
+                ir_comp_checked=False,
+            )
+            new_method_root.append(method_tree.getroot())
+            charge_counter += 1
+
+        elif method_name == "delay":
+            delay_value = float(row.get("Delays", "None"))
+            if delay_value == "None":
+                raise ValueError("Missing required value for delay method: 'Delays'.")
+            # Add "Delay" method
+            method_tree = delay(
+                template=template_method,
+                delay_value=delay_value,
+                delay_style_index=1,
+                delay_variable="None",
+            )
+            new_method_root.append(method_tree.getroot())
+
+        else:
+            # any other method from the sequencer XML files
+            registry = load_method_registry(
+                tuple(method_xml_paths or [template_method_path]),
+                METHOD_REGISTRY_CACHE_FILE,
+            )
+            method = find_method(registry, str(method_name))
+            new_method_root.append(method.build(method.values_from_row(row)))
+
+    # Create a new XML tree and return it
+    new_method_tree = ET.ElementTree(new_method_root)
+    ET.indent(new_method_root)
+    return new_method_tree
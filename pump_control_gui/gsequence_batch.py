@@ -0,0 +1,229 @@
+"""
+Batch GSequence generation.
+
+Convert every DOE run of a workbook, or every recipe of a directory, into a .GSequence file in parallel.
+Each sheet containing an "Echem Steps" column is one run, for recipe exported by the GUI template only the
+"Do Not Edit (Export Settings)" sheet is used (same as Load Recipe in the GUI).
+
+Usage:
+    python gsequence_batch.py DOE_runs.xlsx -o sequences
+    python gsequence_batch.py recipes_folder another_recipe.csv -j 4
+"""
+
+# other library
+import os
+import sys
+import glob
+import time
+import logging
+import argparse
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from gsequence import (
+    load_method_template,
+    extract_eChem_sequence,
+    generate_gsequence,
+    METHOD_REGISTRY_CACHE_FILE,
+)
+from gamry_methods import load_method_registry
+
+EXPORT_SHEET_NAME = "Do Not Edit (Export Settings)"
+RECIPE_EXTENSIONS = (".csv", ".xlsx", ".xls")
+XMLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "xmls")
+
+
+def find_jobs(inputs: list[str]) -> list[tuple[str, str | None]]:
+    """
+    Expand the input files and directories into a list of (file_path, sheet_name) jobs.
+    CSV files have a single job with sheet_name None.
+    """
+    file_paths = []
+    for input_path in inputs:
+        if os.path.isdir(input_path):
+            for file_path in sorted(glob.glob(os.path.join(input_path, "*"))):
+                # skip the temporary lock files of Excel
+                if file_path.lower().endswith(
+                    RECIPE_EXTENSIONS
+                ) and not os.path.basename(file_path).startswith("~$"):
+                    file_paths.append(file_path)
+        elif os.path.isfile(input_path):
+            file_paths.append(input_path)
+        else:
+            raise FileNotFoundError(f"No such file or directory: {input_path}")
+
+    jobs = []
+    for file_path in file_paths:
+        if file_path.lower().endswith(".csv"):
+            jobs.append((file_path, None))
+            continue
+        sheet_names = pd.ExcelFile(file_path).sheet_names
+        if EXPORT_SHEET_NAME in sheet_names:
+            jobs.append((file_path, EXPORT_SHEET_NAME))
+        else:
+            jobs.extend((file_path, str(sheet_name)) for sheet_name in sheet_names)
+    return jobs
+
+
+def output_path_for(
+    file_path: str, sheet_name: str | None, output_dir: str | None
+) -> str:
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    if sheet_name is not None and sheet_name != EXPORT_SHEET_NAME:
+        stem = f"{stem} - {sheet_name}"
+    directory = (
+        output_dir if output_dir else os.path.dirname(os.path.abspath(file_path))
+    )
+    return os.path.join(directory, f"{stem}.GSequence")
+
+
+def init_worker(template_method_path: str, method_xml_paths: tuple[str, ...]) -> None:
+    """Parse the template and load the method registry once per worker process."""
+    load_method_template(template_method_path)
+    load_method_registry(method_xml_paths, METHOD_REGISTRY_CACHE_FILE)
+
+
+def convert_job(
+    file_path: str,
+    sheet_name: str | None,
+    output_path: str,
+    template_method_path: str,
+    method_xml_paths: tuple[str, ...],
+) -> tuple[int, float] | None:
+    """
+    Convert one run to a .GSequence file.
+
+    Returns:
+        tuple[int, float] | None: The number of sequence steps and the conversion time in seconds,
+        None if the sheet has no "Echem Steps" column.
+    """
+    start_time = time.perf_counter()
+    if sheet_name is None:
+        recipe_df = pd.read_csv(file_path, keep_default_na=False, dtype=object)
+    else:
+        recipe_df = pd.read_excel(
+            file_path, sheet_name=sheet_name, keep_default_na=False, dtype=object
+        )
+    if not any(
+        isinstance(column, str) and "echem steps" in column.lower()
+        for column in recipe_df.columns
+    ):
+        return None  # not a run, e.g. a notes sheet of the workbook
+    eChem_sequence_df = extract_eChem_sequence(recipe_df)
+    if eChem_sequence_df.empty:
+        raise ValueError("The EChem sequence is empty.")
+    new_method_tree = generate_gsequence(
+        df=eChem_sequence_df,
+        template_method_path=template_method_path,
+        method_xml_paths=list(method_xml_paths),
+    )
+    new_method_tree.write(output_path, encoding="utf-8", xml_declaration=True)  # type: ignore
+    return len(eChem_sequence_df), time.perf_counter() - start_time
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Convert the EChem sequences of DOE workbooks or recipe files into .GSequence files in parallel."
+    )
+    parser.add_argument(
+        "inputs", nargs="+", help="Workbooks, CSV recipes or directories of recipes."
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        default=None,
+        help="Directory for the .GSequence files, default to next to each input file.",
+    )
+    parser.add_argument(
+        "-t",
+        "--template",
+        default=os.path.join(XMLS_DIR, "combined_sequencer_methods.xml"),
+        help="Path to the template method XML file.",
+    )
+    parser.add_argument(
+        "-x",
+        "--xml-dir",
+        default=XMLS_DIR,
+        help="Directory of the sequencer XML files for the method registry.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of worker processes, default to the number of CPU cores.",
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s: %(message)s")
+
+    template_method_path = args.template
+    method_xml_paths = tuple(sorted(glob.glob(os.path.join(args.xml_dir, "*.xml"))))
+    if not method_xml_paths:
+        method_xml_paths = (template_method_path,)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    start_time = time.perf_counter()
+    jobs = find_jobs(args.inputs)
+    if not jobs:
+        logging.error("No recipe found in the inputs.")
+        return 1
+    # compile the registry once here so the workers only read the disk cache
+    load_method_registry(method_xml_paths, METHOD_REGISTRY_CACHE_FILE)
+
+    num_workers = max(1, min(args.jobs, len(jobs)))
+    logging.info(f"Converting {len(jobs)} runs with {num_workers} worker processes.")
+    succeeded = []
+    skipped = []
+    failed = []
+    with ProcessPoolExecutor(
+        max_workers=num_workers,
+        initializer=init_worker,
+        initargs=(template_method_path, method_xml_paths),
+    ) as executor:
+        futures = {}
+        for file_path, sheet_name in jobs:
+            output_path = output_path_for(file_path, sheet_name, args.output_dir)
+            future = executor.submit(
+                convert_job,
+                file_path,
+                sheet_name,
+                output_path,
+                template_method_path,
+                method_xml_paths,
+            )
+            futures[future] = (file_path, sheet_name, output_path)
+        for future in as_completed(futures):
+            file_path, sheet_name, output_path = futures[future]
+            run_name = (
+                file_path if sheet_name is None else f"{file_path} [{sheet_name}]"
+            )
+            try:
+                result = future.result()
+                if result is None:
+                    skipped.append(run_name)
+                    continue
+                num_steps, elapsed = result
+                succeeded.append(elapsed)
+                logging.info(
+                    f"{run_name}: {num_steps} steps -> {output_path} ({elapsed:.3f} s)"
+                )
+            except Exception as e:
+                failed.append((run_name, e))
+                logging.error(f"{run_name}: {e}")
+
+    total_time = time.perf_counter() - start_time
+    logging.info(
+        f"Summary: {len(succeeded)} succeeded, {len(failed)} failed, "
+        f"{len(skipped)} skipped (no 'Echem Steps' column), "
+        f"total {total_time:.3f} s, "
+        f"conversion time {sum(succeeded):.3f} s "
+        f"(mean {sum(succeeded) / len(succeeded) if succeeded else 0:.3f} s, "
+        f"max {max(succeeded, default=0):.3f} s per run)."
+    )
+    for run_name, e in failed:
+        logging.error(f"Failed: {run_name}: {e}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
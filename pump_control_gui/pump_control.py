@@ -12,9 +12,11 @@ from PIL import Image
 # other library
 import os
 import re
+import glob
 import time
 import json
 import logging
+import numpy as np
 import pandas as pd
 from queue import Queue
 from datetime import datetime, timedelta
@@ -36,13 +38,15 @@ from helper_functions import (
     resource_path,
     convert_minutes_to_ns,
     convert_ns_to_timestr,
-    process_pump_actions,
-    generate_gsequence,
+    collect_pump_targets,
+    format_pump_targets,
     get_config,
     save_config,
     setProcessDpiAwareness,
     getScalingFactor,
 )
+from gsequence import generate_gsequence, extract_eChem_sequence
+from dta_reader import DTADirectoryWatcher, DTALiveSeries
 
 pico_vid = 0x2E8A  # Pi Pico vendor ID
 
@@ -97,6 +101,10 @@ class PicoController:
         self.autosampler_rtc_time = "--:--:--"
         self.autosampler_name = "N/A"
         self.autosampler_slots = {}
+        # estimated move times in seconds reported by the autosampler, keyed by (from, to) position
+        self.autosampler_move_estimates = {}
+        # last position reported by the autosampler, None until the first report
+        self.autosampler_position = None
         # instance field for the potentiostat serial port
         self.potentiostat = serial.Serial(timeout=self.timeout)
         self.potentiostat_widget_map = {}
@@ -121,6 +129,12 @@ class PicoController:
         self.pause_duration_ns = 0
         self.scheduled_task = None
 
+        # live data of the Gamry output files in the GSequence save directory
+        self.live_plot_interval_ns = 1 * NANOSECONDS_PER_SECOND
+        self.live_plot_last_ns = -1
+        self.dta_watcher = None
+        self.live_series = DTALiveSeries()
+
         # time stamp for the RTC time query
         self.last_querytime = time.monotonic_ns()
 
@@ -140,6 +154,10 @@ class PicoController:
         except FileExistsError:
             pass
         log_filename = os.path.join("log", f"pump_control_run_{runtime}.log")
+        # edges captured by the potentiostat controller, with their PC time
+        self.capture_filename = os.path.join(
+            "log", f"potentiostat_captures_{runtime}.csv"
+        )
         logging.basicConfig(
             level=logging.INFO,
             format="%(asctime)s: %(message)s [%(funcName)s]",
@@ -488,6 +506,13 @@ class PicoController:
             3,
             self.update_slot_as,
         )
+        self.calibrate_button_as = button(
+            as_mc_frame,
+            "Calibrate",
+            2,
+            4,
+            self.calibrate_as,
+        )
 
         self.create_firmware_update_page(
             self.advanced_settings_view.add("Firmware Update")
@@ -647,6 +672,7 @@ class PicoController:
             sticky="NSEW",
         )
         self.recipe_frame = self.experiment_scheduler_tabview.add("Load Recipe")
+        self.live_data_frame = self.experiment_scheduler_tabview.add("Live Data")
         for (
             b
         ) in self.experiment_scheduler_tabview._segmented_button._buttons_dict.values():
@@ -863,6 +889,129 @@ class PicoController:
         )
         self.end_time_value = label(self.remaining_time_frame, "", 0, 3, sticky="W")
 
+        self.create_live_data_page(self.live_data_frame)
+
+    # the live plot of the voltage and charge in the Gamry output files
+    def create_live_data_page(self, root_frame):
+        self.live_data_label = label(root_frame, "Watching:", 0, 0, sticky="W")
+        self.live_data_value = label(root_frame, "Not running", 0, 1, sticky="W")
+        self.live_plot_canvas = tk.Canvas(
+            root_frame, width=900, height=400, bg="white", highlightthickness=0
+        )
+        self.live_plot_canvas.grid(
+            row=1,
+            column=0,
+            columnspan=2,
+            padx=global_pad_x,
+            pady=global_pad_y,
+            sticky="NSEW",
+        )
+        # the line and axis label items are created once and moved on every update
+        self.live_plot_lines = {
+            "voltage": self.live_plot_canvas.create_line(0, 0, 0, 0, fill="blue"),
+            "charge": self.live_plot_canvas.create_line(0, 0, 0, 0, fill="red"),
+        }
+        self.live_plot_texts = {
+            key: self.live_plot_canvas.create_text(
+                0, 0, text="", fill=color, anchor=anchor, font=(FONT_FAMILY, 9)
+            )
+            for key, color, anchor in [
+                ("voltage_max", "blue", "nw"),
+                ("voltage_min", "blue", "sw"),
+                ("charge_max", "red", "ne"),
+                ("charge_min", "red", "se"),
+                ("time_min", "black", "sw"),
+                ("time_max", "black", "se"),
+            ]
+        }
+
+    def start_live_data(self):
+        """Start tailing the DTA files written to the GSequence save directory from now on."""
+        directory = self.gSquence_save_path_entry.get()
+        self.live_series.clear()
+        self.draw_live_plot()
+        if not directory or not os.path.isdir(directory):
+            self.dta_watcher = None
+            self.live_data_value.configure(text="No GSequence save directory")
+            return
+        self.dta_watcher = DTADirectoryWatcher(directory)
+        self.live_plot_last_ns = -1
+        self.live_data_value.configure(text=directory)
+        logging.info(f"Watching {directory} for Gamry data files.")
+
+    def stop_live_data(self):
+        if self.dta_watcher is not None:
+            self.update_live_data(instant=True)  # pick up the last rows
+            self.dta_watcher = None
+            self.live_data_value.configure(text="Not running")
+
+    def update_live_data(self, instant=False):
+        if self.dta_watcher is None:
+            return
+        if not instant:
+            if time.time_ns() - self.live_plot_last_ns < self.live_plot_interval_ns:
+                return
+        self.live_plot_last_ns = time.time_ns()
+        run_time_s = 0.0
+        if self.start_time_ns != -1:
+            run_time_s = (
+                time.monotonic_ns() - self.start_time_ns - self.pause_duration_ns
+            ) / NANOSECONDS_PER_SECOND
+        num_samples = 0
+        for path, table_name, columns, arrays in self.dta_watcher.poll():
+            num_samples += self.live_series.add(
+                path, table_name, columns, arrays, run_time_s
+            )
+        if num_samples:
+            self.draw_live_plot()
+
+    def draw_live_plot(self):
+        """Scale the buffered samples into the canvas, the cost is bounded by the buffer size."""
+        canvas = self.live_plot_canvas
+        width = max(canvas.winfo_width(), int(canvas.cget("width")))
+        height = max(canvas.winfo_height(), int(canvas.cget("height")))
+        margin = 20
+        if len(self.live_series.time_s) < 2:
+            for line in self.live_plot_lines.values():
+                canvas.coords(line, 0, 0, 0, 0)
+            for text in self.live_plot_texts.values():
+                canvas.itemconfigure(text, text="")
+            return
+        t = np.fromiter(self.live_series.time_s, float)
+        t_min, t_max = t.min(), t.max()
+        xs = margin + (t - t_min) / max(t_max - t_min, 1e-9) * (width - 2 * margin)
+        for key, unit, values in [
+            ("voltage", "V", self.live_series.voltage),
+            ("charge", "mA h", self.live_series.charge_mAh),
+        ]:
+            y = np.fromiter(values, float)
+            y_min, y_max = y.min(), y.max()
+            ys = (height - margin) - (y - y_min) / max(y_max - y_min, 1e-9) * (
+                height - 2 * margin
+            )
+            canvas.coords(
+                self.live_plot_lines[key], np.column_stack((xs, ys)).ravel().tolist()
+            )
+            x = margin if key == "voltage" else width - margin
+            canvas.coords(self.live_plot_texts[f"{key}_max"], x, 2)
+            canvas.itemconfigure(
+                self.live_plot_texts[f"{key}_max"], text=f"{y_max:.4g} {unit}"
+            )
+            canvas.coords(self.live_plot_texts[f"{key}_min"], x, height - margin)
+            canvas.itemconfigure(
+                self.live_plot_texts[f"{key}_min"], text=f"{y_min:.4g} {unit}"
+            )
+        canvas.coords(self.live_plot_texts["time_min"], margin, height - 2)
+        canvas.itemconfigure(
+            self.live_plot_texts["time_min"],
+            text=convert_ns_to_timestr(int(max(t_min, 0) * NANOSECONDS_PER_SECOND)),
+        )
+        canvas.coords(self.live_plot_texts["time_max"], width - margin, height - 2)
+        canvas.itemconfigure(
+            self.live_plot_texts["time_max"],
+            text=convert_ns_to_timestr(int(max(t_max, 0) * NANOSECONDS_PER_SECOND)),
+        )
+
     def create_recipe_sequence_table(self, root_frame, columns=["", "", "", "", ""]):
         self.recipe_table = ttk.Treeview(root_frame, columns=columns, show="headings")
         self.scrollbar = ctk.CTkScrollbar(
@@ -1113,6 +1262,7 @@ class PicoController:
             self.send_command_as()
             self.send_command_po()
             self.update_progress()
+            self.update_live_data()
             self.query_rtc_time()
             self.update_rtc_time_display()
             self.root.after(self.main_loop_interval_ms, self.main_loop)
@@ -1733,6 +1883,8 @@ class PicoController:
                 logging.info(f"Connected to Autosampler at {selected_port}")
                 self.set_as_buttons_state("normal")
                 self.autosampler_send_queue.put("dumpSlotsConfig")
+                # the position is sent by the autosampler during and after each move, it is queried once here
+                self.autosampler_send_queue.put("getPosition")
                 self.query_controller_name(is_Autosampler=True)
             except Exception as e:
                 self.autosampler_widget_map["status_label_sv"].set(
@@ -1759,6 +1911,7 @@ class PicoController:
         self.goto_position_button_as.configure(state=state)
         self.stop_movement_button_as.configure(state=state)
         self.set_position_button_as.configure(state=state)
+        self.calibrate_button_as.configure(state=state)
 
         self.slot_combobox_as.configure(state=state)
         self.goto_slot_button_as.configure(state=state)
@@ -1856,7 +2009,6 @@ class PicoController:
                     self.pc_send_queue.put(f"{id}:0:time")
             if self.autosampler.is_open:
                 self.autosampler_send_queue.put("time")
-                self.autosampler_send_queue.put("getPosition")
             if self.potentiostat.is_open:
                 self.potentiostat_send_queue.put("0:time")
             self.last_querytime = current_time
@@ -2064,17 +2216,162 @@ class PicoController:
             status_str = status_str[:-2]
             self.current_trigger_state_value_po.configure(text=status_str)
 
+    def parse_potentiostat_captures(self, response) -> None:
+        # format Captures: now <ticks_us>, count <n>, dropped <n>: <time_us>,<pin>,<old>,<new>,<command>;...
+        # the PC time of an edge is the reception time minus its age relative to "now"
+        received = datetime.now()
+        match = re.search(
+            r"Captures: now (\d+), count \d+, dropped (\d+):(.*)", response
+        )
+        if not match:
+            logging.error(
+                f"Failed to parse potentiostat captures from response: {response}"
+            )
+            return
+        now = int(match.group(1))
+        dropped = int(match.group(2))
+        if dropped:
+            logging.warning(f"Potentiostat: {dropped} captured edges were dropped.")
+        edges = [edge for edge in match.group(3).strip().split(";") if edge]
+        if not edges:
+            return
+        new_file = not os.path.exists(self.capture_filename)
+        with open(self.capture_filename, "a") as f:
+            if new_file:
+                f.write("pc_time,ticks_us,pin,old,new,command\n")
+            for edge in edges:
+                time_us, pin, old, new, command = edge.split(",")
+                # time.ticks_us() wraps every 2^30 us on the Pico
+                age_us = (now - int(time_us)) & 0x3FFFFFFF
+                pc_time = received - timedelta(microseconds=age_us)
+                f.write(
+                    f"{pc_time.isoformat(timespec='microseconds')},{time_us},{pin},{old},{new},{command}\n"
+                )
+
     def parse_autosampler_position(self, response) -> None:
         # format INFO: Current position: <position>
         match = re.search(r"position: (\d+)", response)
         if match:
             current_position = match.group(1)
+            self.autosampler_position = int(current_position)
             self.current_position_value_as.configure(text=f"{current_position}")
         else:
             logging.error(
                 f"Failed to parse autosampler position from response: {response}"
             )
 
+    def parse_autosampler_estimate(self, response) -> None:
+        # format INFO: Estimate: from <position> to <position>, steps <steps>, time <ms> ms
+        match = re.search(r"from (\d+) to (\d+), steps \d+, time (\d+) ms", response)
+        if match:
+            start, end, time_ms = (int(value) for value in match.groups())
+            self.autosampler_move_estimates[(start, end)] = time_ms / 1000
+        else:
+            logging.error(
+                f"Failed to parse autosampler estimate from response: {response}"
+            )
+
+    def estimate_move_time_as(self, start, end):
+        """Return the estimated time in seconds of an autosampler move between two positions.
+
+        The estimate comes from the time model calibrated on the autosampler, it is queried on the first call
+        and None is returned until the reply has been received.
+        """
+        key = (int(start), int(end))
+        if key not in self.autosampler_move_estimates and self.autosampler.is_open:
+            self.autosampler_send_queue.put(f"estimate:{key[0]}:{key[1]}")
+        return self.autosampler_move_estimates.get(key)
+
+    def autosampler_targets(self, row) -> list:
+        """Return the autosampler moves of a recipe row in the order execute_actions sends them.
+
+        Each move is ("slot", name) or ("position", value), slots first, as the slot names can be numbers. The
+        comma-separated slots of a visit are left out, their order is planned by the autosampler.
+        """
+        targets = []
+        for kind, pattern in (
+            ("slot", r"^(?!.*position).*Autosampler.*(slot)?$"),
+            ("position", r"^(?!.*slot).*Autosampler.*(position)$"),
+        ):
+            for col in row.index:
+                if re.search(pattern, col, re.IGNORECASE):
+                    value = row[col]
+                    if pd.isna(value) or value == "" or "," in str(value):
+                        continue
+                    targets.append((kind, str(value)))
+        return targets
+
+    def target_position_as(self, kind, value):
+        """Return the position of a move from autosampler_targets, None when the slot or position is invalid."""
+        if kind == "slot":
+            position = self.autosampler_slots.get(value)
+            return None if position is None else int(position)
+        return int(value) if value.isdigit() else None
+
+    def move_time_as(self, start, targets):
+        """Return the estimated time in seconds of the moves to targets from the position start and the end position.
+
+        The time is None when an estimate is missing, the missing estimates are queried so a later call can return
+        it, and both are None when a target is invalid.
+        """
+        total = 0
+        missing = False
+        for kind, value in targets:
+            end = self.target_position_as(kind, value)
+            if end is None:
+                return None, None
+            estimate = self.estimate_move_time_as(start, end)
+            if estimate is None:
+                missing = True
+            else:
+                total += estimate
+            start = end
+        return (None if missing else total), start
+
+    def prefetch_move_times_as(self):
+        """Query the estimates of all autosampler moves of the recipe before it runs."""
+        if not self.autosampler.is_open or self.autosampler_position is None:
+            return
+        position = self.autosampler_position
+        for _, row in self.recipe_df.iterrows():
+            targets = self.autosampler_targets(row)
+            if not targets:
+                continue
+            _, position = self.move_time_as(position, targets)
+            if position is None:
+                return
+
+    def check_move_time_as(self, index, row):
+        """Warn when the autosampler moves of a step are estimated to take longer than the time to the next step."""
+        targets = self.autosampler_targets(row)
+        if (
+            not targets
+            or self.autosampler_position is None
+            or index + 1 >= len(self.recipe_df)
+        ):
+            return
+        move_time, _ = self.move_time_as(self.autosampler_position, targets)
+        if move_time is None:
+            return
+        next_time_ns = convert_minutes_to_ns(
+            float(self.recipe_df.iloc[index + 1].iloc[self.recipe_df_time_header_index])
+        )
+        elapsed_time_ns = (
+            time.monotonic_ns() - self.start_time_ns - self.pause_duration_ns
+        )
+        available = (next_time_ns - elapsed_time_ns) / NANOSECONDS_PER_SECOND
+        if move_time > available:
+            logging.warning(
+                f"The autosampler moves of step {index} take about {move_time:.1f} s, the next step starts in {available:.1f} s."
+            )
+
+    def calibrate_as(self, distances=None):
+        """Run the move time calibration of the autosampler from its current position."""
+        if self.autosampler.is_open:
+            command = "calibrate" if distances is None else f"calibrate:{distances}"
+            self.autosampler_send_queue.put(command)
+            logging.info(f"Autosampler command sent: {command}")
+
     def update_rtc_time_display(self) -> None:
         try:
             # sort the keys of the dictionary by the pump id, join the values and update the label
@@ -2340,6 +2637,15 @@ class PicoController:
                 f"Trying to toggle direction for pump {pump_id} without a controller."
             )
 
+    # set the power and direction of several pumps of a controller with one batch command,
+    # the controller switches them together and replies with their status
+    def set_pumps(self, controller_id, targets):
+        serial_obj = self.pc.get(controller_id, None)
+        if serial_obj and serial_obj.is_open:
+            self.pc_send_queue.put(
+                f"{controller_id}:0:batch:{format_pump_targets(targets)}"
+            )
+
     def register_pump(
         self,
         controller_id,
@@ -2527,6 +2833,7 @@ class PicoController:
             if self.scheduled_task:
                 self.root.after_cancel(self.scheduled_task)
                 self.scheduled_task = None
+            self.stop_live_data()
             self.start_time_ns = -1
             self.total_procedure_time_ns = -1
             self.current_index = -1
@@ -2785,6 +3092,11 @@ class PicoController:
                         self.parse_autosampler_config(response)
                     elif "INFO: Current position: " in response:
                         self.parse_autosampler_position(response)
+                    elif "INFO: Estimate: " in response:
+                        self.parse_autosampler_estimate(response)
+                    elif "Info: Calibration: samples" in response:
+                        # the time model changed, the estimates are queried again
+                        self.autosampler_move_estimates.clear()
                     elif "RTC Time:" in response:
                         self.parse_rtc_time(
                             controller_id=None, response=response, is_Autosampler=True
@@ -2834,6 +3146,8 @@ class PicoController:
                         self.parse_potentiostat_config(response)
                     if "Status:" in response:
                         self.parse_potentiostat_status(response)
+                    elif "Captures:" in response:
+                        self.parse_potentiostat_captures(response)
                     elif "RTC Time:" in response:
                         self.parse_rtc_time(
                             controller_id=None,
@@ -2902,7 +3216,11 @@ class PicoController:
                 if slot is None:
                     slot = self.slot_combobox_as.get().strip()
                 if slot:
-                    command = f"moveToSlot:{slot}"
+                    # several slots separated by commas are visited in the order with the least travel time
+                    if "," in slot:
+                        command = f"visit:{slot}"
+                    else:
+                        command = f"moveToSlot:{slot}"
                     self.autosampler_send_queue.put(command)
             except Exception as e:
                 logging.error(f"Error: {e}")
@@ -2933,6 +3251,7 @@ class PicoController:
                 if position and position.isdigit():
                     command = f"setPosition:{position}"
                     self.autosampler_send_queue.put(command)
+                    self.autosampler_send_queue.put("getPosition")
                     logging.info(f"Autosampler command sent: {command}")
                 else:
                     non_blocking_messagebox(
@@ -3228,11 +3547,10 @@ class PicoController:
                     for col_idx, cell in enumerate(temp_df.columns)
                     if isinstance(cell, str) and "echem steps" in cell.lower()
                 ]
-                echem_header_col_idx, echem_header = echem_headers[0]
+                echem_header_col_idx, _ = echem_headers[0]
 
                 # Split the dataframe until echem_header_col_idx, that is the recipe data
                 self.recipe_df = temp_df.iloc[:, 0:echem_header_col_idx]
-                self.eChem_sequence_df = temp_df.iloc[:, echem_header_col_idx:]
                 # drop rows where time column has NaN
                 self.recipe_df = self.recipe_df.dropna(axis=0, subset=[recipe_header])
                 self.recipe_df = self.recipe_df.drop(
@@ -3240,16 +3558,7 @@ class PicoController:
                 )
                 self.recipe_df = self.recipe_df.reset_index(drop=True)
 
-                # drop tows where echem_header has NaN or empty string
-                self.eChem_sequence_df = self.eChem_sequence_df.dropna(
-                    axis=0, subset=[echem_header]
-                )
-                self.eChem_sequence_df = self.eChem_sequence_df.drop(
-                    self.eChem_sequence_df[
-                        self.eChem_sequence_df[echem_header] == ""
-                    ].index,
-                )
-                self.eChem_sequence_df = self.eChem_sequence_df.reset_index(drop=True)
+                self.eChem_sequence_df = extract_eChem_sequence(temp_df)
                 # convert the time column to float
                 self.recipe_df[recipe_header] = self.recipe_df[recipe_header].apply(
                     float
@@ -3470,6 +3779,9 @@ class PicoController:
             # record start time
             self.start_time_ns = time.monotonic_ns() - self.pause_duration_ns
             self.current_index = 0
+            self.start_live_data()
+            # the move time estimates are cached before the steps check their timing
+            self.prefetch_move_times_as()
             self.execute_procedure()
         except Exception as e:
             # stop the procedure if an error occurs
@@ -3555,6 +3867,8 @@ class PicoController:
             for id, connection_status in self.pc_connected.items():
                 if connection_status:
                     self.update_status(controller_id=id)
+            if self.autosampler.is_open:
+                self.check_move_time_as(index, row)
             self.execute_actions(
                 index,
                 pump_actions,
@@ -3580,24 +3894,22 @@ class PicoController:
         auto_sampler_actions_positions,
         potentiostat_actions,
     ):
-        # Process power toggling
-        process_pump_actions(
-            pumps=self.pumps,
-            index=index,
-            actions=pump_actions,
-            action_type="power",
-            status_key="power_status",
-            toggle_function=self.toggle_power,
-        )
-        # Process direction toggling
-        process_pump_actions(
+        # Process power and direction, one batch command per controller
+        targets = collect_pump_targets(
             pumps=self.pumps,
             index=index,
-            actions=valve_actions,
-            action_type="direction",
-            status_key="direction_status",
-            toggle_function=self.toggle_direction,
-        )
+            power_actions=pump_actions,
+            direction_actions=valve_actions,
+        )
+        controller_targets = {}
+        for pump_id, statuses in targets.items():
+            controller_id = self.pump_ids_to_controller_ids.get(pump_id, None)
+            if controller_id:
+                controller_targets.setdefault(controller_id, {})[pump_id] = statuses
+            else:
+                logging.error(f"Trying to set pump {pump_id} without a controller.")
+        for controller_id, pump_targets in controller_targets.items():
+            self.set_pumps(controller_id, pump_targets)
 
         for _, slot in auto_sampler_actions_slots.items():
             if pd.isna(slot) or slot == "":
@@ -3625,9 +3937,9 @@ class PicoController:
             elif action.lower() == "off":
                 self.set_trigger_po(state="low")
 
-        # update status for all pumps and autosampler
+        # update status for the other controllers, the batch reply carries the status of the switched pumps
         for id, connection_status in self.pc_connected.items():
-            if connection_status:
+            if connection_status and id not in controller_targets:
                 self.update_status(controller_id=id)
         self.execute_procedure(index + 1)
 
@@ -3915,6 +4227,9 @@ class PicoController:
                 template_method_path=resource_path(
                     os.path.join("xmls", "combined_sequencer_methods.xml")
                 ),
+                method_xml_paths=sorted(
+                    glob.glob(resource_path(os.path.join("xmls", "*.xml")))
+                ),
             )
             if new_method_tree is not None:
                 non_blocking_messagebox(